@@ -12,6 +12,9 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Auto-discover tasks
 app.autodiscover_tasks()
 
+# Count tasks in flight for /metrics
+from . import metrics  # noqa: E402,F401
+
 @app.task(bind=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
\ No newline at end of file
@@ -0,0 +1,137 @@
+"""
+Prometheus metrics
+
+Request latency, Celery tasks in flight and encoder throughput are
+recorded where they happen, in gunicorn and Celery worker processes.
+With PROMETHEUS_MULTIPROC_DIR set (see docker-compose.yml) every
+process writes its samples to mmap'ed files in that directory, which
+/metrics aggregates, so recording stays a local memory write.
+
+Queue depth and videos per status are read when /metrics is scraped,
+never on the request path.
+"""
+
+import os
+import time
+
+import redis
+from celery.signals import task_postrun, task_prerun, worker_process_shutdown
+from django.conf import settings
+from django.db.models import Count
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Gauge, Histogram, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'HTTP request latency by URL name',
+    ['view', 'method', 'status'],
+)
+
+TASKS_IN_FLIGHT = Gauge(
+    'celery_tasks_in_flight',
+    'Celery tasks currently executing',
+    ['task'],
+    multiprocess_mode='livesum',
+)
+
+# One label per rendition, never a combination of them. A single FFmpeg
+# run writing several renditions at once (the default single-decode path)
+# observes each of them with the run's whole wall time and shared="true",
+# so per-rendition cost is only exact where shared="false".
+ENCODE_SPEED = Histogram(
+    'video_encode_seconds_per_output_second',
+    'Wall seconds spent encoding per second of output media',
+    ['rendition', 'profile', 'shared'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32),
+)
+
+
+class PrometheusMiddleware:
+    """Time every request, labelled with its URL name, e.g. video-list"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        REQUEST_LATENCY.labels(
+            view=match.view_name if match else 'unmatched',
+            method=request.method,
+            status=response.status_code,
+        ).observe(time.perf_counter() - started)
+        return response
+
+
+def observe_encode(rendition, profile, wall_seconds, media_seconds, shared=False):
+    """Record how long an encode took per second of media it produced"""
+    if media_seconds and media_seconds > 0:
+        ENCODE_SPEED.labels(
+            rendition=rendition, profile=profile, shared=str(shared).lower()
+        ).observe(wall_seconds / media_seconds)
+
+
+@task_prerun.connect
+def task_started(task=None, **kwargs):
+    TASKS_IN_FLIGHT.labels(task=task.name).inc()
+
+
+@task_postrun.connect
+def task_finished(task=None, **kwargs):
+    TASKS_IN_FLIGHT.labels(task=task.name).dec()
+
+
+@worker_process_shutdown.connect
+def worker_process_exited(pid=None, **kwargs):
+    # Drop the live gauges of a pool process that went away
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+class ScrapeTimeCollector:
+    """Gauges that are cheap to read once per scrape but not worth tracking live"""
+
+    def collect(self):
+        yield self.queue_depth()
+        yield self.videos_by_status()
+
+    def queue_depth(self):
+        metric = GaugeMetricFamily('celery_queue_depth', 'Messages waiting in a Celery queue', labels=['queue'])
+        try:
+            client = redis.Redis.from_url(settings.CELERY_BROKER_URL, socket_connect_timeout=1, socket_timeout=1)
+            for queue in (settings.CELERY_FAST_QUEUE, settings.CELERY_BULK_QUEUE):
+                # The Redis transport keeps each queue as a list under its name
+                metric.add_metric([queue], client.llen(queue))
+        except redis.RedisError as e:
+            print(f"Reading Celery queue depth failed: {e}")
+        return metric
+
+    def videos_by_status(self):
+        from videos.models import Video
+
+        metric = GaugeMetricFamily('videos', 'Videos by processing status', labels=['status'])
+        counts = dict(Video.objects.values_list('status').annotate(count=Count('id')).order_by())
+        for status, _ in Video.STATUS_CHOICES:
+            metric.add_metric([status], counts.get(status, 0))
+        return metric
+
+
+def metrics_view(request):
+    """Prometheus exposition of this process, or of every process in multiprocess mode"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    scrape_registry = CollectorRegistry()
+    scrape_registry.register(ScrapeTimeCollector())
+
+    return HttpResponse(
+        generate_latest(registry) + generate_latest(scrape_registry),
+        content_type=CONTENT_TYPE_LATEST,
+    )
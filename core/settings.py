@@ -57,6 +57,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.PrometheusMiddleware',  # first, so latency covers every other middleware
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware', #corsheaders middleware
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -178,6 +179,8 @@ CORS_ALLOW_CREDENTIALS = True
 CORS_EXPOSE_HEADERS = [
     'Content-Type',
     'X-CSRFToken',
+    'ETag',
+    'Last-Modified',
 ]
 
 CORS_ALLOW_METHODS = [
@@ -193,7 +196,10 @@ CORS_ALLOW_HEADERS = [
     'accept',
     'accept-encoding',
     'authorization',
+    'content-range',
     'content-type',
+    'if-modified-since',
+    'if-none-match',
     'dnt',
     'origin',
     'user-agent',
@@ -210,4 +216,130 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 CELERY_TASK_TRACK_STARTED = True
-CELERY_TASK_TIME_LIMIT = 30 * 60
\ No newline at end of file
+CELERY_TASK_TIME_LIMIT = 30 * 60
+
+# Quick pipeline stages (probe, thumbnail, playlists) go to the fast queue
+# so they never wait behind encodes, which go to the bulk queue. Run one
+# worker per queue, see docker-compose.yml.
+CELERY_FAST_QUEUE = config('CELERY_FAST_QUEUE', default='fast')
+CELERY_BULK_QUEUE = config('CELERY_BULK_QUEUE', default='bulk')
+CELERY_TASK_DEFAULT_QUEUE = CELERY_FAST_QUEUE
+CELERY_TASK_ROUTES = {
+    'videos.tasks.process_video': {'queue': CELERY_FAST_QUEUE},
+    'videos.tasks.finalize_video': {'queue': CELERY_FAST_QUEUE},
+    'videos.tasks.flush_view_counts': {'queue': CELERY_FAST_QUEUE},
+    'videos.tasks.dispatch_encodes': {'queue': CELERY_FAST_QUEUE},
+    'videos.tasks.encode_video': {'queue': CELERY_BULK_QUEUE},
+    'videos.tasks.encode_rendition': {'queue': CELERY_BULK_QUEUE},
+    'videos.tasks.encode_chunk': {'queue': CELERY_BULK_QUEUE},
+    'videos.tasks.generate_trickplay': {'queue': CELERY_BULK_QUEUE},
+}
+
+# Encodes run far longer than CELERY_TASK_TIME_LIMIT allows. Past the soft
+# limit the encode is marked failed; the hard limit kills it shortly after.
+VIDEO_ENCODE_TIME_LIMIT = config('VIDEO_ENCODE_TIME_LIMIT', default=3 * 60 * 60, cast=int)  # seconds
+CELERY_TASK_ANNOTATIONS = {
+    task: {'soft_time_limit': VIDEO_ENCODE_TIME_LIMIT, 'time_limit': VIDEO_ENCODE_TIME_LIMIT + 10 * 60}
+    for task in (
+        'videos.tasks.encode_video',
+        'videos.tasks.encode_rendition',
+        'videos.tasks.encode_chunk',
+        'videos.tasks.generate_trickplay',
+    )
+}
+# Redis redelivers unacknowledged tasks after the visibility timeout, so it
+# must outlast the longest acks_late encode or a running encode starts twice
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': VIDEO_ENCODE_TIME_LIMIT + 60 * 60}
+
+# video processing settings
+
+# Decode each upload once and encode every quality from that single FFmpeg run
+VIDEO_SINGLE_PASS_ENCODING = config('VIDEO_SINGLE_PASS_ENCODING', default=True, cast=bool)
+
+# Encode each rendition as its own Celery task so renditions run on separate workers
+VIDEO_PARALLEL_RENDITIONS = config('VIDEO_PARALLEL_RENDITIONS', default=False, cast=bool)
+
+# Cut long sources into keyframe-aligned chunks and encode them in parallel
+VIDEO_CHUNKED_ENCODING = config('VIDEO_CHUNKED_ENCODING', default=False, cast=bool)
+VIDEO_CHUNK_DURATION = config('VIDEO_CHUNK_DURATION', default=300, cast=int)  # seconds
+VIDEO_CHUNK_WORKERS = config('VIDEO_CHUNK_WORKERS', default=0, cast=int)  # 0 = one per CPU
+
+# Segment container: 'ts' (one MPEG-TS file per 10 s segment) or 'fmp4' (one fragmented MP4
+# per rendition, addressed with EXT-X-BYTERANGE, plus a DASH manifest of the same files)
+VIDEO_SEGMENT_FORMAT = config('VIDEO_SEGMENT_FORMAT', default='ts')
+VIDEO_DASH_MANIFEST = config('VIDEO_DASH_MANIFEST', default=True, cast=bool)
+
+# Encode and publish the lowest quality on its own first, so uploads play before the whole ladder is done
+VIDEO_PUBLISH_EARLY = config('VIDEO_PUBLISH_EARLY', default=True, cast=bool)
+
+# A retried encode skips work whose outputs still have their recorded sizes.
+# With checksums it also hashes every output, catching damage that keeps the size.
+VIDEO_CHECKPOINT_CHECKSUMS = config('VIDEO_CHECKPOINT_CHECKSUMS', default=False, cast=bool)
+
+# Scrub preview sprite sheets with a WebVTT index, written by the lowest quality's encode
+VIDEO_TRICKPLAY = config('VIDEO_TRICKPLAY', default=True, cast=bool)
+VIDEO_TRICKPLAY_INTERVAL = config('VIDEO_TRICKPLAY_INTERVAL', default=10, cast=int)  # seconds per preview
+VIDEO_TRICKPLAY_WIDTH = config('VIDEO_TRICKPLAY_WIDTH', default=160, cast=int)  # pixels
+VIDEO_TRICKPLAY_GRID = (10, 10)  # previews per sheet, columns x rows
+
+# Seconds between processing_progress writes while FFmpeg is running
+VIDEO_PROGRESS_SAVE_INTERVAL = config('VIDEO_PROGRESS_SAVE_INTERVAL', default=3, cast=int)
+
+# Live processing state (status, percent, stage, ETA) is kept in Redis for status polling
+REDIS_URL = config('REDIS_URL', default=CELERY_BROKER_URL)
+VIDEO_LIVE_STATUS = config('VIDEO_LIVE_STATUS', default=True, cast=bool)
+VIDEO_LIVE_STATUS_TTL = config('VIDEO_LIVE_STATUS_TTL', default=24 * 60 * 60, cast=int)  # seconds
+
+# Resumable chunked uploads
+VIDEO_UPLOAD_MAX_SIZE = config('VIDEO_UPLOAD_MAX_SIZE', default=20 * 1024 ** 3, cast=int)  # bytes
+VIDEO_UPLOAD_MAX_CHUNK_SIZE = config('VIDEO_UPLOAD_MAX_CHUNK_SIZE', default=8 * 1024 ** 2, cast=int)  # bytes
+
+# Serve /stream/ through nginx: set to its internal location (e.g. /protected-media/)
+# and Django only checks access, returning X-Accel-Redirect instead of the bytes
+VIDEO_STREAM_ACCEL_REDIRECT = config('VIDEO_STREAM_ACCEL_REDIRECT', default='')
+
+# Serialized video payloads are cached in Redis and invalidated on every change.
+# Keep them in a database of their own: cache.clear() flushes the whole one,
+# which must never be the Celery broker's.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('CACHE_URL', default='redis://localhost:6379/1'),
+    }
+}
+VIDEO_CACHE_TIMEOUT = config('VIDEO_CACHE_TIMEOUT', default=60 * 60, cast=int)  # seconds
+
+# Buffered view counts are flushed from Redis to Video.views by celery beat
+VIDEO_VIEW_FLUSH_INTERVAL = config('VIDEO_VIEW_FLUSH_INTERVAL', default=60, cast=int)  # seconds
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_BEAT_SCHEDULE = {
+    'flush-view-counts': {
+        'task': 'videos.tasks.flush_view_counts',
+        'schedule': VIDEO_VIEW_FLUSH_INTERVAL,
+    },
+    'dispatch-encodes': {
+        'task': 'videos.tasks.dispatch_encodes',
+        'schedule': 30,
+    },
+}
+
+# Where uploads get processed: 'celery' (workers), 'inline' (synchronously, for tests) or 'disabled'
+VIDEO_PROCESSING_BACKEND = config('VIDEO_PROCESSING_BACKEND', default='celery')
+# Videos encoded at once across all workers, 0 for no limit
+VIDEO_MAX_CONCURRENT_ENCODES = config('VIDEO_MAX_CONCURRENT_ENCODES', default=2, cast=int)
+# Share of those slots one uploader may hold, 0 for no cap
+VIDEO_MAX_ENCODES_PER_USER = config('VIDEO_MAX_ENCODES_PER_USER', default=1, cast=int)
+# A slot outlives the longest encode, so only dead encodes lose it
+VIDEO_ENCODE_SLOT_TTL = config('VIDEO_ENCODE_SLOT_TTL', default=VIDEO_ENCODE_TIME_LIMIT + 30 * 60, cast=int)  # seconds
+VIDEO_ENCODE_RETRY_DELAY = config('VIDEO_ENCODE_RETRY_DELAY', default=30, cast=int)  # seconds
+
+# Encoding profiles, each overriding videos.profiles.DEFAULT_PROFILE.
+# Videos use their own encoding_profile or else VIDEO_ENCODING_PROFILE.
+VIDEO_ENCODING_PROFILES = {
+    'standard': {},
+    # Quicker turnaround at some cost in size, e.g. for a free tier
+    'fast': {'preset': 'veryfast', 'crf': 23},
+    # Smaller files for the same quality, e.g. for popular or archived content
+    'high': {'preset': 'slow', 'crf': 21},
+}
+VIDEO_ENCODING_PROFILE = config('VIDEO_ENCODING_PROFILE', default='standard')
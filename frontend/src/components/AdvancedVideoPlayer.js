@@ -37,6 +37,10 @@ function AdvancedVideoPlayer({ hlsUrl, currentVideo }) {
   const [showControls, setShowControls] = useState(true);
   const [controlsTimeout, setControlsTimeout] = useState(null);
 
+  // Scrub previews
+  const [previews, setPreviews] = useState([]);
+  const [hoverPreview, setHoverPreview] = useState(null);
+
   // Initialize HLS
   useEffect(() => {
     const video = videoRef.current;
@@ -110,6 +114,25 @@ function AdvancedVideoPlayer({ hlsUrl, currentVideo }) {
     }
   }, [hlsUrl]);
 
+  // Load the scrub preview index: WebVTT cues pointing at sprite sheet tiles
+  useEffect(() => {
+    const trickplayUrl = currentVideo && currentVideo.trickplay_url;
+    setPreviews([]);
+    if (!trickplayUrl) return;
+
+    let cancelled = false;
+    fetch(trickplayUrl)
+      .then((response) => (response.ok ? response.text() : ''))
+      .then((text) => {
+        if (!cancelled) setPreviews(parsePreviews(text, trickplayUrl));
+      })
+      .catch((e) => console.log('Scrub previews unavailable:', e));
+
+    return () => {
+      cancelled = true;
+    };
+  }, [currentVideo && currentVideo.trickplay_url]);
+
   // Video event handlers
   const handleTimeUpdate = () => {
     const video = videoRef.current;
@@ -141,6 +164,17 @@ function AdvancedVideoPlayer({ hlsUrl, currentVideo }) {
     setCurrentTime(time);
   };
 
+  const handleProgressHover = (e) => {
+    if (!previews.length || !duration) return;
+
+    const rect = e.currentTarget.getBoundingClientRect();
+    const fraction = Math.min(Math.max((e.clientX - rect.left) / rect.width, 0), 1);
+    const time = fraction * duration;
+    const preview = previews.find((cue) => time >= cue.start && time < cue.end) || previews[previews.length - 1];
+
+    setHoverPreview({ ...preview, time, left: fraction * 100 });
+  };
+
   const handleVolumeChange = (e) => {
     const vol = parseFloat(e.target.value);
     videoRef.current.volume = vol;
@@ -314,8 +348,31 @@ function AdvancedVideoPlayer({ hlsUrl, currentVideo }) {
 
         {/* Custom Controls */}
         <div className={`video-controls ${showControls ? 'visible' : ''}`}>
+          {/* Scrub Preview */}
+          {hoverPreview && (
+            <div
+              className="seek-preview"
+              style={{ left: `${hoverPreview.left}%`, width: hoverPreview.w }}
+            >
+              <div
+                className="seek-preview-image"
+                style={{
+                  width: hoverPreview.w,
+                  height: hoverPreview.h,
+                  backgroundImage: `url(${hoverPreview.url})`,
+                  backgroundPosition: `-${hoverPreview.x}px -${hoverPreview.y}px`,
+                }}
+              />
+              <span className="seek-preview-time">{formatTime(hoverPreview.time)}</span>
+            </div>
+          )}
+
           {/* Progress Bar */}
-          <div className="progress-container">
+          <div
+            className="progress-container"
+            onMouseMove={handleProgressHover}
+            onMouseLeave={() => setHoverPreview(null)}
+          >
             <div className="progress-buffered" style={{ width: `${buffered}%` }} />
             <div
               className="progress-played"
@@ -517,4 +574,24 @@ function AdvancedVideoPlayer({ hlsUrl, currentVideo }) {
   );
 }
 
+// Parse a WebVTT thumbnail index into { start, end, url, x, y, w, h } cues
+function parsePreviews(text, baseUrl) {
+  const toSeconds = (timestamp) =>
+    timestamp.split(':').reduce((total, part) => total * 60 + parseFloat(part), 0);
+
+  const cues = [];
+  const lines = text.split(/\r?\n/);
+  lines.forEach((line, i) => {
+    if (!line.includes('-->') || !lines[i + 1]) return;
+
+    const [start, end] = line.split('-->').map((part) => toSeconds(part.trim()));
+    const [image, fragment] = lines[i + 1].trim().split('#xywh=');
+    if (!fragment) return;
+
+    const [x, y, w, h] = fragment.split(',').map(Number);
+    cues.push({ start, end, url: new URL(image, baseUrl).href, x, y, w, h });
+  });
+  return cues;
+}
+
 export default AdvancedVideoPlayer;
\ No newline at end of file
@@ -38,9 +38,9 @@ function VideoList({ videos, currentVideoId, onVideoSelect, loading }) {
           <div
             key={video.id}
             className={`video-card ${video.id === currentVideoId ? 'active' : ''} ${
-              video.status !== 'ready' ? 'processing' : ''
+              !video.playable ? 'processing' : ''
             }`}
-            onClick={() => video.status === 'ready' && onVideoSelect(video)}
+            onClick={() => video.playable && onVideoSelect(video)}
           >
             <div className="thumbnail-wrapper">
               {video.thumbnail_url ? (
@@ -68,7 +68,10 @@ function VideoList({ videos, currentVideoId, onVideoSelect, loading }) {
                     {video.status === 'processing' && (
                       <>
                         <div className="spinner-small"></div>
-                        <span>{video.processing_progress}%</span>
+                        <span>
+                          {video.playable ? '▶ Playable · ' : ''}
+                          {video.processing_progress}%
+                        </span>
                       </>
                     )}
                     {video.status === 'pending' && <span>⏳ Pending</span>}
@@ -5,10 +5,15 @@ import VideoList from '../components/VideoList';
 import { videoAPI, authAPI } from '../services/api';
 import './VideoPage.css';
 
+// The list is paginated with an opaque cursor, carried in the `next` URL
+const cursorOf = (nextUrl) => (nextUrl ? new URL(nextUrl).searchParams.get('cursor') : null);
+
 function VideoPage({ setIsAuthenticated }) {
   const [videos, setVideos] = useState([]);
   const [currentVideo, setCurrentVideo] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState(null);
   const navigate = useNavigate();
 
@@ -22,12 +27,13 @@ function VideoPage({ setIsAuthenticated }) {
       setLoading(true);
       setError(null);
       const response = await videoAPI.getVideos();
-      const videoList = response.data;
+      const videoList = response.data.results;
 
       setVideos(videoList);
+      setNextCursor(cursorOf(response.data.next));
 
-      // Auto-select first ready video
-      const firstReadyVideo = videoList.find((v) => v.status === 'ready');
+      // Auto-select first playable video, ready or still getting more qualities
+      const firstReadyVideo = videoList.find((v) => v.playable);
       if (firstReadyVideo) {
         setCurrentVideo(firstReadyVideo);
       }
@@ -39,9 +45,27 @@ function VideoPage({ setIsAuthenticated }) {
     }
   };
 
+  const loadMore = async () => {
+    try {
+      setLoadingMore(true);
+      const response = await videoAPI.getVideos({ cursor: nextCursor });
+      setVideos((loaded) => {
+        const seen = new Set(loaded.map((v) => v.id));
+        return [...loaded, ...response.data.results.filter((v) => !seen.has(v.id))];
+      });
+      setNextCursor(cursorOf(response.data.next));
+    } catch (err) {
+      console.error('Error loading more videos:', err);
+      setError('Failed to load more videos. Please try again.');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleVideoSelect = (video) => {
-    if (video.status === 'ready') {
+    if (video.playable) {
       setCurrentVideo(video);
+      videoAPI.recordView(video.id).catch(() => {});
       // Scroll to top on mobile
       window.scrollTo({ top: 0, behavior: 'smooth' });
     }
@@ -133,6 +157,11 @@ function VideoPage({ setIsAuthenticated }) {
               onVideoSelect={handleVideoSelect}
               loading={loading}
             />
+            {nextCursor && !loading && (
+              <button onClick={loadMore} className="load-more-btn" disabled={loadingMore}>
+                {loadingMore ? 'Loading...' : 'Load more'}
+              </button>
+            )}
           </aside>
         </div>
       </main>
@@ -45,8 +45,11 @@ export const authAPI = {
 
 // Videos API
 export const videoAPI = {
-  getVideos: () => api.get('/videos/'),
+  getVideos: (params) => api.get('/videos/', { params }),
   getVideo: (id) => api.get(`/videos/${id}/`),
+  getVideoStatus: (id) => api.get(`/videos/${id}/status/`),
+  recordView: (id) => api.post(`/videos/${id}/view/`),
+  getQueuePosition: (id) => api.get(`/videos/${id}/queue/`),
   streamVideo: (id) => api.get(`/videos/${id}/stream/`),
 };
 
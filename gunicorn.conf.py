@@ -0,0 +1,14 @@
+"""
+gunicorn settings, loaded automatically from the working directory
+
+Only hooks live here; bind and worker counts stay on the command line.
+"""
+
+import os
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of a worker that exited, see core/metrics.py
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,5 +1,16 @@
 from django.contrib import admin
-from .models import Video
+from .models import Video, ProcessingCheckpoint, ProcessingRun, ProcessingStage
+
+class ProcessingCheckpointInline(admin.TabularInline):
+    """Finished work a retry would skip; delete a row to have it redone"""
+    model = ProcessingCheckpoint
+    extra = 0
+    fields = ['name', 'completed_at', 'fingerprint']
+    readonly_fields = fields
+    
+    def has_add_permission(self, request, obj=None):
+        return False
+
 
 # Register your models here.
 @admin.register(Video)
@@ -8,6 +19,7 @@ class VideoAdmin(admin.ModelAdmin):
     list_filter = ['uploaded_at', 'uploaded_by']
     search_fields = ['title', 'description']
     readonly_fields = ['uploaded_at']
+    inlines = [ProcessingCheckpointInline]
     
     fieldsets = (
         ('Basic Information', {
@@ -16,7 +28,34 @@ class VideoAdmin(admin.ModelAdmin):
         ('Files', {
             'fields': ('original_file', 'thumbnail')
         }),
+        ('Encoding', {
+            'fields': ('encoding_profile',)
+        }),
         ('Metadata', {
             'fields': ('duration', 'views', 'uploaded_at')
         }),
-    )
\ No newline at end of file
+    )
+
+
+class ProcessingStageInline(admin.TabularInline):
+    model = ProcessingStage
+    extra = 0
+    can_delete = False
+    fields = ['name', 'started_at', 'wall_seconds', 'cpu_seconds', 'ffmpeg_speed', 'output_bytes', 'exit_code', 'error']
+    readonly_fields = fields
+    
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ProcessingRun)
+class ProcessingRunAdmin(admin.ModelAdmin):
+    list_display = ['video', 'status', 'mode', 'profile', 'worker', 'started_at', 'wall_seconds']
+    list_filter = ['status', 'mode', 'profile', 'worker']
+    search_fields = ['video__title']
+    list_select_related = ['video']
+    readonly_fields = ['video', 'status', 'mode', 'profile', 'worker', 'started_at', 'finished_at', 'error_message']
+    inlines = [ProcessingStageInline]
+    
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,100 @@
+"""
+Server-side cache of serialized video payloads
+
+Every Video carries a version counter, bumped by Video.save() and by
+signals on any change to its qualities. The current (version,
+updated_at) pair is kept in the cache too, so a conditional GET can be
+answered with a 304 and a cache hit can be served without touching the
+serializer or the database.
+
+Cached entries are dropped once the change is committed: dropped any
+earlier, a concurrent read could cache the old row again for the whole
+VIDEO_CACHE_TIMEOUT.
+"""
+
+import hashlib
+import time
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Video
+
+VERSION_KEY = 'videos:version:{}'
+DETAIL_KEY = 'videos:detail:{}:{}:{}'
+LIST_GENERATION_KEY = 'videos:list:generation'
+LIST_KEY = 'videos:list:{}:{}'
+
+
+def touch_video(video_id):
+    """Bump a video's version and drop every cached payload that shows it"""
+    touch_videos([video_id])
+
+
+def touch_videos(video_ids):
+    """Bump the version of several videos at once, for changes made without save()"""
+    now = timezone.now()
+    Video.objects.filter(pk__in=video_ids).update(version=F('version') + 1, updated_at=now)
+    invalidate(video_ids)
+
+
+def invalidate(video_ids):
+    """Drop the cached versions of videos once the current transaction commits"""
+    transaction.on_commit(lambda: drop_cached(video_ids))
+
+
+def drop_cached(video_ids):
+    try:
+        cache.delete_many([VERSION_KEY.format(video_id) for video_id in video_ids])
+
+        # Any list page may contain the video, so start a new list generation.
+        # Microsecond timestamps double as the list's Last-Modified.
+        cache.set(LIST_GENERATION_KEY, time.time_ns() // 1000, None)
+    except redis.RedisError as e:
+        # The change is saved either way; stale entries expire with VIDEO_CACHE_TIMEOUT
+        print(f"Cache invalidation failed for videos {list(video_ids)}: {e}")
+
+
+def get_video_version(video_id):
+    """
+    Current version of a video, from the cache when possible
+
+    Returns:
+        tuple: (version, updated_at as a Unix timestamp), or None if the video does not exist
+    """
+    key = VERSION_KEY.format(video_id)
+    value = cache.get(key)
+    if value is None:
+        row = Video.objects.filter(pk=video_id).values_list('version', 'updated_at').first()
+        if row is None:
+            return None
+        value = (row[0], row[1].timestamp())
+        cache.set(key, value, settings.VIDEO_CACHE_TIMEOUT)
+    return value
+
+
+def get_list_generation():
+    """Current list generation, a microsecond timestamp of the last change"""
+    generation = cache.get(LIST_GENERATION_KEY)
+    if generation is None:
+        generation = time.time_ns() // 1000
+        cache.add(LIST_GENERATION_KEY, generation, None)
+        generation = cache.get(LIST_GENERATION_KEY, generation)
+    return generation
+
+
+def request_key(request):
+    """Payloads hold absolute URLs, so they are cached per scheme, host and query"""
+    return hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+
+
+def detail_key(video_id, version, request):
+    return DETAIL_KEY.format(video_id, version, request_key(request))
+
+
+def list_key(generation, request):
+    return LIST_KEY.format(generation, request_key(request))
@@ -0,0 +1,99 @@
+"""
+Crash-resumable processing
+
+Every stage and rendition that finishes is recorded as a
+ProcessingCheckpoint, together with the size of each file it wrote (and
+its SHA-256 with VIDEO_CHECKPOINT_CHECKSUMS). When a worker dies, e.g.
+during a deploy, the task is delivered again and the new attempt skips
+work whose checkpoint still holds: same source and settings, and every
+output present and intact. Only missing or damaged work is redone.
+"""
+
+import hashlib
+import json
+import os
+
+from django.conf import settings
+
+from .models import ProcessingCheckpoint
+
+BLOCK_SIZE = 1024 * 1024
+
+
+def fingerprint(**inputs):
+    """SHA-256 of everything a piece of work depends on, e.g. source hash and encoder options"""
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def describe(paths):
+    """
+    Size, and checksum if enabled, of output files
+
+    Args:
+        paths: Absolute paths of files under MEDIA_ROOT
+
+    Returns:
+        dict: Path relative to MEDIA_ROOT -> {'size': bytes, 'sha256': hex or absent}
+    """
+    checksums = getattr(settings, 'VIDEO_CHECKPOINT_CHECKSUMS', False)
+    outputs = {}
+    for path in paths:
+        entry = {'size': os.path.getsize(path)}
+        if checksums:
+            entry['sha256'] = file_checksum(path)
+        outputs[os.path.relpath(path, settings.MEDIA_ROOT)] = entry
+    return outputs
+
+
+def verify(outputs):
+    """Whether every recorded output is still on disk, unchanged"""
+    for name, entry in outputs.items():
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        try:
+            if os.path.getsize(path) != entry['size']:
+                return False
+        except OSError:
+            return False
+        if 'sha256' in entry and file_checksum(path) != entry['sha256']:
+            return False
+    return True
+
+
+def record(video, name, inputs_fingerprint, paths):
+    """
+    Record finished work and the files it wrote
+
+    The work itself succeeded either way, so a file that cannot be read
+    back only means a retry will redo it.
+    """
+    try:
+        outputs = describe(paths)
+    except OSError as e:
+        print(f"Checkpointing {name} for video {video.id} failed: {e}")
+        return
+    # One upsert, no savepoint and select first
+    ProcessingCheckpoint.objects.bulk_create(
+        [ProcessingCheckpoint(video=video, name=name, fingerprint=inputs_fingerprint, outputs=outputs)],
+        update_conflicts=True,
+        unique_fields=['video', 'name'],
+        update_fields=['fingerprint', 'outputs', 'completed_at']
+    )
+
+
+def is_done(video, name, inputs_fingerprint):
+    """Whether work was finished with the same inputs and its outputs are intact"""
+    checkpoint = ProcessingCheckpoint.objects.filter(video=video, name=name).first()
+    if checkpoint is None or checkpoint.fingerprint != inputs_fingerprint:
+        return False
+    if verify(checkpoint.outputs):
+        return True
+    print(f"Outputs of {name} for video {video.id} are missing or damaged, redoing it")
+    return False
@@ -0,0 +1,152 @@
+"""
+DASH manifests for single-file fMP4 renditions
+
+In the fmp4 segment format every rendition is one fragmented MP4 file
+that the HLS playlists address with byte ranges. A DASH manifest can
+point at the very same bytes: each Representation lists its init
+section and its segments as byte ranges of that file, so both protocols
+are served from one copy of the media.
+"""
+
+import os
+from xml.etree import ElementTree
+
+from .hls import read_media_playlist, write_atomic
+
+TIMESCALE = 1000
+
+
+def iso_duration(seconds):
+    """Format seconds as an xs:duration, e.g. PT25.000S"""
+    return f'PT{seconds:.3f}S'
+
+
+def video_codec(path, offset, length):
+    """
+    RFC 6381 codecs string of an H.264 track, e.g. avc1.64001F
+
+    Read from the avcC box in the init section, or None for other codecs.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        init = f.read(length)
+    box = init.find(b'avcC')
+    if box < 0 or len(init) < box + 8:
+        return None
+    # configurationVersion, then profile, constraint flags and level
+    return 'avc1.' + init[box + 5:box + 8].hex().upper()
+
+
+def segment_list(playlist_path):
+    """
+    SegmentList element of a single-file rendition, from its HLS playlist
+
+    Returns:
+        tuple: (BaseURL of the file relative to the playlist, SegmentList element,
+        init range, duration in seconds as the sum of the segment durations)
+    """
+    playlist = read_media_playlist(playlist_path)
+    if not playlist['init']:
+        raise ValueError(f'{playlist_path} is not a single-file fMP4 playlist')
+    uri, init_offset, init_length = playlist['init']
+
+    element = ElementTree.Element('SegmentList', timescale=str(TIMESCALE))
+    ElementTree.SubElement(element, 'Initialization', range=f'{init_offset}-{init_offset + init_length - 1}')
+
+    # Segment durations vary, so the timeline lists them, merging runs of equal ones
+    timeline = ElementTree.SubElement(element, 'SegmentTimeline')
+    start = 0.0
+    runs = []
+    for _, duration, _ in playlist['segments']:
+        # Rounding both ends keeps the timeline from drifting
+        t = round(start * TIMESCALE)
+        d = round((start + duration) * TIMESCALE) - t
+        if runs and runs[-1][1] == d:
+            runs[-1][2] += 1
+        else:
+            runs.append([t, d, 0])
+        start += duration
+    for t, d, repeat in runs:
+        s = ElementTree.SubElement(timeline, 'S', t=str(t), d=str(d))
+        if repeat:
+            s.set('r', str(repeat))
+
+    for _, _, (offset, length) in playlist['segments']:
+        ElementTree.SubElement(element, 'SegmentURL', mediaRange=f'{offset}-{offset + length - 1}')
+
+    return uri, element, (init_offset, init_length), start
+
+
+def write_manifest(manifest_path, videos, audio=None):
+    """
+    Write a static DASH manifest for renditions already described by HLS playlists
+
+    The presentation lasts as long as the longest rendition's segments, not
+    Video.duration, which is whole seconds and would cut off the last one.
+
+    Args:
+        manifest_path: Where to write manifest.mpd, next to the rendition folders
+        videos: Dicts with name, width, height and bandwidth (bits per second), lowest first
+        audio: Dict with name, bandwidth and codecs of the audio rendition, if any
+    """
+    output_dir = os.path.dirname(manifest_path)
+
+    mpd = ElementTree.Element('MPD', {
+        'xmlns': 'urn:mpeg:dash:schema:mpd:2011',
+        'profiles': 'urn:mpeg:dash:profile:isoff-main:2011',
+        'type': 'static',
+        'minBufferTime': 'PT2S',
+    })
+    period = ElementTree.SubElement(mpd, 'Period', id='0', start='PT0S')
+    duration = 0.0
+
+    adaptation = ElementTree.SubElement(period, 'AdaptationSet', {
+        'id': '0',
+        'contentType': 'video',
+        'mimeType': 'video/mp4',
+        'segmentAlignment': 'true',
+        'startWithSAP': '1',
+    })
+    for rendition in videos:
+        uri, segments, (init_offset, init_length), rendition_duration = segment_list(
+            os.path.join(output_dir, rendition['name'], 'playlist.m3u8')
+        )
+        duration = max(duration, rendition_duration)
+        representation = ElementTree.SubElement(adaptation, 'Representation', {
+            'id': rendition['name'],
+            'bandwidth': str(rendition['bandwidth']),
+            'width': str(rendition['width']),
+            'height': str(rendition['height']),
+        })
+        codecs = video_codec(os.path.join(output_dir, rendition['name'], uri), init_offset, init_length)
+        if codecs:
+            representation.set('codecs', codecs)
+        ElementTree.SubElement(representation, 'BaseURL').text = f"{rendition['name']}/{uri}"
+        representation.append(segments)
+
+    if audio:
+        adaptation = ElementTree.SubElement(period, 'AdaptationSet', {
+            'id': '1',
+            'contentType': 'audio',
+            'mimeType': 'audio/mp4',
+            'segmentAlignment': 'true',
+            'startWithSAP': '1',
+        })
+        uri, segments, _, rendition_duration = segment_list(os.path.join(output_dir, audio['name'], 'playlist.m3u8'))
+        duration = max(duration, rendition_duration)
+        representation = ElementTree.SubElement(adaptation, 'Representation', {
+            'id': audio['name'],
+            'bandwidth': str(audio['bandwidth']),
+        })
+        if audio.get('codecs'):
+            representation.set('codecs', audio['codecs'])
+        ElementTree.SubElement(representation, 'BaseURL').text = f"{audio['name']}/{uri}"
+        representation.append(segments)
+
+    # Known only once every rendition has been read
+    mpd.set('mediaPresentationDuration', iso_duration(duration))
+    ElementTree.indent(mpd)
+    write_atomic(
+        manifest_path,
+        '<?xml version="1.0" encoding="utf-8"?>\n' + ElementTree.tostring(mpd, encoding='unicode') + '\n'
+    )
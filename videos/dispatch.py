@@ -0,0 +1,79 @@
+"""
+Dispatch of video processing jobs
+
+Uploads hand their processing to a backend chosen by
+VIDEO_PROCESSING_BACKEND once the creating transaction has committed:
+
+    celery    queue videos.tasks.process_video for a worker (default)
+    inline    process synchronously in the calling process, for tests and
+              single-process setups
+    disabled  do not process at all
+
+Workers hold an encode slot while a video is encoded, so no more than
+VIDEO_MAX_CONCURRENT_ENCODES videos are encoded at once across all
+workers. Slots live in a Redis sorted set scored by expiry time, so a
+slot held by a crashed worker frees itself.
+"""
+
+import time
+
+import redis
+from django.conf import settings
+
+from . import live_status
+
+SLOTS_KEY = 'videos:encode:slots'
+
+
+def start_video_processing(video_id):
+    """Hand a committed video to the configured processing backend"""
+    backend = settings.VIDEO_PROCESSING_BACKEND
+
+    if backend == 'celery':
+        from .tasks import process_video
+        process_video.delay(video_id)
+    elif backend == 'inline':
+        from .video_processor import VideoProcessor
+        VideoProcessor(video_id).process()
+    elif backend != 'disabled':
+        raise ValueError(f"Unknown VIDEO_PROCESSING_BACKEND: {backend}")
+
+
+def acquire_encode_slot(video_id):
+    """
+    Claim one of the VIDEO_MAX_CONCURRENT_ENCODES slots for a video
+
+    Claiming again for the same video refreshes its slot.
+
+    Returns:
+        bool: True if the video may be encoded now
+    """
+    limit = settings.VIDEO_MAX_CONCURRENT_ENCODES
+    if not limit:
+        return True
+
+    now = time.time()
+    try:
+        client = live_status.get_redis()
+        pipe = client.pipeline()
+        pipe.zremrangebyscore(SLOTS_KEY, '-inf', now)
+        pipe.zadd(SLOTS_KEY, {video_id: now + settings.VIDEO_ENCODE_SLOT_TTL})
+        pipe.zrank(SLOTS_KEY, video_id)
+        rank = pipe.execute()[2]
+        # Rank follows expiry time, so newer claims lose when slots are full
+        if rank < limit:
+            return True
+        client.zrem(SLOTS_KEY, video_id)
+        return False
+    except redis.RedisError as e:
+        # The broker is Redis too, so this is rare; do not stall the queue over it
+        print(f"Encode slot check failed for video {video_id}: {e}")
+        return True
+
+
+def release_encode_slot(video_id):
+    """Give back the encode slot of a video"""
+    try:
+        live_status.get_redis().zrem(SLOTS_KEY, video_id)
+    except redis.RedisError as e:
+        print(f"Encode slot release failed for video {video_id}: {e}")
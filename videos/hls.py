@@ -0,0 +1,159 @@
+"""
+HLS media playlists
+
+Reads the playlists FFmpeg writes, including the byte ranges of
+single-file fMP4 renditions, and writes the ones joined from chunks.
+Playlists players may already be polling are replaced in one rename
+with write_atomic(), never rewritten in place.
+"""
+
+import math
+import os
+import tempfile
+
+
+def parse_byte_range(value, next_offset):
+    """
+    Parse an EXT-X-BYTERANGE / BYTERANGE value, length[@offset]
+
+    Returns:
+        tuple: (offset, length), the offset defaulting to the end of the previous range
+    """
+    length, _, offset = value.strip('"').partition('@')
+    return (int(offset) if offset else next_offset), int(length)
+
+
+def read_media_playlist(playlist_path):
+    """
+    Read an HLS media playlist, including byte ranges of single-file renditions
+
+    Returns:
+        dict: 'init' as (uri, offset, length) from EXT-X-MAP with a byte
+        range or None, and 'segments' as (uri, duration, (offset, length)
+        or None) tuples in playlist order
+    """
+    init = None
+    segments = []
+    duration = byte_range = None
+    next_offset = 0
+
+    with open(playlist_path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                duration = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line.startswith('#EXT-X-BYTERANGE:'):
+                byte_range = parse_byte_range(line[len('#EXT-X-BYTERANGE:'):], next_offset)
+                next_offset = sum(byte_range)
+            elif line.startswith('#EXT-X-MAP:'):
+                attributes = dict(
+                    attribute.split('=', 1) for attribute in line[len('#EXT-X-MAP:'):].split(',')
+                )
+                if 'BYTERANGE' in attributes:
+                    offset, length = parse_byte_range(attributes['BYTERANGE'], 0)
+                    init = (attributes['URI'].strip('"'), offset, length)
+            elif line and not line.startswith('#') and duration is not None:
+                segments.append((line, duration, byte_range))
+                duration = byte_range = None
+
+    return {'init': init, 'segments': segments}
+
+
+def parse_media_playlist(playlist_path):
+    """
+    Read the segments of an HLS media playlist
+
+    Returns:
+        list: (uri, duration) tuples in playlist order
+    """
+    return [(uri, duration) for uri, duration, _ in read_media_playlist(playlist_path)['segments']]
+
+
+def media_playlist_files(playlist_path):
+    """
+    Paths of an HLS media playlist and of every file it references
+
+    Returns:
+        list: The playlist first, then each segment or single-file rendition once
+    """
+    playlist = read_media_playlist(playlist_path)
+    uris = [uri for uri, _, _ in playlist['segments']]
+    if playlist['init']:
+        uris.insert(0, playlist['init'][0])
+    directory = os.path.dirname(playlist_path)
+    return [playlist_path] + [os.path.join(directory, uri) for uri in dict.fromkeys(uris)]
+
+
+def write_atomic(path, text):
+    """Replace a file in one rename, so readers see the old or the new content, never half of it"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f'.{os.path.basename(path)}.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def write_media_playlist(playlist_path, segments):
+    """
+    Write a VOD HLS media playlist
+
+    Args:
+        playlist_path: Where to write playlist.m3u8
+        segments: (uri, duration) tuples in playlist order
+    """
+    target_duration = math.ceil(max((d for _, d in segments), default=0))
+
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:3',
+        f'#EXT-X-TARGETDURATION:{target_duration}',
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+    ]
+    for uri, duration in segments:
+        lines += [f'#EXTINF:{duration:.6f},', uri]
+    lines.append('#EXT-X-ENDLIST')
+
+    # Players may be polling the playlist already, e.g. one joined from chunks
+    write_atomic(playlist_path, '\n'.join(lines) + '\n')
+
+
+def build_segment_index(playlist_path):
+    """
+    Build the compact timing index of a rendition from its playlist
+
+    FFmpeg cuts segments on keyframes, so real durations vary and the
+    last one is short. The index keeps the EXTINF durations, the start
+    offset of every segment (for bisecting a time to a segment) and the
+    byte size of every segment. Single-file fMP4 renditions also get the
+    byte offset of every segment and the (offset, length) of the init
+    section, since all of them live in one file.
+
+    Returns:
+        tuple: (segment uris, index dict with starts/durations/sizes)
+    """
+    playlist = read_media_playlist(playlist_path)
+    quality_dir = os.path.dirname(playlist_path)
+
+    starts, durations, sizes, offsets = [], [], [], []
+    offset = 0.0
+    for uri, duration, byte_range in playlist['segments']:
+        starts.append(round(offset, 3))
+        durations.append(round(duration, 3))
+        if byte_range:
+            offsets.append(byte_range[0])
+            sizes.append(byte_range[1])
+        else:
+            sizes.append(os.path.getsize(os.path.join(quality_dir, uri)))
+        offset += duration
+
+    uris = [uri for uri, _, _ in playlist['segments']]
+    index = {'starts': starts, 'durations': durations, 'sizes': sizes}
+    if playlist['init']:
+        index['offsets'] = offsets
+        index['init'] = list(playlist['init'][1:])
+    return uris, index
@@ -0,0 +1,69 @@
+"""
+Live processing state kept in Redis
+
+Workers publish status, percent, stage, ETA and whether the video can
+already be played here on every progress
+tick, so status polling never has to touch the database. The Video row
+is only written when the state actually changes.
+"""
+
+import redis
+from django.conf import settings
+
+STATUS_KEY = 'video:{}:status'
+
+_client = None
+
+
+def get_redis():
+    """Shared Redis connection for the configured REDIS_URL"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            socket_connect_timeout=1,
+            socket_timeout=1,
+        )
+    return _client
+
+
+def publish(video_id, **state):
+    """
+    Store live state for a video
+
+    Args:
+        video_id: ID of the Video being processed
+        **state: Fields to set, e.g. status, percent, stage, eta, playable
+    """
+    if not settings.VIDEO_LIVE_STATUS:
+        return
+
+    key = STATUS_KEY.format(video_id)
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hset(key, mapping={k: '' if v is None else v for k, v in state.items()})
+        pipe.expire(key, settings.VIDEO_LIVE_STATUS_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        # Live status is best effort, the database still has the state changes
+        print(f"Live status update failed for video {video_id}: {e}")
+
+
+def read(video_id):
+    """Live state for a video, or None if nothing was published"""
+    try:
+        state = get_redis().hgetall(STATUS_KEY.format(video_id))
+    except redis.RedisError as e:
+        print(f"Live status read failed for video {video_id}: {e}")
+        return None
+
+    if not state:
+        return None
+    return {
+        'status': state.get('status'),
+        'percent': int(state.get('percent') or 0),
+        'stage': state.get('stage') or None,
+        'eta': int(state['eta']) if state.get('eta') else None,
+        'playable': state.get('playable') == '1',
+    }
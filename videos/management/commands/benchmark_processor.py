@@ -0,0 +1,201 @@
+"""
+Benchmark the video processing pipeline on synthetic sources
+
+Sources are generated locally with FFmpeg's lavfi test sources, so runs
+are reproducible without downloading anything. Every stage of
+VideoProcessor is timed on its own and the results are written as JSON,
+one entry per (source, run, stage), for comparing commits:
+
+    python manage.py benchmark_processor --durations 10,60 \
+        --resolutions 640x360,1920x1080 --repeat 3 --output bench.json
+"""
+
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.utils import timezone
+
+from videos.models import Video
+from videos.video_processor import VideoProcessor
+
+
+def usage():
+    """CPU seconds and peak RSS (KB) of this process and its waited-for children"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    return cpu, max(own.ru_maxrss, children.ru_maxrss)
+
+
+def measure(func, *args):
+    """
+    Run one stage and measure it
+
+    Returns:
+        tuple: (return value, dict with wall_s, cpu_s and peak_rss_kb)
+    """
+    cpu_before, _ = usage()
+    started = time.perf_counter()
+    result = func(*args)
+    wall = time.perf_counter() - started
+    cpu_after, peak_rss = usage()
+    return result, {
+        'wall_s': round(wall, 4),
+        'cpu_s': round(cpu_after - cpu_before, 4),
+        # getrusage only keeps the highest peak seen so far, not the stage's own
+        'peak_rss_kb': peak_rss,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=settings.BASE_DIR
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ffmpeg_version():
+    try:
+        output = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, check=True).stdout
+        return output.splitlines()[0]
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks VideoProcessor stages on synthetic lavfi sources and prints JSON results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--durations', default='10,60',
+                            help='Comma separated source durations in seconds')
+        parser.add_argument('--resolutions', default='640x360,1280x720,1920x1080',
+                            help='Comma separated source sizes, WIDTHxHEIGHT')
+        parser.add_argument('--fps', type=int, default=30, help='Source frame rate')
+        parser.add_argument('--repeat', type=int, default=1, help='Runs per source')
+        parser.add_argument('--profile', default=None, help='Encoding profile, default VIDEO_ENCODING_PROFILE')
+        parser.add_argument('--single-pass', action='store_true',
+                            help='Encode all qualities in one FFmpeg run instead of one run per quality')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated sources and outputs')
+
+    def handle(self, *args, **options):
+        try:
+            durations = [int(d) for d in options['durations'].split(',')]
+            resolutions = [tuple(int(n) for n in r.lower().split('x')) for r in options['resolutions'].split(',')]
+        except ValueError:
+            raise CommandError('Durations are seconds and resolutions WIDTHxHEIGHT, comma separated')
+        if not shutil.which('ffmpeg') or not shutil.which('ffprobe'):
+            raise CommandError('FFmpeg and FFprobe must be installed')
+
+        media_root = tempfile.mkdtemp(prefix='benchmark_')
+        user, _ = User.objects.get_or_create(username='benchmark')
+        results = []
+
+        # Nothing may reach the queues or Redis while stages are timed
+        with override_settings(MEDIA_ROOT=media_root, VIDEO_PROCESSING_BACKEND='disabled', VIDEO_LIVE_STATUS=False):
+            try:
+                for width, height in resolutions:
+                    for duration in durations:
+                        source = self.generate_source(media_root, width, height, duration, options['fps'])
+                        for run in range(options['repeat']):
+                            results += self.run_pipeline(user, source, width, height, duration, run, options)
+            finally:
+                Video.objects.filter(uploaded_by=user, title__startswith='Benchmark ').delete()
+                if options['keep']:
+                    self.stderr.write(f'Sources and outputs kept in {media_root}')
+                else:
+                    shutil.rmtree(media_root, ignore_errors=True)
+
+        report = json.dumps({
+            'created_at': timezone.now().isoformat(),
+            'commit': git_commit(),
+            'ffmpeg': ffmpeg_version(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'profile': options['profile'] or settings.VIDEO_ENCODING_PROFILE,
+            'single_pass': options['single_pass'],
+            'results': results,
+        }, indent=2)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report + '\n')
+            self.stderr.write(self.style.SUCCESS(f'✓ {len(results)} results written to {options["output"]}'))
+        else:
+            self.stdout.write(report)
+
+    def generate_source(self, media_root, width, height, duration, fps):
+        """Render a test pattern with a tone as an H.264/AAC MP4"""
+        name = f'videos/originals/benchmark_{width}x{height}_{duration}s.mp4'
+        path = os.path.join(media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.stderr.write(f'Generating {width}x{height} {duration}s source...')
+        subprocess.run([
+            'ffmpeg', '-v', 'error',
+            '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={fps}:duration={duration}',
+            '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={duration}',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+            '-c:a', 'aac', '-shortest',
+            '-y', path
+        ], check=True)
+        return name
+
+    def run_pipeline(self, user, source, width, height, duration, run, options):
+        """Time every stage of one video, returning one result dict per stage"""
+        video = Video.objects.create(
+            title=f'Benchmark {width}x{height} {duration}s #{run}',
+            uploaded_by=user,
+            original_file=source,
+            content_hash=f'benchmark-{run}',
+            encoding_profile=options['profile'] or '',
+            status='processing'
+        )
+        processor = VideoProcessor(video.id, single_pass=options['single_pass'], chunked=False)
+
+        results = []
+
+        def record(stage, func, *args):
+            ok, stats = measure(func, *args)
+            if ok is False:
+                raise CommandError(f'Stage {stage} failed on {source}')
+            results.append({
+                'source': f'{width}x{height}@{options["fps"]}',
+                'duration_s': duration,
+                'run': run,
+                'stage': stage,
+                **stats,
+                # Seconds of media processed per second of wall time
+                'speed': round(duration / stats['wall_s'], 3) if stats['wall_s'] else None,
+            })
+            self.stderr.write(f'  {stage:<28} {stats["wall_s"]:>8.3f}s wall {stats["cpu_s"]:>8.3f}s cpu')
+
+        record('extract_metadata', processor.extract_metadata)
+        record('generate_thumbnail', processor.generate_thumbnail)
+
+        qualities = processor.get_qualities()
+        if options['single_pass']:
+            record('create_hls_streams', processor.create_hls_streams, qualities)
+        else:
+            for quality in qualities:
+                record(f'create_hls_stream:{quality}', processor.create_hls_stream, quality)
+
+        # DB bookkeeping on its own: the upserts create_hls_stream already did, again
+        for quality in qualities:
+            record(f'save_quality:{quality}', processor.save_quality, quality)
+
+        record('create_master_playlist', processor.create_master_playlist)
+        return results
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videoquality',
+            name='segment_index',
+            field=models.JSONField(blank=True, default=dict, help_text='Segment starts, durations (seconds) and sizes (bytes) from the playlist'),
+        ),
+    ]
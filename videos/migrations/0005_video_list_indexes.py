@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0004_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['-uploaded_at', '-id'], name='video_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['status', '-uploaded_at', '-id'], name='video_status_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['uploaded_by', '-uploaded_at', '-id'], name='video_uploader_uploaded_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0006_video_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='dispatched_at',
+            field=models.DateTimeField(blank=True, help_text='When the scheduler handed the encode to a worker', null=True),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='encode_queued_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='When the video joined the fair-share encode queue', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0007_video_encode_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='encoding_profile',
+            field=models.CharField(blank=True, help_text='Key of VIDEO_ENCODING_PROFILES, blank for the deployment default', max_length=50),
+        ),
+    ]
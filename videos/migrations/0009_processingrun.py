@@ -0,0 +1,50 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0008_video_encoding_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessingRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='running', max_length=20)),
+                ('mode', models.CharField(help_text='single_pass, per_quality, parallel or chunked', max_length=20)),
+                ('profile', models.CharField(blank=True, help_text='Encoding profile used', max_length=50)),
+                ('worker', models.CharField(blank=True, help_text='Host that started the run', max_length=255)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('error_message', models.TextField(blank=True)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='processing_runs', to='videos.video')),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProcessingStage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='e.g. metadata, thumbnail, encode:720p, save:720p', max_length=100)),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField()),
+                ('wall_seconds', models.FloatField()),
+                ('cpu_seconds', models.FloatField(help_text='CPU time of the worker process and its FFmpeg children')),
+                ('ffmpeg_speed', models.FloatField(blank=True, help_text='Last speed FFmpeg reported, x realtime', null=True)),
+                ('exit_code', models.IntegerField(blank=True, help_text="Exit code of the stage's FFmpeg run", null=True)),
+                ('output_bytes', models.BigIntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stages', to='videos.processingrun')),
+            ],
+            options={
+                'ordering': ['started_at', 'id'],
+            },
+        ),
+    ]
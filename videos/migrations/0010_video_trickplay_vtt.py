@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0009_processingrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='trickplay_vtt',
+            field=models.CharField(blank=True, help_text='Path to the WebVTT index of scrub preview sprites', max_length=500),
+        ),
+    ]
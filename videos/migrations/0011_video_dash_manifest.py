@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0010_video_trickplay_vtt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='dash_manifest',
+            field=models.CharField(blank=True, help_text='Path to manifest.mpd, for fMP4 renditions', max_length=500),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0011_video_dash_manifest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessingCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='e.g. thumbnail, trickplay, rendition:720p, chunk:720p:003', max_length=100)),
+                ('fingerprint', models.CharField(help_text='SHA-256 of the source and settings the work used', max_length=64)),
+                ('outputs', models.JSONField(blank=True, default=dict, help_text='Path under MEDIA_ROOT -> size in bytes and, if enabled, SHA-256 of every output file')),
+                ('completed_at', models.DateTimeField(auto_now=True)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='videos.video')),
+            ],
+            options={
+                'ordering': ['completed_at', 'id'],
+                'unique_together': {('video', 'name')},
+            },
+        ),
+    ]
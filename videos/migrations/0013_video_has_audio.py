@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0012_processingcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='has_audio',
+            field=models.BooleanField(blank=True, help_text='Whether the source has an audio stream, unknown until probed', null=True),
+        ),
+    ]
@@ -1,6 +1,11 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import User
+import bisect
+import hashlib
 import os
+import uuid
 #from djiango.utils import timezone
 # Create your models here.
 
@@ -24,9 +29,15 @@ class Video(models.Model):
     description = models.TextField(blank=True)
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='videos')
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1, help_text="Bumped on every change, used for ETags")
     
     # Original Video
     original_file = models.FileField(upload_to='videos/originals/', null=True, blank=True)
+    content_hash = models.CharField(
+        max_length=64, blank=True, db_index=True,
+        help_text="SHA-256 of the original file, used to spot re-uploads"
+    )
     thumbnail = models.ImageField(upload_to='videos/thumbnails/', null=True, blank=True)
     
     # Video Metadata
@@ -34,34 +45,117 @@ class Video(models.Model):
     width = models.IntegerField(null=True, blank=True)
     height = models.IntegerField(null=True, blank=True)
     fps = models.FloatField(null=True, blank=True)
+    has_audio = models.BooleanField(null=True, blank=True, help_text="Whether the source has an audio stream, unknown until probed")
     
     # Processing Status
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     processing_progress = models.IntegerField(default=0, help_text="Processing percentage")
     error_message = models.TextField(blank=True)
+    encode_queued_at = models.DateTimeField(
+        null=True, blank=True, db_index=True,
+        help_text="When the video joined the fair-share encode queue"
+    )
+    dispatched_at = models.DateTimeField(
+        null=True, blank=True, help_text="When the scheduler handed the encode to a worker"
+    )
+    
+    encoding_profile = models.CharField(
+        max_length=50, blank=True,
+        help_text="Key of VIDEO_ENCODING_PROFILES, blank for the deployment default"
+    )
     
     # HLS Streaming
     hls_playlist = models.CharField(max_length=500, blank=True, help_text="Path to master.m3u8")
+    dash_manifest = models.CharField(
+        max_length=500, blank=True, help_text="Path to manifest.mpd, for fMP4 renditions"
+    )
+    trickplay_vtt = models.CharField(
+        max_length=500, blank=True, help_text="Path to the WebVTT index of scrub preview sprites"
+    )
     
     # Analytics
     views = models.IntegerField(default=0)
     
     class Meta:
         ordering = ['-uploaded_at']
+        indexes = [
+            # Keyset pagination of the list, optionally filtered
+            models.Index(fields=['-uploaded_at', '-id'], name='video_uploaded_idx'),
+            models.Index(fields=['status', '-uploaded_at', '-id'], name='video_status_uploaded_idx'),
+            models.Index(fields=['uploaded_by', '-uploaded_at', '-id'], name='video_uploader_uploaded_idx'),
+        ]
     
     def __str__(self):
         return self.title
     
+    def clean(self):
+        """Reject a profile the workers would not know, before it reaches them"""
+        if self.encoding_profile and self.encoding_profile not in settings.VIDEO_ENCODING_PROFILES:
+            raise ValidationError({'encoding_profile': (
+                f"Unknown encoding profile, choose one of: {', '.join(settings.VIDEO_ENCODING_PROFILES)}"
+            )})
+    
+    def save(self, *args, **kwargs):
+        """Bump version in the same UPDATE as the change itself"""
+        bump = not self._state.adding and kwargs.get('update_fields') != []
+        if bump:
+            self.version = models.F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+        if bump:
+            # The new number only exists in the row now, it is loaded again on access
+            del self.__dict__['version']
+    
+    @staticmethod
+    def hash_file(file):
+        """SHA-256 of a file, read in chunks so large uploads never sit in memory"""
+        digest = hashlib.sha256()
+        for chunk in file.chunks():
+            digest.update(chunk)
+        return digest.hexdigest()
+    
+    def compute_content_hash(self):
+        """Hash original_file and store it on content_hash"""
+        self.content_hash = self.hash_file(self.original_file)
+        if self.original_file._committed:
+            self.original_file.close()
+        return self.content_hash
+    
     def increment_views(self):
-        """Increment view count"""
-        self.views += 1
-        self.save(update_fields=['views'])
+        """
+        Increment view count
+        
+        Views are buffered in Redis and flushed to the row in batches, so
+        concurrent viewers never contend for the row lock.
+        """
+        from .view_counter import record_view
+        
+        if not record_view(self.id):
+            # Redis is down, count directly without a read-modify-write
+            Video.objects.filter(id=self.id).update(views=models.F('views') + 1)
+    
+    def is_playable(self):
+        """Whether at least one rendition is published, possibly while the rest still encode"""
+        return bool(self.hls_playlist) and self.status in ('processing', 'ready')
     
     def get_hls_url(self):
         """Get HLS playlist URL"""
         if self.hls_playlist:
             return f"/media/{self.hls_playlist}"
         return None
+    
+    def get_dash_url(self):
+        """Get DASH manifest URL"""
+        if self.dash_manifest:
+            return f"/media/{self.dash_manifest}"
+        return None
+    
+    def get_trickplay_url(self):
+        """Get scrub preview WebVTT URL"""
+        if self.trickplay_vtt:
+            return f"/media/{self.trickplay_vtt}"
+        return None
 
 
 class VideoQuality(models.Model):
@@ -71,6 +165,10 @@ class VideoQuality(models.Model):
     file_path = models.CharField(max_length=500)
     file_size = models.BigIntegerField(help_text="File size in bytes")
     bitrate = models.IntegerField(help_text="Bitrate in kbps")
+    segment_index = models.JSONField(
+        default=dict, blank=True,
+        help_text="Segment starts, durations (seconds) and sizes (bytes) from the playlist"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -79,6 +177,20 @@ class VideoQuality(models.Model):
     
     def __str__(self):
         return f"{self.video.title} - {self.quality}"
+    
+    def segment_at(self, seconds):
+        """Number of the segment playing at a given time, or None"""
+        starts = self.segment_index.get('starts')
+        if not starts:
+            return None
+        return max(bisect.bisect_right(starts, seconds) - 1, 0)
+    
+    def segment_range(self, start, end):
+        """First and last segment numbers covering a time range, e.g. for clipping"""
+        first, last = self.segment_at(start), self.segment_at(end)
+        if first is None:
+            return None
+        return first, last
 
 
 class VideoSegment(models.Model):
@@ -93,4 +205,108 @@ class VideoSegment(models.Model):
         ordering = ['segment_number']
     
     def __str__(self):
-        return f"{self.quality} - Segment {self.segment_number}"
\ No newline at end of file
+        return f"{self.quality} - Segment {self.segment_number}"
+
+
+class UploadSession(models.Model):
+    """A resumable upload whose bytes arrive in several chunk requests"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    title = models.CharField(max_length=200)
+    description = models.TextField(blank=True)
+    filename = models.CharField(max_length=255)
+    total_size = models.BigIntegerField(help_text="Expected file size in bytes")
+    received_bytes = models.BigIntegerField(default=0, help_text="Bytes written so far")
+    created_at = models.DateTimeField(auto_now_add=True)
+    video = models.OneToOneField(
+        Video, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_session'
+    )
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.filename} ({self.received_bytes}/{self.total_size})"
+    
+    @property
+    def part_path(self):
+        """Where the partial file is written while chunks arrive"""
+        return os.path.join(settings.MEDIA_ROOT, 'uploads', f'{self.id}.part')
+    
+    @property
+    def is_complete(self):
+        return self.received_bytes >= self.total_size
+
+
+class ProcessingRun(models.Model):
+    """One attempt at processing a video, with its stages"""
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='processing_runs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    mode = models.CharField(max_length=20, help_text="single_pass, per_quality, parallel or chunked")
+    profile = models.CharField(max_length=50, blank=True, help_text="Encoding profile used")
+    worker = models.CharField(max_length=255, blank=True, help_text="Host that started the run")
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error_message = models.TextField(blank=True)
+    
+    class Meta:
+        ordering = ['-started_at']
+    
+    def __str__(self):
+        return f"{self.video} - run {self.id} ({self.status})"
+    
+    @property
+    def wall_seconds(self):
+        if self.finished_at is None:
+            return None
+        return (self.finished_at - self.started_at).total_seconds()
+
+
+class ProcessingStage(models.Model):
+    """Timing and resource use of one stage of a processing run"""
+    run = models.ForeignKey(ProcessingRun, on_delete=models.CASCADE, related_name='stages')
+    name = models.CharField(max_length=100, help_text="e.g. metadata, thumbnail, encode:720p, save:720p")
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    wall_seconds = models.FloatField()
+    cpu_seconds = models.FloatField(help_text="CPU time of the worker process and its FFmpeg children")
+    ffmpeg_speed = models.FloatField(null=True, blank=True, help_text="Last speed FFmpeg reported, x realtime")
+    exit_code = models.IntegerField(null=True, blank=True, help_text="Exit code of the stage's FFmpeg run")
+    output_bytes = models.BigIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    
+    class Meta:
+        ordering = ['started_at', 'id']
+    
+    def __str__(self):
+        return f"{self.name} ({self.wall_seconds:.2f}s)"
+
+
+class ProcessingCheckpoint(models.Model):
+    """
+    A piece of processing work that finished, with the outputs it left
+    
+    A retry skips the work if the fingerprint of its inputs still matches
+    and every output is still there with the recorded size (and checksum).
+    """
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='checkpoints')
+    name = models.CharField(max_length=100, help_text="e.g. thumbnail, trickplay, rendition:720p, chunk:720p:003")
+    fingerprint = models.CharField(max_length=64, help_text="SHA-256 of the source and settings the work used")
+    outputs = models.JSONField(
+        default=dict, blank=True,
+        help_text="Path under MEDIA_ROOT -> size in bytes and, if enabled, SHA-256 of every output file"
+    )
+    completed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['video', 'name']
+        ordering = ['completed_at', 'id']
+    
+    def __str__(self):
+        return f"{self.video} - {self.name}"
@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class VideoCursorPagination(CursorPagination):
+    """
+    Keyset pagination on uploaded_at for the video list
+
+    Each page seeks from the last row of the previous one through the
+    (uploaded_at, id) index, so page cost stays flat however deep a client
+    scrolls, unlike OFFSET based pages.
+    """
+    ordering = ('-uploaded_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
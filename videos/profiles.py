@@ -0,0 +1,104 @@
+"""
+Encoding profile registry
+
+A profile fully describes how a video is encoded: the ladder of
+qualities and, shared by every rung, the video codec, preset, rate
+control, keyframe interval and audio. Profiles are defined in
+settings.VIDEO_ENCODING_PROFILES; each one only lists what differs from
+DEFAULT_PROFILE. The profile used for a video is its encoding_profile
+field, falling back to settings.VIDEO_ENCODING_PROFILE, so a deployment
+can pick a faster or slower preset and single videos or tiers can be
+moved to another profile without code changes.
+"""
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+DEFAULT_PROFILE = {
+    'video_codec': 'libx264',
+    'preset': 'medium',
+    # Constant quality capped by VBV when set, otherwise average bitrate
+    'crf': None,
+    # VBV limits as multiples of the rung bitrate, None to leave unconstrained
+    'maxrate_factor': 1.5,
+    'bufsize_factor': 2.0,
+    # Fixed keyframe interval, so segments cut cleanly at 10 seconds
+    'gop_seconds': 2,
+    'threads': 0,  # 0 = let the encoder decide
+    'audio_codec': 'aac',
+    'audio_bitrate': '128k',
+    # Quality name -> nominal size and bitrate, lowest first
+    'ladder': {
+        '360p': {'width': 640, 'height': 360, 'bitrate': '500k'},
+        '480p': {'width': 854, 'height': 480, 'bitrate': '1000k'},
+        '720p': {'width': 1280, 'height': 720, 'bitrate': '2500k'},
+        '1080p': {'width': 1920, 'height': 1080, 'bitrate': '5000k'},
+    },
+}
+
+
+def get_profile(name=None):
+    """
+    Resolve an encoding profile by name
+
+    Args:
+        name: Key of settings.VIDEO_ENCODING_PROFILES, or None for the deployment default
+
+    Returns:
+        dict: DEFAULT_PROFILE with the profile's overrides applied
+
+    Raises:
+        ImproperlyConfigured: If the profile is not defined
+    """
+    name = name or settings.VIDEO_ENCODING_PROFILE
+    profiles = settings.VIDEO_ENCODING_PROFILES
+    if name not in profiles:
+        raise ImproperlyConfigured(f"Unknown video encoding profile: {name}")
+
+    profile = {**DEFAULT_PROFILE, **profiles[name], 'name': name}
+    profile['ladder'] = dict(profile['ladder'])
+    return profile
+
+
+def video_args(profile, bitrate, fps=None, stream=None):
+    """
+    FFmpeg video encoder options for one rendition
+
+    Args:
+        profile: Profile from get_profile()
+        bitrate: Target bitrate of the rendition, e.g. '2500k'
+        fps: Source frame rate, for the keyframe interval in frames
+        stream: Output video stream index when one FFmpeg run writes several
+
+    Returns:
+        list: Command line arguments
+    """
+    spec = ':v' if stream is None else f':v:{stream}'
+    kbps = int(bitrate.replace('k', ''))
+
+    args = [f'-c{spec}', profile['video_codec'], f'-preset{spec}', profile['preset']]
+    if profile['crf'] is not None:
+        args += [f'-crf{spec}', str(profile['crf'])]
+    else:
+        args += [f'-b{spec}', bitrate]
+    if profile['maxrate_factor']:
+        args += [f'-maxrate{spec}', f"{int(kbps * profile['maxrate_factor'])}k"]
+    if profile['bufsize_factor']:
+        args += [f'-bufsize{spec}', f"{int(kbps * profile['bufsize_factor'])}k"]
+    if profile['gop_seconds']:
+        gop = max(round((fps or 30) * profile['gop_seconds']), 1)
+        args += [f'-g{spec}', str(gop), f'-keyint_min{spec}', str(gop), f'-sc_threshold{spec}', '0']
+    if profile['threads']:
+        args += ['-threads', str(profile['threads'])]
+    return args
+
+
+def audio_args(profile):
+    """FFmpeg audio encoder options"""
+    return ['-c:a', profile['audio_codec'], '-b:a', profile['audio_bitrate']]
+
+
+def peak_bitrate(profile, bitrate):
+    """Highest bitrate a rendition may reach, in bits per second, for BANDWIDTH"""
+    kbps = int(bitrate.replace('k', ''))
+    return int(kbps * (profile['maxrate_factor'] or 1)) * 1000
@@ -0,0 +1,135 @@
+"""
+Fair-share scheduling of encodes across uploaders
+
+Prepared videos wait in a per-uploader queue instead of going straight
+to the bulk Celery queue. Whenever a slot frees up the scheduler hands
+out the next encode round-robin: the uploader with the fewest encodes
+running or already picked goes first, oldest video first within an
+uploader. A single uploader may hold at most VIDEO_MAX_ENCODES_PER_USER
+of the VIDEO_MAX_CONCURRENT_ENCODES slots, so a bulk upload cannot
+starve everyone else.
+
+The queue is the Video table itself: encode_queued_at is set when a
+video joins it and dispatched_at when its encode is handed to a worker.
+"""
+
+from collections import Counter
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Video
+
+
+def running_encodes():
+    """
+    Videos handed to a worker that have not finished yet
+
+    Like the Redis encode slots, a claim expires after VIDEO_ENCODE_SLOT_TTL:
+    an encode that died without reporting back, e.g. killed at its hard
+    time limit, must not hold its uploader's share forever.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.VIDEO_ENCODE_SLOT_TTL)
+    return Video.objects.filter(status='processing', dispatched_at__gte=cutoff)
+
+
+def waiting_encodes():
+    """Prepared videos still waiting for the scheduler"""
+    return Video.objects.filter(
+        status='processing', encode_queued_at__isnull=False, dispatched_at__isnull=True
+    )
+
+
+def plan():
+    """
+    Order waiting encodes the way the scheduler will hand them out
+
+    Every uploader's n-th waiting video gets the turn running + n, so
+    uploaders take turns and ones with fewer encodes running go first.
+    Ties go to the video that has waited longest.
+
+    Returns:
+        tuple: (Counter of running encodes per uploader, [(video_id, uploader_id)] in order)
+    """
+    running = Counter(running_encodes().values_list('uploaded_by_id', flat=True))
+    waiting = waiting_encodes().order_by('encode_queued_at', 'id').values_list('id', 'uploaded_by_id')
+
+    queued = Counter()
+    turns = []
+    for age, (video_id, user_id) in enumerate(waiting):
+        turns.append((running[user_id] + queued[user_id], age, video_id, user_id))
+        queued[user_id] += 1
+
+    return running, [(video_id, user_id) for _, _, video_id, user_id in sorted(turns)]
+
+
+def enqueue(video_id):
+    """Put a prepared video in its uploader's queue and dispatch what fits"""
+    Video.objects.filter(id=video_id).update(encode_queued_at=timezone.now(), dispatched_at=None)
+    return dispatch()
+
+
+def dispatch():
+    """
+    Hand waiting encodes to the bulk queue while slots are free
+
+    Dispatch runs from beat, from every finished encode and from several
+    workers at once. Each run locks the waiting rows before it counts the
+    running encodes, so a concurrent run waits, then counts the encodes
+    this one claimed, and VIDEO_MAX_ENCODES_PER_USER holds.
+
+    Returns:
+        list: IDs of the videos dispatched
+    """
+    with transaction.atomic():
+        # Always in id order, so two dispatchers never deadlock
+        list(waiting_encodes().select_for_update().order_by('id').values_list('id', flat=True))
+        dispatched = claim_free_slots()
+
+    if dispatched:
+        print(f"📤 Dispatched encodes of videos {dispatched}")
+    return dispatched
+
+
+def claim_free_slots():
+    """Claim and queue as many waiting encodes as the limits allow, see dispatch()"""
+    from .tasks import encode_video
+
+    running, order = plan()
+    limit = settings.VIDEO_MAX_CONCURRENT_ENCODES
+    free = limit - sum(running.values()) if limit else len(order)
+    per_user = settings.VIDEO_MAX_ENCODES_PER_USER
+
+    dispatched = []
+    for video_id, user_id in order:
+        if free <= 0:
+            break
+        if per_user and running[user_id] >= per_user:
+            continue
+
+        # Claim the row so concurrent dispatchers never send a video twice
+        claimed = Video.objects.filter(id=video_id, dispatched_at__isnull=True).update(
+            dispatched_at=timezone.now()
+        )
+        if not claimed:
+            continue
+
+        # Sent once the claim is committed, so a rolled back run sends nothing
+        transaction.on_commit(partial(encode_video.delay, video_id))
+        running[user_id] += 1
+        free -= 1
+        dispatched.append(video_id)
+
+    return dispatched
+
+
+def queue_position(video_id):
+    """1-based position of a video in the encode queue, or None if it is not waiting"""
+    _, order = plan()
+    for position, (waiting_id, _) in enumerate(order, 1):
+        if waiting_id == video_id:
+            return position
+    return None
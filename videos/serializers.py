@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Video, VideoQuality, VideoSegment
+from django.conf import settings
+from .models import Video, VideoQuality, VideoSegment, UploadSession, ProcessingRun, ProcessingStage
 
 class VideoQualitySerializer(serializers.ModelSerializer):
     class Meta:
@@ -10,6 +11,9 @@ class VideoSerializer(serializers.ModelSerializer):
     uploaded_by = serializers.StringRelatedField()
     qualities = VideoQualitySerializer(many=True, read_only=True)
     hls_url = serializers.SerializerMethodField()
+    dash_url = serializers.SerializerMethodField()
+    playable = serializers.BooleanField(source='is_playable', read_only=True)
+    trickplay_url = serializers.SerializerMethodField()
     thumbnail_url = serializers.SerializerMethodField()
     processing_status = serializers.SerializerMethodField()
     
@@ -18,9 +22,9 @@ class VideoSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'title', 'description', 'uploaded_by', 'uploaded_at',
             'duration', 'width', 'height', 'fps',
-            'status', 'processing_progress', 'error_message',
+            'status', 'processing_progress', 'error_message', 'playable',
             'thumbnail', 'thumbnail_url',
-            'hls_url', 'qualities', 'views',
+            'hls_url', 'dash_url', 'trickplay_url', 'qualities', 'views',
             'processing_status'
         ]
         read_only_fields = ['uploaded_by', 'uploaded_at', 'views', 'status']
@@ -33,6 +37,22 @@ class VideoSerializer(serializers.ModelSerializer):
                 return request.build_absolute_uri(f'/media/{obj.hls_playlist}')
         return None
     
+    def get_dash_url(self, obj):
+        """Return DASH manifest URL"""
+        if obj.dash_manifest:
+            request = self.context.get('request')
+            if request:
+                return request.build_absolute_uri(f'/media/{obj.dash_manifest}')
+        return None
+    
+    def get_trickplay_url(self, obj):
+        """Return scrub preview WebVTT URL"""
+        if obj.trickplay_vtt:
+            request = self.context.get('request')
+            if request:
+                return request.build_absolute_uri(f'/media/{obj.trickplay_vtt}')
+        return None
+    
     def get_thumbnail_url(self, obj):
         """Return thumbnail URL"""
         if obj.thumbnail:
@@ -43,6 +63,8 @@ class VideoSerializer(serializers.ModelSerializer):
     
     def get_processing_status(self, obj):
         """Return user-friendly processing status"""
+        if obj.status == 'processing' and obj.hls_playlist:
+            return f'Playable, more qualities coming ({obj.processing_progress}%)'
         status_map = {
             'pending': 'Waiting to process',
             'processing': f'Processing ({obj.processing_progress}%)',
@@ -61,4 +83,47 @@ class VideoUploadSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         # Set uploaded_by from request user
         validated_data['uploaded_by'] = self.context['request'].user
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Serializer for resumable upload sessions"""
+    
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'title', 'description', 'filename',
+            'total_size', 'received_bytes', 'created_at', 'video'
+        ]
+        read_only_fields = ['received_bytes', 'created_at', 'video']
+    
+    def validate_total_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("File size must be positive.")
+        if value > settings.VIDEO_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError("File is too large.")
+        return value
+    
+    def create(self, validated_data):
+        validated_data['uploaded_by'] = self.context['request'].user
+        return super().create(validated_data)
+
+
+class ProcessingStageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProcessingStage
+        fields = [
+            'name', 'started_at', 'finished_at', 'wall_seconds', 'cpu_seconds',
+            'ffmpeg_speed', 'output_bytes', 'exit_code', 'error'
+        ]
+
+
+class ProcessingRunSerializer(serializers.ModelSerializer):
+    stages = ProcessingStageSerializer(many=True, read_only=True)
+    wall_seconds = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = ProcessingRun
+        fields = [
+            'id', 'status', 'mode', 'profile', 'worker', 'started_at', 'finished_at',
+            'wall_seconds', 'error_message', 'stages'
+        ]
@@ -1,14 +1,11 @@
 # videos/signals.py
-from django.db.models.signals import post_save
+from functools import partial
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import Video
-from .video_processor import VideoProcessor 
-import threading
-
-def start_video_processing(video_id):
-    """Function to run in a separate thread"""
-    processor = VideoProcessor(video_id)
-    processor.process()
+from . import dispatch, live_status
+from .caching import invalidate, touch_video
+from .models import Video, VideoQuality
 
 @receiver(post_save, sender=Video)
 def video_post_save(sender, instance, created, **kwargs):
@@ -17,10 +14,22 @@ def video_post_save(sender, instance, created, **kwargs):
     Only runs if 'created' is True (new upload).
     """
     if created:
-        # We run this in a thread so the Admin page doesn't freeze
-        # while FFmpeg converts the video
-        thread = threading.Thread(
-            target=start_video_processing, 
-            args=(instance.id,)
-        )
-        thread.start()
\ No newline at end of file
+        live_status.publish(instance.id, status=instance.status, percent=0, stage='queued', eta=None)
+        
+        # Processing runs on a worker, never in the web process, and only
+        # once the row is committed so the worker is sure to see it
+        transaction.on_commit(partial(dispatch.start_video_processing, instance.id))
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+def video_changed(sender, instance, **kwargs):
+    """Invalidate cached payloads of a video whenever it changes, save() bumped its version"""
+    invalidate([instance.id])
+
+
+@receiver(post_save, sender=VideoQuality)
+@receiver(post_delete, sender=VideoQuality)
+def video_quality_changed(sender, instance, **kwargs):
+    """Qualities are part of the video payload, so they invalidate it too"""
+    touch_video(instance.video_id)
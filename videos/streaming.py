@@ -0,0 +1,161 @@
+"""
+HTTP range responses for video files
+
+Single ranges are served from a file positioned at the range start with
+an exact Content-Length, so gunicorn's wsgi.file_wrapper can hand the
+bytes to os.sendfile without copying them through Python. Deployments
+behind nginx can skip that too and let nginx serve the file through
+X-Accel-Redirect once Django has checked access.
+"""
+
+import os
+import uuid
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+
+BLOCK_SIZE = 64 * 1024
+
+# More ranges than this get the whole file instead of a huge multipart body
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(header, size):
+    """
+    Parse a Range header into byte ranges
+
+    Returns:
+        list: Inclusive (start, end) tuples, or None to send the whole file
+
+    Raises:
+        RangeNotSatisfiable: If no range overlaps the file
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+
+    ranges = []
+    for spec in header[len('bytes='):].split(','):
+        start, sep, end = spec.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if start:
+                start, end = int(start), int(end) if end else None
+                if end is None:
+                    end = size - 1
+                elif end < start:
+                    return None
+            elif end:
+                # Suffix range: the last N bytes
+                start, end = max(size - int(end), 0), size - 1
+            else:
+                return None
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+class RangeFile:
+    """
+    A file limited to one byte range
+
+    read() stops at the end of the range for plain WSGI servers, while
+    fileno() exposes the underlying file, already positioned at the range
+    start, so a sendfile-capable server sends Content-Length bytes from it.
+    """
+
+    def __init__(self, path, start, end):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start + 1
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def multipart_ranges(path, ranges, size, content_type, boundary):
+    """Yield a multipart/byteranges body for several ranges"""
+    with open(path, 'rb') as f:
+        for start, end in ranges:
+            yield (
+                f'\r\n--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+            ).encode()
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                data = f.read(min(BLOCK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+        yield f'\r\n--{boundary}--\r\n'.encode()
+
+
+def range_file_response(request, field_file, content_type):
+    """
+    Serve a stored file with support for Range requests
+
+    Args:
+        request: The incoming request, for its Range header
+        field_file: FieldFile in default storage, e.g. video.original_file
+        content_type: Content-Type of the file
+    """
+    accel_prefix = settings.VIDEO_STREAM_ACCEL_REDIRECT
+    if accel_prefix:
+        # nginx serves the bytes (and ranges) from its internal location
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + quote(field_file.name)
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    path = field_file.path
+    size = os.path.getsize(path)
+
+    try:
+        ranges = parse_range_header(request.headers.get('Range'), size)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if ranges is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = FileResponse(RangeFile(path, start, end), content_type=content_type, status=206)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        boundary = uuid.uuid4().hex
+        response = StreamingHttpResponse(
+            multipart_ranges(path, ranges, size, content_type, boundary),
+            content_type=f'multipart/byteranges; boundary={boundary}',
+            status=206
+        )
+
+    response['Accept-Ranges'] = 'bytes'
+    return response
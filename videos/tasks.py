@@ -3,15 +3,25 @@
 """
 
 
-from celery import shared_task
+from celery import shared_task, chord
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Least
+from . import dispatch, live_status, scheduler, view_counter
+from .caching import touch_video, touch_videos
 from .video_processor import VideoProcessor
 from .models import Video
 
-@shared_task(bind=True)
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
 def process_video(self, video_id):
     """
     Celery task to process video asynchronously
     
+    Runs on the fast queue: the duplicate check, metadata and thumbnail
+    take seconds, so new uploads show them even when every encode worker
+    is busy. The encode itself joins the fair-share scheduler, which
+    queues encode_video on the bulk queue.
+    
     Args:
         video_id: ID of the Video object to process
         
@@ -28,17 +38,24 @@ def process_video(self, video_id):
         # Create processor
         processor = VideoProcessor(video_id)
         
-        # Process video
-        result = processor.process()
+        # Re-uploads reuse the outputs they already have
+        duplicate = processor.find_duplicate()
+        if duplicate:
+            processor.link_duplicate(duplicate)
+            print(f"♻️ Video {video_id} reused outputs of video {duplicate.id}")
+            return f"Video {video_id} reused outputs of video {duplicate.id}"
         
-        if result:
-            print(f"✅ Video {video_id} processed successfully")
-            return f"Video {video_id} processed successfully"
-        else:
-            video.refresh_from_db()
-            error_msg = video.error_message or "Unknown error"
-            print(f"❌ Video {video_id} processing failed: {error_msg}")
-            return f"Video {video_id} processing failed: {error_msg}"
+        if processor.prepare():
+            # Encodes are handed out fairly across uploaders
+            processor.set_stage('queued')
+            scheduler.enqueue(video_id)
+            print(f"📋 Video {video_id} prepared, encode queued")
+            return f"Video {video_id} prepared"
+        
+        video.refresh_from_db()
+        error_msg = video.error_message or "Unknown error"
+        print(f"❌ Video {video_id} processing failed: {error_msg}")
+        return f"Video {video_id} processing failed: {error_msg}"
             
     except Video.DoesNotExist:
         error_msg = f"Video {video_id} does not exist"
@@ -46,16 +63,249 @@ def process_video(self, video_id):
         return error_msg
         
     except Exception as e:
-        error_msg = f"Error processing video {video_id}: {str(e)}"
-        print(f"❌ {error_msg}")
+        mark_failed(video_id, e)
+        raise
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def encode_video(self, video_id):
+    """
+    Encode a prepared video on the bulk queue
+    
+    Acknowledged only once it finishes, so a video whose worker died is
+    delivered again. Waits for a free encode slot when
+    VIDEO_MAX_CONCURRENT_ENCODES videos are already being encoded.
+    
+    Args:
+        video_id: ID of a Video that went through VideoProcessor.prepare()
         
-        # Update video status
-        try:
-            video = Video.objects.get(id=video_id)
-            video.status = 'failed'
-            video.error_message = str(e)
-            video.save()
-        except:
-            pass
+    Returns:
+        str: Success or failure message
+    """
+    if not dispatch.acquire_encode_slot(video_id):
+        raise self.retry(countdown=settings.VIDEO_ENCODE_RETRY_DELAY, max_retries=None)
+    
+    # The fanned-out path keeps the slot until finalize_video
+    fanned_out = False
+    try:
+        processor = VideoProcessor(video_id)
+        
+        # One task per rendition. A redelivered encode only fans out the
+        # renditions an earlier attempt did not finish; with none left,
+        # encode() below skips straight to finishing the video.
+        qualities = []
+        if settings.VIDEO_PARALLEL_RENDITIONS:
+            qualities = processor.pending_qualities(processor.get_qualities())
+        
+        if qualities:
+            processor.set_stage('encoding')
             
-        raise
\ No newline at end of file
+            if processor.chunked:
+                # One task per (quality, chunk), joined per quality at the end
+                chunks = processor.plan_chunks()
+                chord(
+                    encode_chunk.s(video_id, quality, index, start, end, len(chunks))
+                    for quality in qualities
+                    for index, (start, end) in enumerate(chunks)
+                )(finalize_video.s(video_id, chunk_count=len(chunks)).on_error(encode_failed.s(video_id)))
+                fanned_out = True
+                print(f"🚀 Video {video_id} fanned out to {len(qualities) * len(chunks)} chunk tasks")
+                return f"Video {video_id} queued {len(qualities) * len(chunks)} chunks"
+
+            # The previews come with the lowest rendition, unless it is done already
+            if processor.get_qualities()[0] not in qualities:
+                processor.generate_trickplay()
+
+            chord(
+                encode_rendition.s(video_id, quality) for quality in qualities
+            )(finalize_video.s(video_id).on_error(encode_failed.s(video_id)))
+            fanned_out = True
+            print(f"🚀 Video {video_id} fanned out to {len(qualities)} rendition tasks")
+            return f"Video {video_id} queued {len(qualities)} renditions"
+        
+        if processor.encode():
+            print(f"✅ Video {video_id} processed successfully")
+            return f"Video {video_id} processed successfully"
+        
+        processor.video.refresh_from_db()
+        error_msg = processor.video.error_message or "Unknown error"
+        print(f"❌ Video {video_id} processing failed: {error_msg}")
+        return f"Video {video_id} processing failed: {error_msg}"
+    
+    except Video.DoesNotExist:
+        error_msg = f"Video {video_id} does not exist"
+        print(f"❌ {error_msg}")
+        return error_msg
+    
+    except Exception as e:
+        mark_failed(video_id, e)
+        raise
+    
+    finally:
+        if not fanned_out:
+            dispatch.release_encode_slot(video_id)
+            scheduler.dispatch()
+
+
+def mark_failed(video_id, error):
+    """Record an unexpected task error on the video"""
+    error_msg = f"Error processing video {video_id}: {str(error)}"
+    print(f"❌ {error_msg}")
+    
+    # Update video status
+    try:
+        video = Video.objects.get(id=video_id)
+        video.status = 'failed'
+        video.error_message = str(error)
+        video.save()
+    except:
+        pass
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def encode_rendition(video_id, quality):
+    """
+    Encode a single HLS rendition as its own task
+    
+    Runs in parallel with the other renditions of the same video, so
+    a 1080p encode no longer waits for the lower qualities.
+    
+    Returns:
+        str: The quality if it was encoded, otherwise None
+    """
+    processor = VideoProcessor(video_id)
+    if not processor.create_hls_stream(quality):
+        return None
+    
+    # Renditions finish in any order, so bump progress in the database
+    weights = processor.get_progress_weights(processor.get_qualities())
+    add_progress(video_id, 70 * weights.get(quality, 0))
+    return quality
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def encode_chunk(video_id, quality, index, start, end, chunk_count):
+    """
+    Encode one keyframe-aligned chunk of one rendition as its own task
+    
+    Returns:
+        list: [quality, index] if the chunk was encoded, otherwise None
+    """
+    processor = VideoProcessor(video_id)
+    # Redelivered after a worker died, the chunk may be done already
+    if not processor.chunk_done(quality, index, start, end):
+        if not processor.encode_chunk(quality, index, start, end):
+            return None
+        processor.record_chunk(quality, index, start, end)
+    
+    weights = processor.get_progress_weights(processor.get_qualities())
+    add_progress(video_id, 70 * weights.get(quality, 0) / chunk_count)
+    return [quality, index]
+
+
+def add_progress(video_id, step):
+    """Bump processing progress without overwriting other tasks' updates"""
+    Video.objects.filter(id=video_id).update(
+        processing_progress=Least(F('processing_progress') + max(int(step), 1), 90)
+    )
+    percent = Video.objects.filter(id=video_id).values_list('processing_progress', flat=True).first()
+    live_status.publish(video_id, status='processing', percent=percent, stage='encoding', eta=None)
+    # update() skips signals, so invalidate cached payloads here
+    touch_video(video_id)
+
+
+@shared_task
+def encode_failed(request, exc, traceback, video_id):
+    """
+    Error callback of a fanned-out encode
+    
+    A rendition or chunk task raised, e.g. at its hard time limit, so the
+    chord never calls finalize_video: fail the video and free its slot here.
+    """
+    dispatch.release_encode_slot(video_id)
+    mark_failed(video_id, exc)
+    scheduler.dispatch()
+
+
+@shared_task
+def finalize_video(results, video_id, chunk_count=None):
+    """
+    Write the master playlist once every rendition task has finished
+    
+    Args:
+        results: Return values of the encode_rendition or encode_chunk tasks
+        video_id: ID of the Video object to finalize
+        chunk_count: Number of chunks per quality when encoding in chunks
+    """
+    dispatch.release_encode_slot(video_id)
+    processor = VideoProcessor(video_id)
+    
+    if chunk_count:
+        # Only join qualities whose chunks all came back
+        encoded = {}
+        for result in filter(None, results):
+            encoded.setdefault(result[0], set()).add(result[1])
+        results = [
+            quality for quality, indexes in encoded.items()
+            if len(indexes) == chunk_count and processor.join_chunks(quality, chunk_count)
+        ]
+    # Renditions finished by an earlier attempt were not fanned out again
+    if not any(results) and not processor.video.qualities.exists():
+        processor.fail('HLS encoding failed for every quality')
+        scheduler.dispatch()
+        print(f"❌ Video {video_id} processing failed: no rendition was encoded")
+        return f"Video {video_id} processing failed"
+    
+    processor.create_master_playlist()
+    processor.finish()
+    scheduler.dispatch()
+    # Chunks each decode a slice, so the previews need a pass of their own
+    if chunk_count:
+        generate_trickplay.delay(video_id)
+    print(f"✅ Video {video_id} processed successfully")
+    return f"Video {video_id} processed successfully"
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def generate_trickplay(video_id):
+    """
+    Generate the preview sprite sheets of a chunked encode on the bulk queue
+    
+    Decodes the whole source, so it stays off the fast queue. The video is
+    playable meanwhile; players just get no previews until it finishes.
+    
+    Returns:
+        bool: Whether the sprite sheets and their index were written
+    """
+    try:
+        return VideoProcessor(video_id).generate_trickplay()
+    except Video.DoesNotExist:
+        print(f"❌ Video {video_id} does not exist")
+        return False
+
+
+@shared_task
+def flush_view_counts():
+    """
+    Periodic task moving buffered view counts into Video.views
+    
+    Returns:
+        str: How many videos got new views
+    """
+    video_ids = view_counter.flush()
+    if video_ids:
+        # The persisted count is part of cached payloads
+        touch_videos(video_ids)
+    return f"Flushed views of {len(video_ids)} videos"
+
+
+@shared_task
+def dispatch_encodes():
+    """
+    Periodic task filling free encode slots
+    
+    Finished encodes dispatch the next ones themselves; this catches
+    anything left waiting, e.g. after a worker restart.
+    """
+    dispatched = scheduler.dispatch()
+    return f"Dispatched {len(dispatched)} encodes"
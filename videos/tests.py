@@ -1,9 +1,43 @@
 
 # Create your tests here.
-from django.test import TestCase, Client
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import Counter
+from datetime import timedelta
+from io import StringIO
+from xml.etree import ElementTree
+from unittest import skipUnless
+from unittest.mock import MagicMock, patch
+
+import redis
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError
+from django.db.models import QuerySet
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth.models import User
 from django.urls import reverse
-from .models import Video
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .models import Video, VideoQuality, VideoSegment, UploadSession, ProcessingStage
+from .hls import parse_media_playlist, write_media_playlist
+from .tasks import process_video, encode_video, finalize_video, flush_view_counts
+from . import dispatch, scheduler, view_counter
+from .video_processor import VideoProcessor
+from core.celery import app as celery_app
+from core.metrics import observe_encode
+
+# Tests that clear the cache never touch a real Redis
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
 
 class VideoAdminTest(TestCase):
     def setUp(self):
@@ -43,4 +77,1254 @@ class VideoModelTest(TestCase):
             uploaded_by=user  # <--- This fixes the error!
         )
         
-        self.assertEqual(video.title, "My Test Video")
\ No newline at end of file
+        self.assertEqual(video.title, "My Test Video")
+
+class VideoProcessorTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        user = User.objects.create_user(username='uploader', password='password')
+        with patch('videos.dispatch.start_video_processing'):
+            self.video = Video.objects.create(
+                title="Processor Video",
+                uploaded_by=user,
+                original_file='videos/originals/test.mp4',
+                content_hash='0' * 64
+            )
+
+    def fake_ffmpeg(self, cmd, *args, **kwargs):
+        """Pretend to be FFmpeg by dropping two segments per rendition folder"""
+        output_dir = os.path.join(settings.MEDIA_ROOT, 'videos', 'processed', str(self.video.id))
+        for name in os.listdir(output_dir):
+            if not os.path.isdir(os.path.join(output_dir, name)):
+                continue
+            self.write_segments(os.path.join(output_dir, name), [10.0, 3.5])
+
+    def write_segments(self, quality_dir, durations):
+        """Write dummy segments and the playlist that lists them"""
+        segments = []
+        for i, duration in enumerate(durations):
+            with open(os.path.join(quality_dir, f'segment_{i:03d}.ts'), 'wb') as f:
+                f.write(b'\x00' * 188)
+            segments.append((f'segment_{i:03d}.ts', duration))
+        write_media_playlist(os.path.join(quality_dir, 'playlist.m3u8'), segments)
+
+    def test_single_pass_encodes_all_qualities_in_one_run(self):
+        self.video.duration = 20
+        self.video.save()
+        processor = VideoProcessor(self.video.id, single_pass=True)
+
+        with patch.object(VideoProcessor, 'run_ffmpeg', side_effect=self.fake_ffmpeg) as run, \
+                patch('videos.video_processor.observe_encode') as observe:
+            self.assertTrue(processor.create_hls_streams(['360p', '720p']))
+
+        self.assertEqual(run.call_count, 1)
+        # Throughput is labelled per rendition, flagged as sharing the run's wall time
+        self.assertEqual(
+            [(call.args[0], call.args[4]) for call in observe.call_args_list],
+            [('360p', True), ('720p', True)]
+        )
+        cmd = run.call_args[0][0]
+        self.assertIn(
+            '[0:v]split=3[s0][s1][s2];[s0]scale=640:360[v0];[s1]scale=1280:720[v1];'
+            '[s2]fps=1/10,scale=160:90,tile=10x10[tp]',
+            cmd
+        )
+        self.assertIn('v:0,a:0,name:360p v:1,a:1,name:720p', cmd)
+        # Scrub preview sprites are a second output of the same decode
+        self.assertEqual(cmd[-1], os.path.join(processor.output_dir, 'trickplay', 'sprite_%03d.jpg'))
+
+        self.assertEqual(
+            sorted(self.video.qualities.values_list('quality', flat=True)),
+            ['360p', '720p']
+        )
+        self.assertEqual(VideoSegment.objects.filter(quality__video=self.video).count(), 4)
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.hls_playlist, f'videos/processed/{self.video.id}/master.m3u8')
+
+    def test_lowest_quality_is_playable_before_the_rest(self):
+        self.video.width, self.video.height, self.video.status = 1280, 720, 'processing'
+        self.video.save()
+        processor = VideoProcessor(self.video.id, single_pass=True)
+        master = os.path.join(processor.output_dir, 'master.m3u8')
+        seen = []
+
+        def encode(cmd, *args, **kwargs):
+            # What a client polling the video sees when each encode starts
+            video = Video.objects.get(id=self.video.id)
+            seen.append((video.status, video.is_playable(), os.path.exists(master) and open(master).read()))
+            self.fake_ffmpeg(cmd)
+
+        with patch.object(VideoProcessor, 'run_ffmpeg', side_effect=encode) as run:
+            self.assertTrue(processor.encode())
+
+        # 360p alone, then one decode for the rest
+        self.assertEqual(run.call_count, 2)
+        self.assertEqual(seen[0], ('processing', False, False))
+        status, playable, playlist = seen[1]
+        self.assertEqual((status, playable), ('processing', True))
+        self.assertIn('360p/playlist.m3u8', playlist)
+        self.assertNotIn('480p/playlist.m3u8', playlist)
+
+        with open(master) as f:
+            self.assertEqual(f.read().count('#EXT-X-STREAM-INF'), 3)
+        self.assertEqual([name for name in os.listdir(processor.output_dir) if name.startswith('.')], [])
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.status, 'ready')
+
+    def test_encode_video_keeps_a_silent_source_silent(self):
+        # What process_video's probe found
+        self.video.width, self.video.height, self.video.status = 1280, 720, 'processing'
+        self.video.has_audio = False
+        self.video.save()
+
+        with patch('videos.dispatch.acquire_encode_slot', return_value=True), \
+                patch('videos.scheduler.dispatch'), \
+                patch.object(VideoProcessor, 'run_ffmpeg', side_effect=self.fake_ffmpeg) as run:
+            encode_video(self.video.id)
+
+        for call in run.call_args_list:
+            self.assertNotIn('0:a:0', call.args[0])
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.status, 'ready')
+        self.assertEqual(self.video.qualities.count(), 3)
+
+    @override_settings(VIDEO_TRICKPLAY=False)
+    def test_retry_after_a_crash_skips_intact_renditions(self):
+        self.video.width, self.video.height, self.video.status = 1280, 720, 'processing'
+        self.video.save()
+
+        class WorkerLost(BaseException):
+            pass
+
+        def crash_on_720p(cmd, *args, **kwargs):
+            if '720p' in cmd[-1]:
+                raise WorkerLost()
+            self.fake_ffmpeg(cmd)
+
+        processor = VideoProcessor(self.video.id, single_pass=False)
+        with patch.object(VideoProcessor, 'run_ffmpeg', side_effect=crash_on_720p):
+            with self.assertRaises(WorkerLost):
+                processor.encode()
+        self.assertEqual(
+            sorted(self.video.checkpoints.values_list('name', flat=True)),
+            ['rendition:360p', 'rendition:480p']
+        )
+
+        # A damaged segment is caught by its size
+        with open(os.path.join(processor.output_dir, '480p', 'segment_001.ts'), 'wb') as f:
+            f.write(b'\x00' * 100)
+
+        processor = VideoProcessor(self.video.id, single_pass=False)
+        with patch.object(VideoProcessor, 'run_ffmpeg', side_effect=self.fake_ffmpeg) as run:
+            self.assertTrue(processor.encode())
+
+        encoded = [os.path.basename(os.path.dirname(call.args[0][-1])) for call in run.call_args_list]
+        self.assertEqual(encoded, ['480p', '720p'])
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.status, 'ready')
+        self.assertEqual(self.video.qualities.count(), 3)
+        with open(os.path.join(processor.output_dir, 'master.m3u8')) as f:
+            self.assertEqual(f.read().count('#EXT-X-STREAM-INF'), 3)
+
+    @override_settings(VIDEO_PARALLEL_RENDITIONS=True)
+    def test_parallel_renditions_fan_out_and_finalize(self):
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        # What the skipped prepare() would have done
+        Video.objects.filter(id=self.video.id).update(status='processing')
+
+        with patch.object(VideoProcessor, 'prepare', return_value=True), \
+                patch.object(VideoProcessor, 'run_ffmpeg', side_effect=self.fake_ffmpeg) as run, \
+                self.captureOnCommitCallbacks(execute=True):
+            process_video.delay(self.video.id)
+
+        # One FFmpeg run per rendition, then the master playlist is written
+        self.assertEqual(run.call_count, 4)
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.status, 'ready')
+        self.assertEqual(self.video.qualities.count(), 4)
+        self.assertTrue(os.path.exists(os.path.join(
+            settings.MEDIA_ROOT, self.video.hls_playlist
+        )))
+
+    @override_settings(VIDEO_PARALLEL_RENDITIONS=True)
+    def test_failed_rendition_task_fails_the_video_and_frees_its_slot(self):
+        Video.objects.filter(id=self.video.id).update(status='processing')
+
+        with patch('videos.dispatch.acquire_encode_slot', return_value=True), \
+                patch('videos.tasks.chord') as fan_out:
+            encode_video(self.video.id)
+
+        # A header task that raises never reaches finalize_video, only its errback
+        body = fan_out.return_value.call_args.args[0]
+        errback = celery_app.signature(body.options['link_error'][0])
+        self.assertEqual(errback.task, 'videos.tasks.encode_failed')
+
+        with patch('videos.dispatch.release_encode_slot') as release, patch('videos.scheduler.dispatch'):
+            errback(MagicMock(), RuntimeError('Hard time limit exceeded'), None)
+
+        release.assert_called_once_with(self.video.id)
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.status, 'failed')
+        self.assertEqual(self.video.error_message, 'Hard time limit exceeded')
+
+    def test_chunked_previews_are_generated_on_the_bulk_queue(self):
+        with patch('videos.dispatch.release_encode_slot'), patch('videos.scheduler.dispatch'), \
+                patch.object(VideoProcessor, 'join_chunks', return_value=True), \
+                patch.object(VideoProcessor, 'create_master_playlist'), \
+                patch.object(VideoProcessor, 'finish'), \
+                patch.object(VideoProcessor, 'generate_trickplay') as generate, \
+                patch('videos.tasks.generate_trickplay.delay') as delay:
+            finalize_video([['360p', 0], ['360p', 1]], self.video.id, chunk_count=2)
+
+        # finalize_video runs on the fast queue, so it never decodes the source itself
+        generate.assert_not_called()
+        delay.assert_called_once_with(self.video.id)
+
+    @override_settings(VIDEO_CHUNK_DURATION=300)
+    def test_plan_chunks_starts_on_keyframes(self):
+        processor = VideoProcessor(self.video.id)
+        keyframes = [0.0, 120.0, 299.5, 301.2, 450.0, 602.4, 700.0]
+
+        with patch.object(VideoProcessor, 'get_keyframes', return_value=keyframes):
+            chunks = processor.plan_chunks()
+
+        self.assertEqual(chunks, [(0.0, 301.2), (301.2, 602.4), (602.4, None)])
+
+    def test_chunked_encode_joins_segments_in_order(self):
+        processor = VideoProcessor(self.video.id, chunked=True)
+        run = processor.start_run()
+
+        def fake_chunk_ffmpeg(cmd, *args, **kwargs):
+            chunk_dir = os.path.dirname(cmd[-1])
+            with open(cmd[-1], 'w') as f:
+                f.write('#EXTM3U\n')
+                for i, duration in enumerate([10.0, 4.5]):
+                    with open(os.path.join(chunk_dir, f'segment_{i:03d}.ts'), 'wb') as segment:
+                        segment.write(b'\x00' * 188)
+                    f.write(f'#EXTINF:{duration},\nsegment_{i:03d}.ts\n')
+                f.write('#EXT-X-ENDLIST\n')
+
+        saved_from = []
+        save = ProcessingStage.save
+
+        def record_thread(stage, *args, **kwargs):
+            saved_from.append(threading.current_thread())
+            save(stage, *args, **kwargs)
+
+        with patch.object(VideoProcessor, 'plan_chunks', return_value=[(0.0, 14.5), (14.5, None)]), \
+                patch.object(VideoProcessor, 'run_ffmpeg', side_effect=fake_chunk_ffmpeg), \
+                patch.object(ProcessingStage, 'save', record_thread):
+            self.assertEqual(processor.create_hls_streams_chunked(['360p']), ['360p'])
+
+        # Chunk threads leave their stages to the calling thread
+        self.assertEqual(set(saved_from), {threading.current_thread()})
+        self.assertEqual(
+            sorted(run.stages.values_list('name', flat=True)),
+            ['encode:360p:chunk_000', 'encode:360p:chunk_001', 'join:360p', 'playlist', 'save:360p']
+        )
+
+        quality_dir = os.path.join(processor.output_dir, '360p')
+        self.assertEqual(
+            parse_media_playlist(os.path.join(quality_dir, 'playlist.m3u8')),
+            [('segment_000.ts', 10.0), ('segment_001.ts', 4.5),
+             ('segment_002.ts', 10.0), ('segment_003.ts', 4.5)]
+        )
+        self.assertFalse(any(name.startswith('chunk_') for name in os.listdir(quality_dir)))
+        self.assertEqual(
+            list(VideoSegment.objects.filter(quality__video=self.video).values_list('segment_number', flat=True)),
+            [0, 1, 2, 3]
+        )
+
+    def test_ladder_never_upscales_and_keeps_aspect_ratio(self):
+        self.video.width, self.video.height, self.video.fps = 720, 480, 60.0
+        self.video.save()
+        processor = VideoProcessor(self.video.id)
+
+        self.assertEqual(processor.get_qualities(), ['360p', '480p'])
+        self.assertEqual(
+            processor.get_rendition('360p'),
+            {'width': 540, 'height': 360, 'bitrate': '750k'}
+        )
+        weights = processor.get_progress_weights(['360p', '480p'])
+        self.assertAlmostEqual(sum(weights.values()), 1.0)
+        self.assertGreater(weights['480p'], weights['360p'])
+
+    @override_settings(VIDEO_ENCODING_PROFILES={
+        'standard': {},
+        'fast': {'preset': 'veryfast', 'crf': 23, 'audio_bitrate': '96k'},
+    })
+    def test_encoding_profile_drives_ffmpeg_options(self):
+        self.video.fps, self.video.encoding_profile = 25.0, 'fast'
+        self.video.save()
+        processor = VideoProcessor(self.video.id, single_pass=True)
+
+        with patch.object(VideoProcessor, 'run_ffmpeg', side_effect=self.fake_ffmpeg) as run:
+            self.assertTrue(processor.create_hls_streams(['360p', '720p']))
+
+        cmd = ' '.join(run.call_args[0][0])
+        self.assertIn('-c:v:1 libx264 -preset:v:1 veryfast -crf:v:1 23 -maxrate:v:1 3750k', cmd)
+        self.assertIn('-g:v:0 50 -keyint_min:v:0 50', cmd)
+        self.assertIn('-c:a aac -b:a 96k', cmd)
+
+        self.video.encoding_profile = 'missing'
+        self.video.save()
+        with self.assertRaises(ImproperlyConfigured):
+            VideoProcessor(self.video.id)
+
+    @override_settings(VIDEO_ENCODING_PROFILES={'standard': {}, 'fast': {'preset': 'veryfast'}})
+    def test_unknown_encoding_profile_is_rejected_when_edited(self):
+        self.video.encoding_profile = 'fsat'
+        with self.assertRaises(ValidationError) as raised:
+            self.video.clean()
+        self.assertIn('encoding_profile', raised.exception.message_dict)
+
+        for name in ('', 'fast'):
+            self.video.encoding_profile = name
+            self.video.clean()
+
+    @override_settings(VIDEO_TRICKPLAY_INTERVAL=10, VIDEO_TRICKPLAY_GRID=(2, 1))
+    def test_trickplay_index_maps_intervals_to_tiles(self):
+        self.video.duration, self.video.width, self.video.height = 25, 1280, 720
+        self.video.save()
+        processor = VideoProcessor(self.video.id)
+
+        trickplay_dir = os.path.join(processor.output_dir, 'trickplay')
+        os.makedirs(trickplay_dir)
+        for name in ('sprite_000.jpg', 'sprite_001.jpg'):
+            open(os.path.join(trickplay_dir, name), 'wb').close()
+
+        self.assertTrue(processor.write_trickplay_index())
+
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.trickplay_vtt, f'videos/processed/{self.video.id}/trickplay/thumbnails.vtt')
+        with open(os.path.join(settings.MEDIA_ROOT, self.video.trickplay_vtt)) as f:
+            cues = f.read().split('\n\n')
+        self.assertEqual(cues[0], 'WEBVTT')
+        self.assertEqual(cues[1:], [
+            '00:00:00.000 --> 00:00:10.000\nsprite_000.jpg#xywh=0,0,160,90',
+            '00:00:10.000 --> 00:00:20.000\nsprite_000.jpg#xywh=160,0,160,90',
+            '00:00:20.000 --> 00:00:25.000\nsprite_001.jpg#xywh=0,0,160,90\n',
+        ])
+
+    def test_thumbnail_seeks_before_decoding(self):
+        self.video.duration, self.video.fps = 100, 25.0
+        self.video.save()
+        processor = VideoProcessor(self.video.id)
+
+        with patch.object(VideoProcessor, 'run_ffmpeg') as run:
+            self.assertTrue(processor.generate_thumbnail())
+
+        cmd = run.call_args[0][0]
+        # -ss before -i seeks in the demuxer instead of decoding up to it
+        self.assertLess(cmd.index('-ss'), cmd.index('-i'))
+        self.assertEqual(cmd[cmd.index('-ss') + 1], '10.000')
+        self.assertTrue(cmd[cmd.index('-vf') + 1].startswith('thumbnail=n=75,'))
+
+    def fake_fmp4_ffmpeg(self, cmd, *args, **kwargs):
+        """Pretend to be FFmpeg writing one byte-range fMP4 file per rendition folder"""
+        output_dir = os.path.join(settings.MEDIA_ROOT, 'videos', 'processed', str(self.video.id))
+        for name in os.listdir(output_dir):
+            if name == 'trickplay' or not os.path.isdir(os.path.join(output_dir, name)):
+                continue
+            # ftyp/moov with an avcC box (High profile, level 3.1), then two fragments
+            init = b'\x00' * 16 + b'avcC\x01\x64\x00\x1f' + b'\x00' * 8
+            with open(os.path.join(output_dir, name, 'stream.mp4'), 'wb') as f:
+                f.write(init + b'\x01' * 1000 + b'\x02' * 400)
+            with open(os.path.join(output_dir, name, 'playlist.m3u8'), 'w') as f:
+                f.write(
+                    '#EXTM3U\n#EXT-X-VERSION:7\n#EXT-X-TARGETDURATION:10\n#EXT-X-PLAYLIST-TYPE:VOD\n'
+                    f'#EXT-X-MAP:URI="stream.mp4",BYTERANGE="{len(init)}@0"\n'
+                    f'#EXTINF:10.000000,\n#EXT-X-BYTERANGE:1000@{len(init)}\nstream.mp4\n'
+                    '#EXTINF:4.500000,\n#EXT-X-BYTERANGE:400\nstream.mp4\n#EXT-X-ENDLIST\n'
+                )
+
+    @override_settings(VIDEO_SEGMENT_FORMAT='fmp4')
+    def test_fmp4_renditions_are_single_files_shared_with_dash(self):
+        self.video.width, self.video.height, self.video.duration = 854, 480, 14
+        self.video.save()
+        processor = VideoProcessor(self.video.id, single_pass=True)
+
+        with patch.object(VideoProcessor, 'run_ffmpeg', side_effect=self.fake_fmp4_ffmpeg) as run:
+            self.assertTrue(processor.create_hls_streams(['360p', '480p']))
+
+        cmd = ' '.join(run.call_args[0][0])
+        self.assertIn('-hls_segment_type fmp4 -hls_flags single_file', cmd)
+        # Audio is its own rendition, written along with the lowest quality
+        self.assertIn('-var_stream_map v:0,name:360p v:1,name:480p', cmd)
+        self.assertIn(f'{processor.output_dir}/audio/playlist.m3u8', cmd)
+
+        # No row per segment: the byte ranges live in the index
+        self.assertEqual(VideoSegment.objects.filter(quality__video=self.video).count(), 0)
+        quality = self.video.qualities.get(quality='360p')
+        self.assertEqual(quality.segment_index['offsets'], [32, 1032])
+        self.assertEqual(quality.segment_index['sizes'], [1000, 400])
+        self.assertEqual(quality.segment_index['init'], [0, 32])
+        self.assertEqual(quality.file_size, 1432)
+
+        with open(os.path.join(processor.output_dir, 'master.m3u8')) as f:
+            master = f.read()
+        self.assertIn('#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="audio"', master)
+        self.assertIn('RESOLUTION=640x360,AUDIO="audio"\n360p/playlist.m3u8', master)
+
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.dash_manifest, f'videos/processed/{self.video.id}/manifest.mpd')
+        namespace = {'mpd': 'urn:mpeg:dash:schema:mpd:2011'}
+        mpd = ElementTree.parse(os.path.join(settings.MEDIA_ROOT, self.video.dash_manifest)).getroot()
+        # The segments, not the whole-second Video.duration, decide how long it lasts
+        self.assertEqual(mpd.get('mediaPresentationDuration'), 'PT14.500S')
+        video, audio = mpd.findall('.//mpd:AdaptationSet', namespace)
+        representation = video.find('mpd:Representation', namespace)
+        self.assertEqual(representation.get('codecs'), 'avc1.64001F')
+        self.assertEqual(representation.find('mpd:BaseURL', namespace).text, '360p/stream.mp4')
+        self.assertEqual(representation.find('.//mpd:Initialization', namespace).get('range'), '0-31')
+        self.assertEqual(
+            [url.get('mediaRange') for url in representation.findall('.//mpd:SegmentURL', namespace)],
+            ['32-1031', '1032-1431']
+        )
+        self.assertEqual(
+            [(s.get('t'), s.get('d')) for s in representation.findall('.//mpd:S', namespace)],
+            [('0', '10000'), ('10000', '4500')]
+        )
+        self.assertEqual(audio.find('mpd:Representation', namespace).get('codecs'), 'mp4a.40.2')
+
+    def test_ladder_for_portrait_and_tiny_sources(self):
+        self.video.width, self.video.height = 1080, 1920
+        self.video.save()
+        processor = VideoProcessor(self.video.id)
+        self.assertEqual(processor.get_qualities(), ['360p', '480p', '720p', '1080p'])
+        self.assertEqual(processor.get_rendition('720p')['width'], 720)
+        self.assertEqual(processor.get_rendition('720p')['height'], 1280)
+
+        self.video.width, self.video.height = 320, 240
+        self.video.save()
+        self.assertEqual(VideoProcessor(self.video.id).get_qualities(), ['360p'])
+
+    def test_save_quality_replaces_segments_in_bulk(self):
+        processor = VideoProcessor(self.video.id)
+        quality_dir = os.path.join(processor.output_dir, '360p')
+        os.makedirs(quality_dir)
+        self.write_segments(quality_dir, [10.0] * 5)
+        processor.save_quality('360p')
+
+        # A shorter re-encode must not leave stale rows behind
+        for i in (3, 4):
+            os.remove(os.path.join(quality_dir, f'segment_{i:03d}.ts'))
+        self.write_segments(quality_dir, [10.0] * 3)
+        # Plus one for the rendition's checkpoint
+        with self.assertNumQueries(10):
+            quality = processor.save_quality('360p')
+
+        self.assertEqual(list(quality.segments.values_list('segment_number', flat=True)), [0, 1, 2])
+
+    def test_segment_index_uses_real_durations(self):
+        processor = VideoProcessor(self.video.id)
+        quality_dir = os.path.join(processor.output_dir, '360p')
+        os.makedirs(quality_dir)
+        self.write_segments(quality_dir, [10.0, 8.4, 10.0, 2.25])
+
+        quality = processor.save_quality('360p')
+
+        self.assertEqual(quality.segment_index['starts'], [0.0, 10.0, 18.4, 28.4])
+        self.assertEqual(quality.segment_index['sizes'], [188] * 4)
+        self.assertEqual(quality.file_size, 188 * 4)
+        self.assertEqual(list(quality.segments.values_list('duration', flat=True)), [10.0, 8.4, 10.0, 2.25])
+        self.assertEqual(quality.segment_at(0), 0)
+        self.assertEqual(quality.segment_at(18.4), 2)
+        self.assertEqual(quality.segment_at(25), 2)
+        self.assertEqual(quality.segment_at(999), 3)
+        self.assertEqual(quality.segment_range(9, 19), (0, 2))
+
+    @skipUnless(shutil.which('ffmpeg'), 'FFmpeg is not installed')
+    def test_run_ffmpeg_streams_progress(self):
+        processor = VideoProcessor(self.video.id)
+        seen = []
+
+        processor.run_ffmpeg([
+            'ffmpeg', '-f', 'lavfi', '-i', 'testsrc=duration=2:size=160x90',
+            '-f', 'null', '-'
+        ], seen.append)
+
+        self.assertTrue(seen)
+        self.assertAlmostEqual(seen[-1], 2.0, delta=0.1)
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            processor.run_ffmpeg(['ffmpeg', '-i', 'missing.mp4', '-f', 'null', '-'])
+
+    def test_processing_run_records_every_stage(self):
+        self.video.width, self.video.height = 854, 480
+        self.video.save()
+        processor = VideoProcessor(self.video.id, single_pass=False)
+
+        with patch.object(VideoProcessor, 'extract_metadata', return_value=True), \
+                patch.object(VideoProcessor, 'run_ffmpeg', side_effect=self.fake_ffmpeg):
+            self.assertTrue(processor.process())
+
+        run = self.video.processing_runs.get()
+        self.assertEqual((run.status, run.mode, run.profile), ('succeeded', 'per_quality', 'standard'))
+        self.assertIsNotNone(run.finished_at)
+        self.assertEqual(list(run.stages.values_list('name', flat=True)), [
+            'metadata', 'thumbnail', 'encode:360p', 'save:360p', 'playlist',
+            'encode:480p', 'save:480p', 'playlist'
+        ])
+        encode = run.stages.get(name='encode:480p')
+        self.assertGreater(encode.output_bytes, 0)
+        self.assertGreaterEqual(encode.cpu_seconds, 0)
+
+        client = APIClient()
+        client.force_authenticate(self.video.uploaded_by)
+        response = client.get(reverse('video-runs', args=[self.video.id]))
+        self.assertEqual(response.data[0]['status'], 'succeeded')
+        self.assertEqual(len(response.data[0]['stages']), 8)
+
+    def test_failed_stage_keeps_exit_code(self):
+        processor = VideoProcessor(self.video.id)
+        processor.start_run()
+        error = subprocess.CalledProcessError(183, ['ffmpeg'])
+
+        with patch.object(VideoProcessor, 'run_ffmpeg', side_effect=error):
+            self.assertFalse(processor.create_hls_stream('360p'))
+        processor.fail('HLS encoding failed')
+
+        run = self.video.processing_runs.get()
+        stage = run.stages.get()
+        self.assertEqual((stage.name, stage.exit_code), ('encode:360p', 183))
+        self.assertIn('183', stage.error)
+        self.assertEqual(run.status, 'failed')
+
+    @override_settings(VIDEO_LIVE_STATUS=False)
+    def test_progress_saves_are_throttled(self):
+        self.video.duration = 100
+        self.video.save()
+        processor = VideoProcessor(self.video.id)
+        on_progress = processor.encode_progress(20, 70)
+
+        # One progress save, the cache version bump included
+        with self.assertNumQueries(1):
+            for seconds in range(0, 100, 5):
+                on_progress(seconds)
+
+        self.assertEqual(processor.video.processing_progress, 86)
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.processing_progress, 20)
+
+    def test_live_progress_goes_to_redis_only(self):
+        self.video.duration = 100
+        self.video.status = 'processing'
+        self.video.save()
+        processor = VideoProcessor(self.video.id)
+        on_progress = processor.encode_progress(20, 70)
+
+        with patch('videos.live_status.publish') as publish, self.assertNumQueries(0):
+            for seconds in range(0, 100, 5):
+                on_progress(seconds)
+
+        self.assertEqual(publish.call_count, 20)
+        self.assertEqual(publish.call_args.kwargs['percent'], 86)
+        self.assertEqual(publish.call_args.kwargs['status'], 'processing')
+
+
+class VideoLiveStatusTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='viewer', password='password')
+        with patch('videos.dispatch.start_video_processing'):
+            self.video = Video.objects.create(title="Live Video", uploaded_by=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('video-live-status', args=[self.video.id])
+
+    def test_status_is_served_from_redis_without_queries(self):
+        redis_client = MagicMock()
+        redis_client.hgetall.return_value = {
+            'status': 'processing', 'percent': '42', 'stage': 'encoding', 'eta': '90'
+        }
+
+        with patch('videos.live_status.get_redis', return_value=redis_client), \
+                self.assertNumQueries(0):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            'id': self.video.id, 'status': 'processing', 'percent': 42, 'stage': 'encoding', 'eta': 90,
+            'playable': False
+        })
+        redis_client.hgetall.assert_called_once_with(f'video:{self.video.id}:status')
+
+    def test_status_falls_back_to_the_row(self):
+        with patch('videos.live_status.read', return_value=None):
+            response = self.client.get(self.url)
+            missing = self.client.get(reverse('video-live-status', args=[self.video.id + 1]))
+
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertEqual(response.data['percent'], 0)
+        self.assertEqual(missing.status_code, 404)
+
+
+class VideoDeduplicationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='uploader', password='password')
+
+    def create_video(self, **fields):
+        with patch('videos.dispatch.start_video_processing'):
+            return Video.objects.create(uploaded_by=self.user, **fields)
+
+    def test_worker_hashes_the_upload(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        os.makedirs(os.path.join(media_root, 'videos', 'originals'))
+        with open(os.path.join(media_root, 'videos', 'originals', 'clip.mp4'), 'wb') as f:
+            f.write(b'same bytes' * 1000)
+        video = self.create_video(title="Clip", original_file='videos/originals/clip.mp4')
+        self.assertEqual(video.content_hash, '')
+
+        with override_settings(MEDIA_ROOT=media_root):
+            self.assertIsNone(VideoProcessor(video.id).find_duplicate())
+
+        video.refresh_from_db()
+        self.assertEqual(video.content_hash, hashlib.sha256(b'same bytes' * 1000).hexdigest())
+
+    def test_reupload_links_existing_outputs(self):
+        source = self.create_video(
+            title="Original", original_file='videos/originals/a.mp4', content_hash='a' * 64,
+            status='ready', duration=20, width=1280, height=720,
+            hls_playlist='videos/processed/1/master.m3u8', thumbnail='videos/thumbnails/1.jpg'
+        )
+        quality = VideoQuality.objects.create(
+            video=source, quality='360p', file_path='videos/processed/1/360p/playlist.m3u8',
+            file_size=376, bitrate=500, segment_index={'starts': [0.0, 10.0]}
+        )
+        for i in range(2):
+            VideoSegment.objects.create(
+                quality=quality, segment_number=i,
+                file_path=f'videos/processed/1/360p/segment_{i:03d}.ts', duration=10.0
+            )
+        copy = self.create_video(
+            title="Copy", original_file='videos/originals/b.mp4', content_hash='a' * 64
+        )
+
+        with patch.object(VideoProcessor, 'run_ffmpeg') as run_ffmpeg:
+            self.assertTrue(VideoProcessor(copy.id).process())
+
+        run_ffmpeg.assert_not_called()
+        copy.refresh_from_db()
+        self.assertEqual(copy.status, 'ready')
+        self.assertEqual(copy.hls_playlist, source.hls_playlist)
+        self.assertEqual(copy.thumbnail.name, source.thumbnail.name)
+        self.assertEqual(copy.width, 1280)
+        copied = copy.qualities.get()
+        self.assertEqual(copied.segment_index, {'starts': [0.0, 10.0]})
+        self.assertEqual(copied.segments.count(), 2)
+
+
+class ResumableUploadTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.user = User.objects.create_user(username='uploader', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.content = os.urandom(3000)
+
+    def put_chunk(self, session_id, start, end):
+        return self.client.put(
+            reverse('upload-chunk', args=[session_id]),
+            data=self.content[start:end + 1],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.content)}'
+        )
+
+    def test_chunks_resume_and_complete_into_a_video(self):
+        response = self.client.post(reverse('upload-list'), {
+            'title': 'Big upload', 'filename': 'big movie.mp4', 'total_size': len(self.content)
+        })
+        self.assertEqual(response.status_code, 201)
+        session_id = response.data['id']
+
+        self.assertEqual(self.put_chunk(session_id, 0, 999).data['received_bytes'], 1000)
+
+        # A retried or out-of-order chunk is rejected with the resume offset
+        response = self.put_chunk(session_id, 2000, 2999)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['received_bytes'], 1000)
+
+        response = self.client.post(reverse('upload-complete', args=[session_id]))
+        self.assertEqual(response.status_code, 409)
+
+        self.put_chunk(session_id, 1000, 1999)
+        self.put_chunk(session_id, 2000, 2999)
+        self.assertEqual(
+            self.client.get(reverse('upload-detail', args=[session_id])).data['received_bytes'], 3000
+        )
+
+        with patch('videos.dispatch.start_video_processing'):
+            response = self.client.post(reverse('upload-complete', args=[session_id]))
+        self.assertEqual(response.status_code, 201)
+
+        video = Video.objects.get(id=response.data['id'])
+        self.assertEqual(video.uploaded_by, self.user)
+        self.assertEqual(video.original_file.name, 'videos/originals/big_movie.mp4')
+        with video.original_file.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(UploadSession.objects.get(id=session_id).video, video)
+
+    def test_chunk_body_must_match_its_range(self):
+        session = UploadSession.objects.create(
+            uploaded_by=self.user, title='Mine', filename='a.mp4', total_size=len(self.content)
+        )
+        url = reverse('upload-chunk', args=[session.id])
+        for body in (b'', self.content[:10]):
+            response = self.client.put(
+                url, data=body, content_type='application/octet-stream',
+                HTTP_CONTENT_RANGE=f'bytes 0-999/{len(self.content)}'
+            )
+            self.assertEqual(response.status_code, 400)
+        session.refresh_from_db()
+        self.assertEqual(session.received_bytes, 0)
+
+    def test_complete_checks_the_file_and_runs_once(self):
+        session = UploadSession.objects.create(
+            uploaded_by=self.user, title='Mine', filename='a.mp4',
+            total_size=len(self.content), received_bytes=len(self.content)
+        )
+        os.makedirs(os.path.dirname(session.part_path))
+        # A dropped retry left the file shorter than the counted bytes
+        with open(session.part_path, 'wb') as f:
+            f.write(self.content[:2500])
+        url = reverse('upload-complete', args=[session.id])
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['received_bytes'], 2500)
+        self.assertFalse(Video.objects.exists())
+
+        self.assertEqual(self.put_chunk(session.id, 2500, 2999).status_code, 200)
+        with patch('videos.dispatch.start_video_processing'):
+            first = self.client.post(url)
+            again = self.client.post(url)
+        self.assertEqual((first.status_code, again.status_code), (201, 200))
+        self.assertEqual(again.data['id'], first.data['id'])
+        self.assertEqual(Video.objects.count(), 1)
+
+    def test_sessions_are_private(self):
+        other = User.objects.create_user(username='other', password='password')
+        session = UploadSession.objects.create(
+            uploaded_by=other, title='Theirs', filename='a.mp4', total_size=10
+        )
+        self.assertEqual(self.put_chunk(session.id, 0, 9).status_code, 404)
+
+
+class VideoStreamTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.content = bytes(range(256)) * 4
+        os.makedirs(os.path.join(media_root, 'videos', 'originals'))
+        with open(os.path.join(media_root, 'videos', 'originals', 'clip.mp4'), 'wb') as f:
+            f.write(self.content)
+
+        user = User.objects.create_user(username='viewer', password='password')
+        with patch('videos.dispatch.start_video_processing'):
+            self.video = Video.objects.create(
+                title="Stream", uploaded_by=user, original_file='videos/originals/clip.mp4'
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.url = reverse('video-stream', args=[self.video.id])
+
+    def test_whole_file_without_range(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_single_range_is_partial_content(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-24')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-24:])
+
+    def test_multiple_ranges_are_multipart(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9,500-509')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        body = b''.join(response.streaming_content)
+        self.assertIn(f'Content-Range: bytes 500-509/{len(self.content)}'.encode(), body)
+        self.assertIn(self.content[500:510], body)
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    @override_settings(VIDEO_STREAM_ACCEL_REDIRECT='/protected-media/')
+    def test_accel_redirect_hands_bytes_to_nginx(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/videos/originals/clip.mp4')
+        self.assertEqual(response.content, b'')
+
+
+class VideoListTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='viewer', password='password')
+        self.other = User.objects.create_user(username='other', password='password')
+        with patch('videos.dispatch.start_video_processing'):
+            for i in range(25):
+                video = Video.objects.create(
+                    title=f"Video {i}",
+                    uploaded_by=self.user if i % 2 else self.other,
+                    status='ready' if i % 3 else 'pending'
+                )
+                VideoQuality.objects.create(
+                    video=video, quality='360p', file_path='x', file_size=1, bitrate=500
+                )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_query_count_is_flat(self):
+        # page, uploaders joined in, qualities prefetched
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('video-list'))
+
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertEqual(response.data['results'][0]['title'], "Video 24")
+        self.assertEqual(response.data['results'][0]['uploaded_by'], 'other')
+        self.assertEqual(len(response.data['results'][0]['qualities']), 1)
+
+    def test_cursor_pages_cover_every_video_once(self):
+        titles = []
+        url = reverse('video-list') + '?page_size=10'
+        while url:
+            response = self.client.get(url)
+            titles += [video['title'] for video in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(titles, [f"Video {i}" for i in range(24, -1, -1)])
+
+    def test_filters(self):
+        response = self.client.get(reverse('video-list'), {
+            'status': 'ready', 'uploaded_by': self.user.id, 'page_size': 100
+        })
+        expected = [f"Video {i}" for i in range(24, -1, -1) if i % 2 and i % 3]
+        self.assertEqual([video['title'] for video in response.data['results']], expected)
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class VideoResponseCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='viewer', password='password')
+        with patch('videos.dispatch.start_video_processing'):
+            self.video = Video.objects.create(title="Cached", uploaded_by=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('video-detail', args=[self.video.id])
+
+    def test_detail_etag_and_not_modified(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('ETag', first)
+        self.assertIn('Last-Modified', first)
+
+        # Repeat reads skip the serializer and the database
+        with self.assertNumQueries(0):
+            again = self.client.get(self.url)
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.data, first.data)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], first['ETag'])
+
+    def test_saves_invalidate_detail_and_list(self):
+        detail = self.client.get(self.url)
+        listing = self.client.get(reverse('video-list'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.video.title = "Renamed"
+            self.video.save()
+            VideoQuality.objects.create(video=self.video, quality='360p', file_path='x', file_size=1, bitrate=500)
+
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=detail['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.data['title'], "Renamed")
+        self.assertEqual(len(changed.data['qualities']), 1)
+
+        changed_list = self.client.get(reverse('video-list'), HTTP_IF_NONE_MATCH=listing['ETag'])
+        self.assertEqual(changed_list.status_code, 200)
+        self.assertEqual(changed_list.data['results'][0]['title'], "Renamed")
+
+    def test_invalidation_waits_for_the_commit(self):
+        detail = self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.video.title = "Renamed"
+            self.video.save()
+            # A poll before the commit still sees the old version
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=detail['ETag']).status_code, 304)
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=detail['ETag']).status_code, 200)
+
+    def test_saves_survive_a_cache_outage(self):
+        with patch.object(cache, 'delete_many', side_effect=redis.ConnectionError("down")), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.video.title = "Renamed"
+            self.video.save()
+
+        self.assertEqual(Video.objects.get(id=self.video.id).title, "Renamed")
+
+    def test_unknown_video_is_404(self):
+        self.assertEqual(self.client.get(reverse('video-detail', args=[999])).status_code, 404)
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class VideoViewCountTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='viewer', password='password')
+        with patch('videos.dispatch.start_video_processing'):
+            self.video = Video.objects.create(title="Popular", uploaded_by=self.user, views=10)
+            self.other = Video.objects.create(title="Niche", uploaded_by=self.user, views=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.redis = MagicMock()
+        self.redis.exists.return_value = 0
+
+    def test_views_are_buffered_without_queries(self):
+        self.client.get(reverse('video-detail', args=[self.video.id]))
+
+        with patch('videos.live_status.get_redis', return_value=self.redis), \
+                self.assertNumQueries(0):
+            response = self.client.post(reverse('video-view', args=[self.video.id]))
+
+        self.assertEqual(response.status_code, 204)
+        self.redis.hincrby.assert_called_once_with('videos:views:pending', self.video.id, 1)
+
+    def test_views_fall_back_to_an_atomic_update(self):
+        self.redis.hincrby.side_effect = redis.RedisError("down")
+        with patch('videos.live_status.get_redis', return_value=self.redis):
+            self.video.increment_views()
+
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.views, 11)
+
+    def test_responses_include_pending_views(self):
+        # Views buffered since the last flush, and views of a flush still in progress
+        buffered = {view_counter.PENDING_KEY: {self.video.id: '5'}, view_counter.FLUSHING_KEY: {self.video.id: '2'}}
+        pipe = self.redis.pipeline.return_value
+        pipe.execute.side_effect = lambda: [
+            [buffered[key].get(i) for i in ids] for key, ids in (call.args for call in pipe.hmget.call_args_list[-2:])
+        ]
+        with patch('videos.live_status.get_redis', return_value=self.redis):
+            detail = self.client.get(reverse('video-detail', args=[self.video.id]))
+            listing = self.client.get(reverse('video-list'))
+
+        self.assertEqual(detail.data['views'], 17)
+        views = {video['id']: video['views'] for video in listing.data['results']}
+        self.assertEqual(views, {self.video.id: 17, self.other.id: 1})
+
+    def test_flush_applies_counts_and_invalidates_cache(self):
+        self.redis.hgetall.return_value = {str(self.video.id): '3', str(self.other.id): '3'}
+        self.video.refresh_from_db()
+        version = self.video.version
+
+        with patch('videos.live_status.get_redis', return_value=self.redis):
+            result = flush_view_counts()
+
+        self.assertEqual(result, "Flushed views of 2 videos")
+        self.video.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.video.views, self.other.views), (13, 4))
+        self.assertEqual(self.video.version, version + 1)
+        self.redis.delete.assert_called_once()
+
+    def test_failed_flush_never_counts_twice(self):
+        self.redis.hgetall.return_value = {str(self.video.id): '3', str(self.other.id): '2'}
+        update = QuerySet.update
+        calls = []
+
+        def fail_second_update(queryset, **kwargs):
+            calls.append(kwargs)
+            if len(calls) == 2:
+                raise DatabaseError("connection lost")
+            return update(queryset, **kwargs)
+
+        with patch('videos.live_status.get_redis', return_value=self.redis), \
+                patch.object(QuerySet, 'update', fail_second_update):
+            with self.assertRaises(DatabaseError):
+                view_counter.flush()
+
+        # The first UPDATE was rolled back with the second, and the counts stay buffered
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.views, 10)
+        self.redis.delete.assert_not_called()
+
+        # The next flush applies the leftover hash before taking new views
+        self.redis.exists.return_value = 1
+        with patch('videos.live_status.get_redis', return_value=self.redis):
+            self.assertEqual(sorted(view_counter.flush()), sorted([self.video.id, self.other.id]))
+        self.redis.rename.assert_called_once()
+        self.video.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.video.views, self.other.views), (13, 3))
+        self.redis.delete.assert_called_once_with(view_counter.FLUSHING_KEY)
+
+    def test_only_one_flush_at_a_time(self):
+        self.redis.lock.return_value.acquire.return_value = False
+        with patch('videos.live_status.get_redis', return_value=self.redis):
+            self.assertEqual(view_counter.flush(), [])
+        self.redis.rename.assert_not_called()
+
+    def test_flush_with_empty_buffer(self):
+        self.redis.rename.side_effect = redis.ResponseError("no such key")
+        with patch('videos.live_status.get_redis', return_value=self.redis):
+            self.assertEqual(flush_view_counts(), "Flushed views of 0 videos")
+
+
+class VideoDispatchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='uploader', password='password')
+
+    def create_video(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            video = Video.objects.create(
+                title="Queued", uploaded_by=self.user, original_file='videos/originals/queued.mp4'
+            )
+        # Processing and the cache invalidation both wait for the commit
+        self.assertEqual(len(callbacks), 2)
+        return video
+
+    def test_celery_backend_queues_after_commit(self):
+        with patch('videos.tasks.process_video.delay') as delay:
+            video = self.create_video()
+        delay.assert_called_once_with(video.id)
+
+    @override_settings(VIDEO_PROCESSING_BACKEND='inline')
+    def test_inline_backend_processes_synchronously(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media_root), \
+                patch.object(VideoProcessor, 'process', return_value=True) as process:
+            self.create_video()
+        process.assert_called_once_with()
+
+    @override_settings(VIDEO_PROCESSING_BACKEND='disabled')
+    def test_disabled_backend_does_nothing(self):
+        with patch('videos.tasks.process_video.delay') as delay, \
+                patch.object(VideoProcessor, 'process') as process:
+            self.create_video()
+        delay.assert_not_called()
+        process.assert_not_called()
+
+    @override_settings(VIDEO_MAX_CONCURRENT_ENCODES=2)
+    def test_encode_slots_are_bounded(self):
+        redis_client = MagicMock()
+        redis_client.pipeline.return_value.execute.side_effect = [[0, 1, 1], [0, 1, 2]]
+
+        with patch('videos.live_status.get_redis', return_value=redis_client):
+            self.assertTrue(dispatch.acquire_encode_slot(1))
+            self.assertFalse(dispatch.acquire_encode_slot(2))
+
+        redis_client.zrem.assert_called_once_with(dispatch.SLOTS_KEY, 2)
+
+    def test_encode_video_waits_for_a_slot(self):
+        with patch('videos.dispatch.acquire_encode_slot', return_value=False), \
+                patch.object(VideoProcessor, 'encode') as encode, \
+                patch.object(encode_video, 'retry', side_effect=RuntimeError('retry')) as retry:
+            with self.assertRaisesMessage(RuntimeError, 'retry'):
+                encode_video(1)
+
+        encode.assert_not_called()
+        self.assertIsNone(retry.call_args.kwargs['max_retries'])
+
+    def test_quick_stages_and_encodes_use_separate_queues(self):
+        router = celery_app.amqp.router
+        route = lambda name: router.route({}, name)['queue'].name
+
+        self.assertEqual(route('videos.tasks.process_video'), 'fast')
+        self.assertEqual(route('videos.tasks.finalize_video'), 'fast')
+        self.assertEqual(route('videos.tasks.encode_video'), 'bulk')
+        self.assertEqual(route('videos.tasks.encode_rendition'), 'bulk')
+        self.assertEqual(route('videos.tasks.encode_chunk'), 'bulk')
+        self.assertEqual(route('videos.tasks.generate_trickplay'), 'bulk')
+
+    def test_encodes_outlast_the_default_time_limit(self):
+        for name in ('encode_video', 'encode_rendition', 'encode_chunk', 'generate_trickplay'):
+            task = celery_app.tasks[f'videos.tasks.{name}']
+            self.assertGreater(task.soft_time_limit, settings.CELERY_TASK_TIME_LIMIT)
+            self.assertGreater(task.time_limit, task.soft_time_limit)
+            # Not redelivered while still running
+            self.assertGreater(settings.CELERY_BROKER_TRANSPORT_OPTIONS['visibility_timeout'], task.time_limit)
+
+    def test_process_video_prepares_then_queues_the_encode(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        video = Video.objects.create(
+            title="Fresh", uploaded_by=self.user, original_file='videos/originals/fresh.mp4',
+            content_hash='1' * 64, status='processing'
+        )
+
+        with override_settings(MEDIA_ROOT=media_root), \
+                patch.object(VideoProcessor, 'prepare', return_value=True), \
+                patch.object(VideoProcessor, 'encode') as encode, \
+                patch('videos.tasks.encode_video.delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            process_video(video.id)
+
+        encode.assert_not_called()
+        delay.assert_called_once_with(video.id)
+
+
+@override_settings(VIDEO_MAX_CONCURRENT_ENCODES=2, VIDEO_MAX_ENCODES_PER_USER=1)
+class FairShareSchedulerTest(TestCase):
+    def setUp(self):
+        self.heavy = User.objects.create_user(username='heavy', password='password')
+        self.light = User.objects.create_user(username='light', password='password')
+        self.bulk = [self.queue_video(self.heavy, f"Bulk {i}") for i in range(5)]
+        self.single = self.queue_video(self.light, "Single")
+
+    def queue_video(self, user, title):
+        video = Video.objects.create(title=title, uploaded_by=user, status='processing')
+        with patch('videos.tasks.encode_video.delay'):
+            scheduler.enqueue(video.id)
+        return video
+
+    def test_uploaders_take_turns(self):
+        # The first bulk upload took one slot, the light uploader gets the other
+        self.assertEqual(
+            list(scheduler.running_encodes().order_by('id').values_list('id', flat=True)),
+            [self.bulk[0].id, self.single.id]
+        )
+        self.assertIsNone(scheduler.queue_position(self.single.id))
+        self.assertEqual(scheduler.queue_position(self.bulk[1].id), 1)
+        self.assertEqual(scheduler.queue_position(self.bulk[4].id), 4)
+
+    def test_new_uploader_jumps_ahead_of_a_backlog(self):
+        other = User.objects.create_user(username='other', password='password')
+        late = self.queue_video(other, "Late")
+        Video.objects.filter(id=self.single.id).update(status='ready')
+
+        with patch('videos.tasks.encode_video.delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            dispatched = scheduler.dispatch()
+
+        self.assertEqual(dispatched, [late.id])
+        delay.assert_called_once_with(late.id)
+
+    def test_dispatch_locks_the_queue_before_counting(self):
+        Video.objects.filter(id=self.single.id).update(status='ready')
+        calls = []
+        lock = QuerySet.select_for_update
+
+        def record_lock(queryset, *args, **kwargs):
+            calls.append('lock')
+            return lock(queryset, *args, **kwargs)
+
+        with patch.object(QuerySet, 'select_for_update', record_lock), \
+                patch('videos.scheduler.plan', side_effect=lambda: calls.append('plan') or (Counter(), [])):
+            scheduler.dispatch()
+
+        # A concurrent dispatcher waits on the lock, then counts this one's claims
+        self.assertEqual(calls, ['lock', 'plan'])
+
+    def test_per_user_cap_leaves_slots_free(self):
+        Video.objects.filter(id=self.single.id).update(status='ready')
+
+        with patch('videos.tasks.encode_video.delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(scheduler.dispatch(), [])
+        delay.assert_not_called()
+
+    def test_dead_encodes_give_their_slot_back(self):
+        # The light uploader's encode died without reaching mark_failed
+        Video.objects.filter(id=self.single.id).update(
+            dispatched_at=timezone.now() - timedelta(seconds=settings.VIDEO_ENCODE_SLOT_TTL + 1)
+        )
+
+        other = User.objects.create_user(username='other', password='password')
+        late = self.queue_video(other, "Late")
+
+        self.assertEqual(
+            list(scheduler.running_encodes().order_by('id').values_list('id', flat=True)),
+            [self.bulk[0].id, late.id]
+        )
+
+    def test_queue_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.heavy)
+        response = client.get(reverse('video-queue', args=[self.bulk[2].id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['position'], 2)
+        self.assertEqual(response.data['waiting'], 4)
+
+
+class BenchmarkCommandTest(TestCase):
+    def test_rejects_bad_arguments(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark_processor', resolutions='hd')
+
+    @skipUnless(shutil.which('ffmpeg') and shutil.which('ffprobe'), 'FFmpeg is not installed')
+    def test_reports_every_stage(self):
+        output = os.path.join(tempfile.mkdtemp(), 'bench.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output), ignore_errors=True)
+
+        call_command(
+            'benchmark_processor', durations='2', resolutions='320x240', output=output, stderr=StringIO()
+        )
+
+        with open(output) as f:
+            report = json.load(f)
+        stages = [result['stage'] for result in report['results']]
+        self.assertEqual(stages, [
+            'extract_metadata', 'generate_thumbnail', 'create_hls_stream:360p',
+            'save_quality:360p', 'create_master_playlist',
+        ])
+        for result in report['results']:
+            self.assertGreater(result['wall_s'], 0)
+            self.assertIn('cpu_s', result)
+            self.assertIn('peak_rss_kb', result)
+        self.assertFalse(Video.objects.filter(title__startswith='Benchmark ').exists())
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='viewer', password='password')
+        Video.objects.create(title="Ready", uploaded_by=self.user, status='ready')
+        Video.objects.create(title="Waiting", uploaded_by=self.user)
+
+    def test_metrics_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        client.get(reverse('video-list'))
+        observe_encode('720p', 'standard', 30.0, 60)
+
+        with patch('redis.Redis.llen', return_value=7):
+            response = self.client.get('/metrics')
+
+        body = response.content.decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http_request_duration_seconds_count{method="GET",status="200",view="video-list"}', body)
+        self.assertIn('celery_queue_depth{queue="bulk"} 7.0', body)
+        self.assertIn('videos{status="ready"} 1.0', body)
+        self.assertIn('videos{status="pending"} 1.0', body)
+        self.assertIn(
+            'video_encode_seconds_per_output_second_bucket{le="0.5",profile="standard",rendition="720p",shared="false"}', body
+        )
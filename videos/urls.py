@@ -1,8 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import VideoViewSet
+from .views import VideoViewSet, UploadSessionViewSet
 
 router = DefaultRouter()
+# Registered first so 'uploads/' is not taken for a video id
+router.register(r'uploads', UploadSessionViewSet, basename='upload')
 router.register(r'', VideoViewSet, basename='video')
 urlpatterns = [
     path('', include(router.urls))
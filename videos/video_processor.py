@@ -1,21 +1,57 @@
 import os
+import resource
+import shutil
+import socket
 import subprocess
+import tempfile
+import threading
+import time
 import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from django.conf import settings
-from .models import Video, VideoQuality, VideoSegment
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+from core.metrics import observe_encode
+from . import checkpoints, dash, live_status, profiles
+from .hls import (
+    build_segment_index, media_playlist_files, parse_media_playlist, write_atomic, write_media_playlist,
+)
+from .models import Video, VideoQuality, VideoSegment, ProcessingCheckpoint, ProcessingRun, ProcessingStage
+
+
+def cpu_seconds():
+    """CPU time of this process plus its finished children, e.g. FFmpeg"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def path_size(path):
+    """Bytes in a file, or in every file under a directory"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def vtt_timestamp(seconds):
+    """Format seconds as a WebVTT timestamp, e.g. 00:01:05.000"""
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3_600_000)
+    minutes, millis = divmod(millis, 60_000)
+    return f'{hours:02d}:{minutes:02d}:{millis // 1000:02d}.{millis % 1000:03d}'
+
 
 class VideoProcessor:
     """Handles video processing with FFmpeg"""
     
-    QUALITY_SETTINGS = {
-        '360p': {'width': 640, 'height': 360, 'bitrate': '500k'},
-        '480p': {'width': 854, 'height': 480, 'bitrate': '1000k'},
-        '720p': {'width': 1280, 'height': 720, 'bitrate': '2500k'},
-        '1080p': {'width': 1920, 'height': 1080, 'bitrate': '5000k'},
-    }
-    
-    def __init__(self, video_id):
+    def __init__(self, video_id, single_pass=None, chunked=None):
         self.video = Video.objects.get(id=video_id)
         self.input_path = self.video.original_file.path
         self.output_dir = os.path.join(
@@ -25,6 +61,248 @@ class VideoProcessor:
             str(self.video.id)
         )
         os.makedirs(self.output_dir, exist_ok=True)
+        
+        # Decode the source once for all qualities unless told otherwise
+        if single_pass is None:
+            single_pass = getattr(settings, 'VIDEO_SINGLE_PASS_ENCODING', True)
+        self.single_pass = single_pass
+        
+        # Long sources can be cut into keyframe-aligned chunks encoded in parallel
+        if chunked is None:
+            chunked = getattr(settings, 'VIDEO_CHUNKED_ENCODING', False)
+        self.chunked = chunked
+        
+        # 'ts': one MPEG-TS file per segment. 'fmp4': one fragmented MP4 per
+        # rendition addressed by byte ranges, with audio as its own rendition
+        # (one track per file, as CMAF and DASH players expect). Chunks are
+        # joined segment file by segment file, so chunked encodes stay on ts.
+        self.segment_format = getattr(settings, 'VIDEO_SEGMENT_FORMAT', 'ts')
+        if self.segment_format not in ('ts', 'fmp4'):
+            raise ImproperlyConfigured(f"Unknown video segment format: {self.segment_format}")
+        if self.chunked:
+            self.segment_format = 'ts'
+        
+        # Ladder, codec, preset, rate control and audio, see profiles.py
+        self.profile = profiles.get_profile(self.video.encoding_profile or None)
+        # Probed in prepare(), which may have run in another task
+        self.has_audio = self.video.has_audio is not False
+        self.stage = None
+        self._started_at = time.monotonic()
+        self._progress_saved_at = 0
+        
+        # Stages are recorded on the video's open ProcessingRun, if any
+        self._run = None
+        self._run_loaded = False
+        # Speed and exit code of the last FFmpeg run, per thread for chunk pools
+        self._ffmpeg = threading.local()
+    
+    def run_ffmpeg(self, cmd, on_progress=None):
+        """
+        Run an FFmpeg command, streaming its progress
+        
+        FFmpeg reports key=value progress blocks on stdout (-progress pipe:1),
+        so on_progress is called with the seconds of output written so far
+        while the encode is still running.
+        
+        Raises:
+            subprocess.CalledProcessError: If FFmpeg exits with an error
+        """
+        cmd = [cmd[0], '-progress', 'pipe:1', '-nostats'] + cmd[1:]
+        
+        # stderr goes to a file so a chatty FFmpeg can never block on a full pipe
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True)
+            self._ffmpeg.speed = None
+            try:
+                for line in process.stdout:
+                    key, _, value = line.strip().partition('=')
+                    if key == 'out_time_us' and on_progress and value.isdigit():
+                        on_progress(int(value) / 1_000_000)
+                    elif key == 'speed' and value.endswith('x'):
+                        try:
+                            self._ffmpeg.speed = float(value[:-1])
+                        except ValueError:
+                            pass
+            except BaseException:
+                # e.g. the task's soft time limit: FFmpeg must not outlive it
+                process.kill()
+                process.wait()
+                raise
+            returncode = process.wait()
+            self._ffmpeg.exit_code = returncode
+            
+            if returncode != 0:
+                stderr.seek(0)
+                raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr.read())
+    
+    def get_mode(self):
+        """How this video is encoded, for ProcessingRun.mode"""
+        if self.chunked:
+            return 'chunked'
+        if getattr(settings, 'VIDEO_PARALLEL_RENDITIONS', False):
+            return 'parallel'
+        return 'single_pass' if self.single_pass else 'per_quality'
+    
+    def start_run(self):
+        """Open a ProcessingRun for the stages that follow"""
+        # A run still open belongs to an attempt that died, e.g. with its worker
+        ProcessingRun.objects.filter(video=self.video, status='running').update(
+            status='failed', error_message='Interrupted', finished_at=timezone.now()
+        )
+        self._run = ProcessingRun.objects.create(
+            video=self.video,
+            mode=self.get_mode(),
+            profile=self.profile['name'],
+            worker=socket.gethostname()
+        )
+        self._run_loaded = True
+        return self._run
+    
+    def get_run(self):
+        """The video's open ProcessingRun, which may have been started by another task"""
+        if not self._run_loaded:
+            self._run = ProcessingRun.objects.filter(video=self.video, status='running').first()
+            self._run_loaded = True
+        return self._run
+    
+    def end_run(self, status, error=''):
+        """Close the open ProcessingRun as succeeded or failed"""
+        run = self.get_run()
+        if run is None:
+            return
+        run.status = status
+        run.error_message = str(error)
+        run.finished_at = timezone.now()
+        run.save(update_fields=['status', 'error_message', 'finished_at'])
+    
+    @contextmanager
+    def record_stage(self, name, output_path=None, rendition=None, media_seconds=None, stages=None):
+        """
+        Record wall time, CPU time, FFmpeg speed and exit code, and output
+        size of the block as a ProcessingStage of the open run
+        
+        Encodes pass the rendition, or the list of renditions one FFmpeg run
+        writes, and the seconds of media they write, which feeds the encoder
+        throughput metric whether or not a run is open.
+        CPU time covers the whole process, so stages running in parallel
+        threads count each other's CPU time too. Worker threads pass a
+        stages list instead of touching the database: the unsaved stage is
+        appended to it, for the calling thread to write with write_stages().
+        """
+        run = self.get_run() if stages is None else None
+        
+        self._ffmpeg.speed = self._ffmpeg.exit_code = None
+        started_at = timezone.now()
+        wall_start, cpu_start = time.perf_counter(), cpu_seconds()
+        error = ''
+        try:
+            yield
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if isinstance(e, subprocess.CalledProcessError):
+                self._ffmpeg.exit_code = e.returncode
+            raise
+        finally:
+            wall_seconds = time.perf_counter() - wall_start
+            if rendition and not error:
+                renditions = [rendition] if isinstance(rendition, str) else rendition
+                for quality in renditions:
+                    observe_encode(quality, self.profile['name'], wall_seconds, media_seconds, len(renditions) > 1)
+            
+            if run is not None or stages is not None:
+                stage = ProcessingStage(
+                    run=run,
+                    name=name,
+                    started_at=started_at,
+                    finished_at=timezone.now(),
+                    wall_seconds=wall_seconds,
+                    cpu_seconds=cpu_seconds() - cpu_start,
+                    ffmpeg_speed=self._ffmpeg.speed,
+                    exit_code=self._ffmpeg.exit_code,
+                    output_bytes=path_size(output_path) if output_path and os.path.exists(output_path) else None,
+                    error=error
+                )
+                if stages is not None:
+                    stages.append(stage)
+                else:
+                    stage.save()
+    
+    def write_stages(self, stages):
+        """Save stages collected by worker threads to the open run"""
+        run = self.get_run()
+        if run is None or not stages:
+            return
+        for stage in stages:
+            stage.run = run
+        ProcessingStage.objects.bulk_create(stages)
+    
+    def set_progress(self, percent, force=False):
+        """
+        Update processing progress, saving at most every few seconds
+        
+        Every change goes to the live status store. Only processing_progress
+        is written to the database, and with live status enabled only when
+        forced at a stage boundary, so polling never needs the row.
+        """
+        percent = int(percent)
+        if percent == self.video.processing_progress and not force:
+            return
+        self.video.processing_progress = percent
+        self.publish_status()
+        
+        now = time.monotonic()
+        interval = getattr(settings, 'VIDEO_PROGRESS_SAVE_INTERVAL', 3)
+        live = getattr(settings, 'VIDEO_LIVE_STATUS', True)
+        if force or (not live and now - self._progress_saved_at >= interval):
+            self.video.save(update_fields=['processing_progress'])
+            self._progress_saved_at = now
+    
+    def set_stage(self, stage):
+        """Record the stage currently running for live status"""
+        self.stage = stage
+        self.publish_status()
+    
+    def publish_status(self):
+        """Push status, percent, stage, ETA and playability to the live status store"""
+        percent = self.video.processing_progress
+        eta = None
+        if self.video.status == 'processing' and 0 < percent < 100:
+            # Assume the rest of the run goes at the same pace as so far
+            elapsed = time.monotonic() - self._started_at
+            eta = int(elapsed * (100 - percent) / percent)
+        
+        live_status.publish(
+            self.video.id,
+            status=self.video.status,
+            percent=percent,
+            stage=self.stage,
+            eta=eta,
+            playable=int(self.video.is_playable())
+        )
+    
+    def encode_progress(self, start, span, weight=1.0):
+        """
+        Build an on_progress callback mapping encoded seconds to a percentage
+        
+        Args:
+            start: Percentage when the encode starts
+            span: Percentage points the encode covers
+            weight: Share of span this encode covers, e.g. one quality's weight
+        """
+        def on_progress(seconds):
+            if self.video.duration:
+                fraction = min(seconds / self.video.duration, 1.0)
+                self.set_progress(start + span * weight * fraction)
+        return on_progress
+    
+    def work_fingerprint(self, **inputs):
+        """
+        Fingerprint of a piece of work on this video's source, see checkpoints.py
+        
+        A checkpoint only counts if the fingerprint matches, so a new
+        source or changed settings redo the work.
+        """
+        return checkpoints.fingerprint(source=self.video.content_hash or self.video.original_file.name, **inputs)
     
     def extract_metadata(self):
         """Extract video metadata using FFprobe"""
@@ -39,6 +317,7 @@ class VideoProcessor:
         
         try:
             result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+            self._ffmpeg.exit_code = result.returncode
             data = json.loads(result.stdout)
             
             # Find video stream
@@ -52,17 +331,22 @@ class VideoProcessor:
                 self.video.height = video_stream.get('height')
                 self.video.fps = eval(video_stream.get('r_frame_rate', '0/1'))
             
+            self.has_audio = any(s['codec_type'] == 'audio' for s in data['streams'])
+            self.video.has_audio = self.has_audio
+            
             # Get duration
             if 'format' in data:
                 self.video.duration = int(float(data['format'].get('duration', 0)))
             
-            self.video.save()
+            self.video.save(update_fields=['width', 'height', 'fps', 'duration', 'has_audio'])
             return True
             
         except Exception as e:
+            self._ffmpeg.exit_code = getattr(e, 'returncode', None)
             self.video.status = 'failed'
             self.video.error_message = f"Metadata extraction failed: {str(e)}"
-            self.video.save()
+            self.video.save(update_fields=['status', 'error_message'])
+            self.publish_status()
             return False
     
     def generate_thumbnail(self):
@@ -76,157 +360,898 @@ class VideoProcessor:
         
         os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
         
+        # Seek on the input side so FFmpeg jumps to the nearest keyframe
+        # instead of decoding everything before it. A tenth of the way in
+        # skips most fade-ins and title cards.
+        duration = self.video.duration or 0
+        start = min(duration * 0.1, 60) if duration >= 5 else 0
+        
+        # The thumbnail filter picks the most representative of the next
+        # few seconds of frames, so flashes and scene cuts are passed over
+        frames = max(int((self.video.fps or 30) * 3), 1)
+        
+        fingerprint = self.work_fingerprint(stage='thumbnail', start=start, frames=frames)
+        if self.video.thumbnail and checkpoints.is_done(self.video, 'thumbnail', fingerprint):
+            return True
+        
         cmd = [
             'ffmpeg',
+            '-ss', f'{start:.3f}',
             '-i', self.input_path,
-            '-ss', '00:00:01',  # Take frame at 1 second
-            '-vframes', '1',
-            '-vf', 'scale=640:360',
+            '-vf', f'thumbnail=n={frames},scale=640:360:force_original_aspect_ratio=decrease',
+            '-frames:v', '1',
+            '-update', '1',
             '-y',
             thumbnail_path
         ]
         
         try:
-            subprocess.run(cmd, check=True, capture_output=True)
+            with self.record_stage('thumbnail', thumbnail_path):
+                self.run_ffmpeg(cmd)
             self.video.thumbnail = f'videos/thumbnails/{self.video.id}.jpg'
-            self.video.save()
+            self.video.save(update_fields=['thumbnail'])
+            checkpoints.record(self.video, 'thumbnail', fingerprint, [thumbnail_path])
             return True
         except Exception as e:
             print(f"Thumbnail generation failed: {e}")
             return False
     
-    def create_hls_stream(self, quality):
+    def get_trickplay_size(self):
+        """Size of one scrub preview tile, VIDEO_TRICKPLAY_WIDTH wide and even"""
+        width = getattr(settings, 'VIDEO_TRICKPLAY_WIDTH', 160)
+        if self.video.width and self.video.height:
+            height = 2 * max(round(width * self.video.height / self.video.width / 2), 1)
+        else:
+            height = 2 * round(width * 9 / 16 / 2)
+        return width, height
+    
+    def trickplay_filter(self):
+        """Filter chain turning decoded frames into sprite sheets of scrub previews"""
+        interval = getattr(settings, 'VIDEO_TRICKPLAY_INTERVAL', 10)
+        columns, rows = getattr(settings, 'VIDEO_TRICKPLAY_GRID', (10, 10))
+        width, height = self.get_trickplay_size()
+        return f'fps=1/{interval},scale={width}:{height},tile={columns}x{rows}'
+    
+    def trickplay_output(self):
+        """
+        FFmpeg output options writing sprite sheets to trickplay/
+        
+        Meant to be added as an extra output of an encode that already
+        decodes the source, so previews cost a scaler rather than a decode.
+        Sheets left from a previous encode are removed first.
+        """
+        trickplay_dir = os.path.join(self.output_dir, 'trickplay')
+        shutil.rmtree(trickplay_dir, ignore_errors=True)
+        os.makedirs(trickplay_dir)
+        return [
+            '-c:v', 'mjpeg',
+            '-q:v', '5',
+            # One image per sheet, whenever the tile filter fills one
+            '-fps_mode', 'passthrough',
+            '-start_number', '0',
+            '-f', 'image2',
+            '-y',
+            os.path.join(trickplay_dir, 'sprite_%03d.jpg')
+        ]
+    
+    def trickplay_fingerprint(self):
+        return self.work_fingerprint(
+            stage='trickplay',
+            interval=getattr(settings, 'VIDEO_TRICKPLAY_INTERVAL', 10),
+            grid=getattr(settings, 'VIDEO_TRICKPLAY_GRID', (10, 10)),
+            size=self.get_trickplay_size()
+        )
+    
+    def trickplay_done(self):
+        """Whether an earlier attempt already wrote the sprite sheets and their index"""
+        return checkpoints.is_done(self.video, 'trickplay', self.trickplay_fingerprint())
+    
+    def wants_trickplay(self, quality):
+        """Whether the encode of this quality also writes the sprite sheets"""
+        return (
+            getattr(settings, 'VIDEO_TRICKPLAY', True)
+            and quality == self.get_qualities()[0]
+            and not self.trickplay_done()
+        )
+    
+    def generate_trickplay(self):
+        """
+        Generate sprite sheets in a pass of their own
+        
+        For encodes that cannot write them on the side, e.g. chunked ones.
+        Only keyframes are decoded, which is enough for previews seconds apart.
+        """
+        if not getattr(settings, 'VIDEO_TRICKPLAY', True):
+            return False
+        if self.trickplay_done():
+            return True
+        
+        cmd = [
+            'ffmpeg',
+            '-skip_frame', 'nokey',
+            '-i', self.input_path,
+            '-an',
+            '-vf', self.trickplay_filter(),
+            *self.trickplay_output()
+        ]
+        
+        try:
+            with self.record_stage('trickplay', os.path.join(self.output_dir, 'trickplay')):
+                self.run_ffmpeg(cmd)
+            return self.write_trickplay_index()
+        except Exception as e:
+            print(f"Trickplay generation failed: {e}")
+            return False
+    
+    def write_trickplay_index(self):
+        """
+        Write trickplay/thumbnails.vtt, mapping every interval to its tile
+        
+        Each cue points at a region of a sprite sheet with a media fragment,
+        e.g. sprite_000.jpg#xywh=160,0,160,90, as players expect.
+        """
+        trickplay_dir = os.path.join(self.output_dir, 'trickplay')
+        sheets = sorted(name for name in os.listdir(trickplay_dir) if name.startswith('sprite_'))
+        if not sheets:
+            return False
+        
+        interval = getattr(settings, 'VIDEO_TRICKPLAY_INTERVAL', 10)
+        columns, rows = getattr(settings, 'VIDEO_TRICKPLAY_GRID', (10, 10))
+        width, height = self.get_trickplay_size()
+        
+        # The last sheet is padded, so the duration decides how many tiles are real
+        tiles = len(sheets) * columns * rows
+        duration = self.video.duration or tiles * interval
+        count = min(max(-(-duration // interval), 1), tiles)
+        
+        lines = ['WEBVTT', '']
+        for i in range(count):
+            start = i * interval
+            end = min(start + interval, duration) if duration > start else start + interval
+            sheet, tile = divmod(i, columns * rows)
+            x, y = (tile % columns) * width, (tile // columns) * height
+            lines += [
+                f'{vtt_timestamp(start)} --> {vtt_timestamp(end)}',
+                f'{sheets[sheet]}#xywh={x},{y},{width},{height}',
+                ''
+            ]
+        
+        index_path = os.path.join(trickplay_dir, 'thumbnails.vtt')
+        write_atomic(index_path, '\n'.join(lines))
+        
+        self.video.trickplay_vtt = f'videos/processed/{self.video.id}/trickplay/thumbnails.vtt'
+        self.video.save(update_fields=['trickplay_vtt'])
+        checkpoints.record(
+            self.video, 'trickplay', self.trickplay_fingerprint(),
+            [os.path.join(trickplay_dir, name) for name in sheets] + [index_path]
+        )
+        return True
+    
+    def hls_output(self, directory):
+        """
+        FFmpeg HLS muxer options writing one rendition to a directory
+        
+        Args:
+            directory: Rendition folder, or one with %v when a var_stream_map names them
+        """
+        args = ['-hls_time', '10', '-hls_playlist_type', 'vod']  # 10 second segments
+        if self.segment_format == 'fmp4':
+            args += [
+                '-hls_segment_type', 'fmp4',
+                # Init section and every segment in one file, listed as byte ranges
+                '-hls_flags', 'single_file',
+                '-hls_segment_filename', os.path.join(directory, 'stream.mp4'),
+            ]
+        else:
+            args += ['-hls_segment_filename', os.path.join(directory, 'segment_%03d.ts')]
+        return args + ['-f', 'hls', '-y', os.path.join(directory, 'playlist.m3u8')]
+    
+    def separate_audio(self):
+        """Whether audio is its own rendition instead of muxed into every video rendition"""
+        return self.segment_format == 'fmp4' and self.has_audio
+    
+    def wants_audio(self, quality):
+        """Whether the encode of this quality also writes the separate audio rendition"""
+        return self.separate_audio() and quality == self.get_qualities()[0]
+    
+    def audio_output(self):
+        """FFmpeg output options writing the audio rendition to audio/"""
+        audio_dir = os.path.join(self.output_dir, 'audio')
+        os.makedirs(audio_dir, exist_ok=True)
+        return ['-map', '0:a:0', *profiles.audio_args(self.profile), *self.hls_output(audio_dir)]
+    
+    def create_hls_stream(self, quality, on_progress=None):
         """Create HLS stream for a specific quality"""
-        settings_data = self.QUALITY_SETTINGS[quality]
+        if self.rendition_done(quality):
+            print(f"Video {self.video.id}: {quality} is already encoded, skipping it")
+            # An attempt may have died between the rendition and its previews
+            if self.wants_trickplay(quality):
+                self.generate_trickplay()
+            self.create_master_playlist()
+            return True
+        
+        settings_data = self.get_rendition(quality)
         
         # Output directory for this quality
         quality_dir = os.path.join(self.output_dir, quality)
         os.makedirs(quality_dir, exist_ok=True)
         
-        # Output files
-        playlist_file = os.path.join(quality_dir, 'playlist.m3u8')
-        segment_pattern = os.path.join(quality_dir, 'segment_%03d.ts')
-        
         # FFmpeg command
+        cmd = ['ffmpeg', '-i', self.input_path]
+        if self.separate_audio():
+            cmd += ['-map', '0:v:0']
+        cmd += [
+            '-vf', f"scale={settings_data['width']}:{settings_data['height']}",
+            *profiles.video_args(self.profile, settings_data['bitrate'], self.video.fps),
+        ]
+        if not self.separate_audio():
+            cmd += profiles.audio_args(self.profile)
+        cmd += self.hls_output(quality_dir)
+        
+        # The lowest quality also writes the audio rendition and the scrub
+        # previews from its decode
+        if self.wants_audio(quality):
+            cmd += self.audio_output()
+        trickplay = self.wants_trickplay(quality)
+        if trickplay:
+            cmd += ['-map', '0:v:0', '-vf', self.trickplay_filter(), *self.trickplay_output()]
+        
+        try:
+            with self.record_stage(f'encode:{quality}', quality_dir, quality, self.video.duration):
+                self.run_ffmpeg(cmd, on_progress)
+            self.save_quality(quality)
+            if trickplay:
+                self.write_trickplay_index()
+            self.create_master_playlist()
+            return True
+            
+        except Exception as e:
+            print(f"HLS creation failed for {quality}: {e}")
+            return False
+    
+    def create_hls_streams(self, qualities, on_progress=None):
+        """
+        Create HLS streams for several qualities from a single decode.
+        
+        The source is decoded once and the frames are split to one scaler
+        per quality, so every rendition comes out of one FFmpeg run instead
+        of one full decode per quality. master.m3u8 is rewritten to include
+        them once they are saved.
+        """
+        # A retry only encodes what an earlier attempt did not finish
+        pending = self.pending_qualities(qualities)
+        if pending != qualities:
+            if qualities[0] not in pending and self.wants_trickplay(qualities[0]):
+                self.generate_trickplay()
+            if not pending:
+                self.create_master_playlist()
+                return True
+            qualities = pending
+        
+        for quality in qualities:
+            os.makedirs(os.path.join(self.output_dir, quality), exist_ok=True)
+        
+        # split -> scale per quality: [s0] -> [v0], [s1] -> [v1], ...
+        # plus one more branch for the scrub preview sprites: [s{n}] -> [tp]
+        trickplay = self.wants_trickplay(qualities[0])
+        branches = len(qualities) + trickplay
+        filters = [f"[0:v]split={branches}" + ''.join(f'[s{i}]' for i in range(branches))]
+        for i, quality in enumerate(qualities):
+            settings_data = self.get_rendition(quality)
+            filters.append(f"[s{i}]scale={settings_data['width']}:{settings_data['height']}[v{i}]")
+        if trickplay:
+            filters.append(f"[s{len(qualities)}]{self.trickplay_filter()}[tp]")
+        
         cmd = [
             'ffmpeg',
             '-i', self.input_path,
-            '-vf', f"scale={settings_data['width']}:{settings_data['height']}",
-            '-c:v', 'libx264',
-            '-b:v', settings_data['bitrate'],
-            '-c:a', 'aac',
-            '-b:a', '128k',
-            '-hls_time', '10',  # 10 second segments
-            '-hls_playlist_type', 'vod',
-            '-hls_segment_filename', segment_pattern,
-            '-f', 'hls',
-            '-y',
-            playlist_file
+            '-filter_complex', ';'.join(filters),
         ]
+        stream_map = []
+        muxed_audio = self.has_audio and not self.separate_audio()
+        for i, quality in enumerate(qualities):
+            cmd += ['-map', f'[v{i}]']
+            if muxed_audio:
+                cmd += ['-map', '0:a:0']
+                stream_map.append(f'v:{i},a:{i},name:{quality}')
+            else:
+                stream_map.append(f'v:{i},name:{quality}')
+        
+        for i, quality in enumerate(qualities):
+            cmd += profiles.video_args(self.profile, self.get_rendition(quality)['bitrate'], self.video.fps, stream=i)
+        if muxed_audio:
+            cmd += profiles.audio_args(self.profile)
+        
+        cmd += ['-var_stream_map', ' '.join(stream_map), *self.hls_output(os.path.join(self.output_dir, '%v'))]
+        if self.wants_audio(qualities[0]):
+            cmd += self.audio_output()
+        if trickplay:
+            cmd += ['-map', '[tp]', *self.trickplay_output()]
         
         try:
-            subprocess.run(cmd, check=True, capture_output=True)
+            with self.record_stage(f"encode:{','.join(qualities)}", self.output_dir, qualities, self.video.duration):
+                self.run_ffmpeg(cmd, on_progress)
+            for quality in qualities:
+                self.save_quality(quality)
+            if trickplay:
+                self.write_trickplay_index()
             
-            # Save quality info
-            file_size = sum(
-                os.path.getsize(os.path.join(quality_dir, f))
-                for f in os.listdir(quality_dir)
-                if f.endswith('.ts')
-            )
+            # Not FFmpeg's master.m3u8: it would drop renditions published earlier
+            self.create_master_playlist()
+            return True
             
-            quality_obj, created = VideoQuality.objects.update_or_create(
-                video=self.video,
-                quality=quality,
-                defaults={
-                    'file_path': f'videos/processed/{self.video.id}/{quality}/playlist.m3u8',
-                    'file_size': file_size,
-                    'bitrate': int(settings_data['bitrate'].replace('k', ''))
-                }
-            )
+        except Exception as e:
+            print(f"HLS creation failed for {', '.join(qualities)}: {e}")
+            return False
+    
+    def save_quality(self, quality):
+        """
+        Save VideoQuality and VideoSegment rows for an encoded quality
+        
+        Single-file fMP4 renditions get no VideoSegment rows: their segments
+        are byte ranges of one file, kept in segment_index.
+        """
+        with self.record_stage(f'save:{quality}'):
+            settings_data = self.get_rendition(quality)
+            quality_dir = os.path.join(self.output_dir, quality)
+            
+            # Real segment durations and sizes come from the playlist FFmpeg wrote
+            segments, segment_index = build_segment_index(os.path.join(quality_dir, 'playlist.m3u8'))
+            single_file = 'init' in segment_index
+            if single_file:
+                segments = []
             
-            # Save segment info
-            segments = sorted([f for f in os.listdir(quality_dir) if f.endswith('.ts')])
-            for i, segment in enumerate(segments):
-                VideoSegment.objects.update_or_create(
-                    quality=quality_obj,
-                    segment_number=i,
+            # Readers see either the old segment list or the new one, never a mix
+            with transaction.atomic():
+                quality_obj, created = VideoQuality.objects.update_or_create(
+                    video=self.video,
+                    quality=quality,
                     defaults={
-                        'file_path': f'videos/processed/{self.video.id}/{quality}/{segment}',
-                        'duration': 10.0
+                        'file_path': f'videos/processed/{self.video.id}/{quality}/playlist.m3u8',
+                        'file_size': (
+                            path_size(os.path.join(quality_dir, 'stream.mp4')) if single_file
+                            else sum(segment_index['sizes'])
+                        ),
+                        'bitrate': int(settings_data['bitrate'].replace('k', '')),
+                        'segment_index': segment_index
                     }
                 )
+                
+                # Save segment info: one upsert instead of a query pair per segment
+                VideoSegment.objects.bulk_create(
+                    [
+                        VideoSegment(
+                            quality=quality_obj,
+                            segment_number=i,
+                            file_path=f'videos/processed/{self.video.id}/{quality}/{segment}',
+                            duration=duration
+                        )
+                        for i, (segment, duration) in enumerate(zip(segments, segment_index['durations']))
+                    ],
+                    batch_size=1000,
+                    update_conflicts=True,
+                    unique_fields=['quality', 'segment_number'],
+                    update_fields=['file_path', 'duration']
+                )
+                
+                # Drop segments left over from a longer previous encode
+                quality_obj.segments.filter(segment_number__gte=len(segments)).delete()
+            
+            outputs = media_playlist_files(os.path.join(quality_dir, 'playlist.m3u8'))
+            if self.wants_audio(quality):
+                outputs += media_playlist_files(os.path.join(self.output_dir, 'audio', 'playlist.m3u8'))
+            checkpoints.record(self.video, f'rendition:{quality}', self.rendition_fingerprint(quality), outputs)
+            
+            return quality_obj
+    
+    def rendition_fingerprint(self, quality, **extra):
+        """Fingerprint of everything the encode of one quality depends on"""
+        return self.work_fingerprint(
+            profile=self.profile,
+            rendition=self.get_rendition(quality),
+            fps=self.video.fps,
+            segment_format=self.segment_format,
+            audio=self.wants_audio(quality),
+            **extra
+        )
+    
+    def rendition_done(self, quality):
+        """Whether an earlier attempt already encoded and saved this quality, intact"""
+        return (
+            checkpoints.is_done(self.video, f'rendition:{quality}', self.rendition_fingerprint(quality))
+            and self.video.qualities.filter(quality=quality).exists()
+        )
+    
+    def pending_qualities(self, qualities):
+        """The qualities still to encode, leaving out those already done"""
+        pending = []
+        for quality in qualities:
+            if self.rendition_done(quality):
+                print(f"Video {self.video.id}: {quality} is already encoded, skipping it")
+            else:
+                pending.append(quality)
+        return pending
+    
+    def get_keyframes(self):
+        """List keyframe timestamps of the source without decoding it"""
+        cmd = [
+            'ffprobe',
+            '-v', 'quiet',
+            '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,flags',
+            '-of', 'csv=p=0',
+            self.input_path
+        ]
+        
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        keyframes = []
+        for line in result.stdout.splitlines():
+            pts_time, _, flags = line.partition(',')
+            if 'K' in flags and pts_time not in ('', 'N/A'):
+                keyframes.append(float(pts_time))
+        return sorted(keyframes)
+    
+    def plan_chunks(self):
+        """
+        Split the source into keyframe-aligned time ranges
+        
+        Each chunk starts on the first keyframe at or after a multiple of
+        VIDEO_CHUNK_DURATION, so every chunk can be decoded on its own.
+        
+        Returns:
+            list: (start, end) tuples in seconds, end is None for the last chunk
+        """
+        chunk_duration = getattr(settings, 'VIDEO_CHUNK_DURATION', 300)
+        keyframes = self.get_keyframes()
+        
+        starts = [0.0]
+        for keyframe in keyframes:
+            if keyframe >= starts[-1] + chunk_duration:
+                starts.append(keyframe)
+        
+        return list(zip(starts, starts[1:] + [None]))
+    
+    def encode_chunk(self, quality, index, start, end, stages=None):
+        """
+        Encode one time range of the source for a specific quality
+        
+        Called from worker threads with a stages list, see record_stage().
+        """
+        settings_data = self.get_rendition(quality)
+        
+        chunk_dir = os.path.join(self.output_dir, quality, f'chunk_{index:03d}')
+        os.makedirs(chunk_dir, exist_ok=True)
+        
+        # Seek on the input side: start is a keyframe, so the cut is exact
+        cmd = ['ffmpeg', '-ss', str(start), '-i', self.input_path]
+        if end is not None:
+            cmd += ['-t', str(end - start)]
+        cmd += [
+            '-vf', f"scale={settings_data['width']}:{settings_data['height']}",
+            *profiles.video_args(self.profile, settings_data['bitrate'], self.video.fps),
+            # Same segment cuts in every chunk and every quality
+            '-force_key_frames', 'expr:gte(t,n_forced*10)',
+            *profiles.audio_args(self.profile),
+            # Keep timestamps continuous across chunks
+            '-output_ts_offset', str(start),
+            '-hls_time', '10',
+            '-hls_playlist_type', 'vod',
+            '-hls_segment_filename', os.path.join(chunk_dir, 'segment_%03d.ts'),
+            '-f', 'hls',
+            '-y',
+            os.path.join(chunk_dir, 'playlist.m3u8')
+        ]
+        
+        try:
+            media_seconds = (end if end is not None else self.video.duration or start) - start
+            with self.record_stage(f'encode:{quality}:chunk_{index:03d}', chunk_dir, quality, media_seconds, stages):
+                self.run_ffmpeg(cmd)
+            return True
+        except Exception as e:
+            print(f"Chunk {index} encoding failed for {quality}: {e}")
+            return False
+    
+    def chunk_checkpoint(self, quality, index, start, end):
+        """Checkpoint name and fingerprint of one chunk"""
+        return f'chunk:{quality}:{index:03d}', self.rendition_fingerprint(quality, start=start, end=end)
+    
+    def chunk_done(self, quality, index, start, end):
+        """Whether an earlier attempt already encoded this chunk, intact"""
+        return checkpoints.is_done(self.video, *self.chunk_checkpoint(quality, index, start, end))
+    
+    def record_chunk(self, quality, index, start, end):
+        """Checkpoint an encoded chunk, so a retry before the join keeps it"""
+        playlist = os.path.join(self.output_dir, quality, f'chunk_{index:03d}', 'playlist.m3u8')
+        checkpoints.record(self.video, *self.chunk_checkpoint(quality, index, start, end), media_playlist_files(playlist))
+    
+    def join_chunks(self, quality, chunk_count):
+        """Join encoded chunks into one continuous playlist for a quality"""
+        quality_dir = os.path.join(self.output_dir, quality)
+        
+        try:
+            with self.record_stage(f'join:{quality}', quality_dir):
+                segments = []
+                for index in range(chunk_count):
+                    chunk_dir = os.path.join(quality_dir, f'chunk_{index:03d}')
+                    for uri, duration in parse_media_playlist(os.path.join(chunk_dir, 'playlist.m3u8')):
+                        # Renumber so segments run on from the previous chunk
+                        name = f'segment_{len(segments):03d}.ts'
+                        os.replace(os.path.join(chunk_dir, uri), os.path.join(quality_dir, name))
+                        segments.append((name, duration))
+                
+                write_media_playlist(os.path.join(quality_dir, 'playlist.m3u8'), segments)
+                
+                for index in range(chunk_count):
+                    shutil.rmtree(os.path.join(quality_dir, f'chunk_{index:03d}'), ignore_errors=True)
             
+            self.save_quality(quality)
+            # The chunks are gone now, the rendition's checkpoint covers them
+            ProcessingCheckpoint.objects.filter(video=self.video, name__startswith=f'chunk:{quality}:').delete()
             return True
             
         except Exception as e:
-            print(f"HLS creation failed for {quality}: {e}")
+            print(f"Joining chunks failed for {quality}: {e}")
             return False
     
+    def create_hls_streams_chunked(self, qualities, on_progress=None):
+        """
+        Create HLS streams by encoding keyframe-aligned chunks in parallel
+        
+        Every (quality, chunk) pair is its own FFmpeg process, so encode
+        time scales with the number of cores instead of the source length.
+        on_progress is called with the fraction of chunks done, and each
+        quality becomes playable as soon as it is joined.
+        
+        Returns:
+            list: Qualities whose chunks were all encoded and joined
+        """
+        # A retry only encodes what an earlier attempt did not finish
+        pending = self.pending_qualities(qualities)
+        encoded = [quality for quality in qualities if quality not in pending]
+        if encoded:
+            self.create_master_playlist()
+        
+        chunks = self.plan_chunks()
+        jobs = [
+            (quality, index, start, end)
+            for quality in pending
+            for index, (start, end) in enumerate(chunks)
+        ]
+        
+        # Checkpoints and stages are read and written here, the threads only run FFmpeg
+        done = {job for job in jobs if self.chunk_done(*job)}
+        stages = []
+        
+        # FFmpeg does the work in child processes, threads only wait on them
+        workers = getattr(settings, 'VIDEO_CHUNK_WORKERS', None) or os.cpu_count()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = []
+            # Results come back in job order, lowest quality first, so each
+            # quality is joined and published while the higher ones still encode
+            for job, ok in zip(jobs, pool.map(lambda job: job in done or self.encode_chunk(*job, stages), jobs)):
+                if ok and job not in done:
+                    self.record_chunk(*job)
+                results.append(ok)
+                if on_progress:
+                    on_progress(len(results) / len(jobs))
+                
+                quality, index = job[0], job[1]
+                if index == len(chunks) - 1 and all(results[-len(chunks):]):
+                    if self.join_chunks(quality, len(chunks)):
+                        encoded.append(quality)
+                        self.create_master_playlist()
+        
+        self.write_stages(stages)
+        return [quality for quality in qualities if quality in encoded]
+    
     def create_master_playlist(self):
-        """Create master HLS playlist with all qualities"""
+        """
+        Write the master HLS playlist with every quality saved so far
+        
+        Called again each time a rendition finishes, so the video plays
+        from its first rendition on. The playlist is written to a temporary
+        file and renamed over the old one, so players never read half of it,
+        even with rendition tasks finishing at the same time. fMP4 videos
+        get their DASH manifest rewritten the same way.
+        """
         master_playlist = os.path.join(self.output_dir, 'master.m3u8')
+        encoded = set(VideoQuality.objects.filter(video=self.video).values_list('quality', flat=True))
+        qualities = [quality for quality in self.get_qualities() if quality in encoded]
+        
+        # A separate audio rendition is written along with the lowest quality
+        audio = self.separate_audio() and os.path.exists(os.path.join(self.output_dir, 'audio', 'playlist.m3u8'))
+        audio_bandwidth = int(self.profile['audio_bitrate'].replace('k', '')) * 1000 if audio else 0
         
-        with open(master_playlist, 'w') as f:
-            f.write('#EXTM3U\n')
-            f.write('#EXT-X-VERSION:3\n\n')
+        with self.record_stage('playlist', master_playlist):
+            lines = ['#EXTM3U']
+            if self.segment_format == 'fmp4':
+                lines += ['#EXT-X-VERSION:7', '#EXT-X-INDEPENDENT-SEGMENTS', '']
+            else:
+                lines += ['#EXT-X-VERSION:3', '']
+            if audio:
+                lines.append('#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="audio",NAME="Default",'
+                             'DEFAULT=YES,AUTOSELECT=YES,URI="audio/playlist.m3u8"')
             
-            for quality in self.QUALITY_SETTINGS:
-                if VideoQuality.objects.filter(video=self.video, quality=quality).exists():
-                    settings_data = self.QUALITY_SETTINGS[quality]
-                    bandwidth = int(settings_data['bitrate'].replace('k', '')) * 1000
-                    
-                    f.write(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},'
-                           f'RESOLUTION={settings_data["width"]}x{settings_data["height"]}\n')
-                    f.write(f'{quality}/playlist.m3u8\n')
+            for quality in qualities:
+                settings_data = self.get_rendition(quality)
+                bandwidth = profiles.peak_bitrate(self.profile, settings_data['bitrate']) + audio_bandwidth
+                
+                lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},'
+                             f'RESOLUTION={settings_data["width"]}x{settings_data["height"]}'
+                             + (',AUDIO="audio"' if audio else ''))
+                lines.append(f'{quality}/playlist.m3u8')
+            write_atomic(master_playlist, '\n'.join(lines) + '\n')
+            
+            if self.segment_format == 'fmp4' and getattr(settings, 'VIDEO_DASH_MANIFEST', True) and qualities:
+                self.create_dash_manifest(qualities, audio)
+        
+        fields = {'hls_playlist': f'videos/processed/{self.video.id}/master.m3u8'}
+        if self.segment_format == 'fmp4' and getattr(settings, 'VIDEO_DASH_MANIFEST', True):
+            fields['dash_manifest'] = f'videos/processed/{self.video.id}/manifest.mpd'
+        changed = [name for name, value in fields.items() if getattr(self.video, name) != value]
+        if changed:
+            # The first rendition makes the video playable
+            for name in changed:
+                setattr(self.video, name, fields[name])
+            self.video.save(update_fields=changed)
+            self.publish_status()
+        
+        return True
+    
+    def create_dash_manifest(self, qualities, audio):
+        """Write manifest.mpd, pointing DASH players at the same fMP4 files as HLS"""
+        videos = []
+        for quality in qualities:
+            settings_data = self.get_rendition(quality)
+            videos.append({
+                'name': quality,
+                'width': settings_data['width'],
+                'height': settings_data['height'],
+                'bandwidth': profiles.peak_bitrate(self.profile, settings_data['bitrate']),
+            })
+        
+        dash.write_manifest(
+            os.path.join(self.output_dir, 'manifest.mpd'),
+            videos,
+            {
+                'name': 'audio',
+                'bandwidth': int(self.profile['audio_bitrate'].replace('k', '')) * 1000,
+                # The AAC encoder writes AAC-LC
+                'codecs': 'mp4a.40.2' if self.profile['audio_codec'] == 'aac' else None,
+            } if audio else None
+        )
+    
+    def get_qualities(self):
+        """
+        Qualities to encode for this video, lowest first
+        
+        Qualities above the source resolution are skipped since upscaled
+        copies cost CPU and disk without adding detail. The lowest quality
+        is always kept so every video gets at least one rendition.
+        """
+        ladder = self.profile['ladder']
+        qualities = list(ladder)
+        if not (self.video.width and self.video.height):
+            return qualities
+        
+        # Quality names refer to the short side, so portrait clips match too
+        short_side = min(self.video.width, self.video.height)
+        return [
+            quality for quality in qualities
+            if ladder[quality]['height'] <= short_side
+        ] or qualities[:1]
+    
+    def get_rendition(self, quality):
+        """
+        Output size and bitrate of a quality, fitted to the source
+        
+        The short side comes from the profile ladder and the long side keeps
+        the source aspect ratio (rounded to even for libx264). High frame
+        rate sources get more bitrate since they carry more frames per second.
+        """
+        settings_data = self.profile['ladder'][quality]
+        width, height = settings_data['width'], settings_data['height']
+        
+        source_width, source_height = self.video.width, self.video.height
+        if source_width and source_height:
+            short_side = settings_data['height']
+            long_side = 2 * round(short_side * max(source_width, source_height) / min(source_width, source_height) / 2)
+            if source_width >= source_height:
+                width, height = long_side, short_side
+            else:
+                width, height = short_side, long_side
+        
+        bitrate = int(settings_data['bitrate'].replace('k', ''))
+        if self.video.fps and self.video.fps > 30:
+            bitrate = int(bitrate * 1.5)
+        
+        return {'width': width, 'height': height, 'bitrate': f'{bitrate}k'}
+    
+    def get_progress_weights(self, qualities):
+        """Share of the encode work per quality, by output pixel count"""
+        pixels = {}
+        for quality in qualities:
+            rendition = self.get_rendition(quality)
+            pixels[quality] = rendition['width'] * rendition['height']
+        total = sum(pixels.values())
+        return {quality: count / total for quality, count in pixels.items()}
+    
+    def find_duplicate(self):
+        """
+        Find an already processed upload with the same content
+        
+        Returns:
+            Video: The oldest ready video with the same content hash and
+            encoding profile, or None
+        """
+        if not self.video.content_hash:
+            self.video.compute_content_hash()
+            self.video.save(update_fields=['content_hash'])
+        
+        return Video.objects.filter(
+            content_hash=self.video.content_hash,
+            encoding_profile=self.video.encoding_profile,
+            status='ready'
+        ).exclude(id=self.video.id).order_by('uploaded_at').first()
+    
+    def link_duplicate(self, source):
+        """
+        Reuse the outputs of an identical upload instead of encoding again
+        
+        The HLS files, thumbnail and previews of the source are shared by path, and its
+        VideoQuality/VideoSegment rows are copied to this video.
+        """
+        with transaction.atomic():
+            for quality in source.qualities.all():
+                segments = list(quality.segments.all())
+                quality_obj, created = VideoQuality.objects.update_or_create(
+                    video=self.video,
+                    quality=quality.quality,
+                    defaults={
+                        'file_path': quality.file_path,
+                        'file_size': quality.file_size,
+                        'bitrate': quality.bitrate,
+                        'segment_index': quality.segment_index
+                    }
+                )
+                quality_obj.segments.all().delete()
+                VideoSegment.objects.bulk_create(
+                    [
+                        VideoSegment(
+                            quality=quality_obj,
+                            segment_number=segment.segment_number,
+                            file_path=segment.file_path,
+                            duration=segment.duration
+                        )
+                        for segment in segments
+                    ],
+                    batch_size=1000
+                )
+            
+            fields = ('duration', 'width', 'height', 'fps', 'has_audio', 'thumbnail', 'hls_playlist', 'dash_manifest', 'trickplay_vtt')
+            for field in fields:
+                setattr(self.video, field, getattr(source, field))
+            self.video.status = 'ready'
+            self.video.processing_progress = 100
+            self.video.save(update_fields=[*fields, 'status', 'processing_progress'])
         
-        self.video.hls_playlist = f'videos/processed/{self.video.id}/master.m3u8'
-        self.video.save()
+        self.set_stage(None)
+        print(f"Video {self.video.id} reuses the outputs of video {source.id}")
+    
+    def prepare(self):
+        """Run the quick stages that every encode depends on"""
+        # Update status
+        self.video.status = 'processing'
+        self.video.processing_progress = 0
+        self.video.save(update_fields=['status', 'processing_progress'])
+        self.start_run()
+        
+        # Step 1: Extract metadata (10%)
+        self.set_stage('metadata')
+        with self.record_stage('metadata'):
+            extracted = self.extract_metadata()
+        if not extracted:
+            self.end_run('failed', self.video.error_message)
+            return False
+        self.set_progress(10, force=True)
+        
+        # Step 2: Generate thumbnail (20%)
+        self.set_stage('thumbnail')
+        self.generate_thumbnail()
+        self.set_progress(20, force=True)
         
         return True
     
+    def finish(self):
+        """Mark the video as ready once its playlists exist"""
+        self.video.status = 'ready'
+        self.video.processing_progress = 100
+        self.video.save(update_fields=['status', 'processing_progress'])
+        self.set_stage(None)
+        self.end_run('succeeded')
+    
+    def fail(self, error):
+        """Mark the video as failed"""
+        self.video.status = 'failed'
+        self.video.error_message = str(error)
+        self.video.processing_progress = 0
+        self.video.save(update_fields=['status', 'error_message', 'processing_progress'])
+        self.set_stage(None)
+        self.end_run('failed', error)
+    
     def process(self):
         """Main processing pipeline"""
         try:
-            # Update status
-            self.video.status = 'processing'
-            self.video.processing_progress = 0
-            self.video.save()
+            # Step 0: Re-uploads reuse the outputs they already have
+            duplicate = self.find_duplicate()
+            if duplicate:
+                self.link_duplicate(duplicate)
+                return True
             
-            # Step 1: Extract metadata (10%)
-            if not self.extract_metadata():
+            if not self.prepare():
                 return False
-            self.video.processing_progress = 10
-            self.video.save()
-            
-            # Step 2: Generate thumbnail (20%)
-            self.generate_thumbnail()
-            self.video.processing_progress = 20
-            self.video.save()
-            
+        except Exception as e:
+            self.fail(e)
+            return False
+        
+        return self.encode()
+    
+    def encode(self):
+        """Encode every quality and write the playlists, after prepare()"""
+        try:
             # Step 3: Create HLS streams for each quality (70%)
-            qualities = ['360p', '480p', '720p', '1080p']
-            progress_per_quality = 70 / len(qualities)
-            
-            for i, quality in enumerate(qualities):
-                if self.create_hls_stream(quality):
-                    self.video.processing_progress = 20 + int((i + 1) * progress_per_quality)
-                    self.video.save()
+            qualities = self.get_qualities()
+            self.set_stage('encoding')
             
-            # Step 4: Create master playlist (90%)
-            self.create_master_playlist()
-            self.video.processing_progress = 90
-            self.video.save()
+            if self.chunked:
+                # Parallel chunks per quality, each joined and published once complete
+                on_progress = lambda fraction: self.set_progress(20 + 70 * fraction)
+                if not self.create_hls_streams_chunked(qualities, on_progress):
+                    raise RuntimeError('HLS encoding failed')
+                self.generate_trickplay()
+                self.set_progress(90, force=True)
+            elif self.single_pass:
+                weights = self.get_progress_weights(qualities)
+                first, rest = qualities[0], qualities[1:]
+                
+                if rest and getattr(settings, 'VIDEO_PUBLISH_EARLY', True):
+                    # The cheapest rendition on its own first, so the video
+                    # plays after its encode rather than the whole ladder's.
+                    # One more decode of the source buys that.
+                    if not self.create_hls_stream(first, self.encode_progress(20, 70, weights[first])):
+                        raise RuntimeError('HLS encoding failed')
+                    self.set_progress(20 + 70 * weights[first], force=True)
+                    
+                    # One decode feeds every other quality
+                    on_progress = self.encode_progress(20 + 70 * weights[first], 70, 1 - weights[first])
+                    if not self.create_hls_streams(rest, on_progress):
+                        print(f"Video {self.video.id} stays at {first}: encoding {', '.join(rest)} failed")
+                else:
+                    # One decode feeds every quality
+                    if not self.create_hls_streams(qualities, self.encode_progress(20, 70)):
+                        raise RuntimeError('HLS encoding failed')
+                self.set_progress(90, force=True)
+            else:
+                weights = self.get_progress_weights(qualities)
+                done = 0
+                encoded = 0
+                
+                # Lowest first, each quality is published as soon as it is saved
+                for quality in qualities:
+                    on_progress = self.encode_progress(20 + 70 * done, 70, weights[quality])
+                    if self.create_hls_stream(quality, on_progress):
+                        self.set_progress(20 + 70 * (done + weights[quality]), force=True)
+                        encoded += 1
+                    done += weights[quality]
+                
+                if not encoded:
+                    raise RuntimeError('HLS encoding failed')
+                self.set_progress(90, force=True)
             
             # Done!
-            self.video.status = 'ready'
-            self.video.processing_progress = 100
-            self.video.save()
-            
+            self.finish()
             return True
             
         except Exception as e:
-            self.video.status = 'failed'
-            self.video.error_message = str(e)
-            self.video.processing_progress = 0
-            self.video.save()
-            return False
\ No newline at end of file
+            self.fail(e)
+            return False
@@ -0,0 +1,116 @@
+"""
+Buffered view counting
+
+View hits are added to a Redis hash instead of the Video row, and a
+periodic task flushes the buffered counts to Video.views in batches with
+F() updates. A hot video therefore costs one HINCRBY per view rather
+than a row lock.
+"""
+
+import redis
+from django.db import transaction
+from django.db.models import F
+
+from . import live_status
+
+PENDING_KEY = 'videos:views:pending'
+FLUSHING_KEY = 'videos:views:flushing'
+FLUSH_LOCK_KEY = 'videos:views:flush-lock'
+
+
+def record_view(video_id):
+    """
+    Count one view of a video
+
+    Returns:
+        bool: False if Redis was unavailable and nothing was buffered
+    """
+    try:
+        live_status.get_redis().hincrby(PENDING_KEY, video_id, 1)
+        return True
+    except redis.RedisError as e:
+        print(f"Buffering a view of video {video_id} failed: {e}")
+        return False
+
+
+def pending_views(video_ids):
+    """Buffered views not flushed yet, as {video_id: count}, counting a flush in progress"""
+    video_ids = list(video_ids)
+    if not video_ids:
+        return {}
+    try:
+        pipe = live_status.get_redis().pipeline()
+        pipe.hmget(PENDING_KEY, video_ids)
+        pipe.hmget(FLUSHING_KEY, video_ids)
+        pending, flushing = pipe.execute()
+    except redis.RedisError as e:
+        print(f"Reading buffered views failed: {e}")
+        return {}
+    counts = {}
+    for video_id, *buffered in zip(video_ids, pending, flushing):
+        count = sum(int(count) for count in buffered if count)
+        if count:
+            counts[video_id] = count
+    return counts
+
+
+def add_pending_views(videos):
+    """Add buffered views to serialized videos, i.e. dicts with 'id' and 'views'"""
+    pending = pending_views(video['id'] for video in videos)
+    for video in videos:
+        video['views'] += pending.get(video['id'], 0)
+    return videos
+
+
+def flush():
+    """
+    Move buffered views into Video.views
+
+    The buffer is renamed to FLUSHING_KEY first so views recorded during
+    the flush go to a fresh hash; pending_views() reads both meanwhile.
+    The flushing hash is deleted only once its counts are committed, so a
+    flush that failed or died leaves it behind and the next flush applies
+    it before taking new views. Videos with the same delta share one UPDATE.
+
+    Returns:
+        list: IDs of the videos whose counts changed
+    """
+    client = live_status.get_redis()
+    # Two flushes of the same hash would count it twice
+    lock = client.lock(FLUSH_LOCK_KEY, timeout=5 * 60)
+    if not lock.acquire(blocking=False):
+        print("Views are being flushed by another worker")
+        return []
+    try:
+        return flush_locked(client)
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            # Expired meanwhile, nothing left to release
+            pass
+
+
+def flush_locked(client):
+    """Apply the flushing hash, see flush()"""
+    from .models import Video
+
+    if not client.exists(FLUSHING_KEY):
+        try:
+            client.rename(PENDING_KEY, FLUSHING_KEY)
+        except redis.ResponseError:
+            # Nothing buffered since the last flush
+            return []
+
+    counts = {int(video_id): int(count) for video_id, count in client.hgetall(FLUSHING_KEY).items()}
+    by_delta = {}
+    for video_id, count in counts.items():
+        by_delta.setdefault(count, []).append(video_id)
+
+    # All or nothing, so a retry of the same hash never counts any twice
+    with transaction.atomic():
+        for delta, video_ids in by_delta.items():
+            Video.objects.filter(id__in=video_ids).update(views=F('views') + delta)
+    client.delete(FLUSHING_KEY)
+
+    return list(counts)
@@ -1,11 +1,25 @@
+import copy
+import mimetypes
+import os
+import re
 from django.shortcuts import render
-from rest_framework import viewsets, status
+from rest_framework import viewsets, mixins, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
-from django.http import FileResponse
-from .models import Video
-from .serializers import VideoSerializer
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.text import get_valid_filename
+from . import caching, live_status, scheduler, view_counter
+from .models import Video, VideoQuality, UploadSession, ProcessingRun
+from .pagination import VideoCursorPagination
+from .serializers import VideoSerializer, UploadSessionSerializer, ProcessingRunSerializer
+from .streaming import range_file_response
 # Create your views here.
 
 class VideoViewSet(viewsets.ModelViewSet):
@@ -13,42 +27,289 @@ class VideoViewSet(viewsets.ModelViewSet):
     
     """
     API end points
-    1. GET /api/videos/ - List all videos
+    1. GET /api/videos/ - List videos (cursor pages, ?status= and ?uploaded_by= filters)
     2. POST /api/videos/ - Upload a new video
     3. GET /api/videos/{id}/stream/ - stream video file
     4. GET /api/videos/{id} - video details
+    5. GET /api/videos/{id}/status/ - live processing status
+    6. POST /api/videos/{id}/view/ - count a view
+    7. GET /api/videos/{id}/queue/ - position in the encode queue
+    8. GET /api/videos/{id}/runs/ - processing runs with per-stage timings
 
     """
     
     queryset = Video.objects.all()
     serializer_class = VideoSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = VideoCursorPagination
+    
+    def get_queryset(self):
+        # Uploader and qualities come in two queries for the whole page,
+        # the segment index is not part of the payload so it stays in the DB
+        queryset = Video.objects.select_related('uploaded_by').prefetch_related(
+            Prefetch('qualities', queryset=VideoQuality.objects.defer('segment_index'))
+        )
+        
+        if self.action == 'list':
+            video_status = self.request.query_params.get('status')
+            if video_status:
+                queryset = queryset.filter(status=video_status)
+            uploaded_by = self.request.query_params.get('uploaded_by')
+            if uploaded_by and uploaded_by.isdigit():
+                queryset = queryset.filter(uploaded_by_id=uploaded_by)
+        return queryset
 
     def perform_upload(self, serializer):
         serializer.save(uploaded_by=self.request.user) # save video wirth logged in user
 
     @action(detail=True, methods=['get'])
     def stream(self, request, pk=None):
-        """Streams the video file."""
+        """Streams the video file, honouring Range requests for seeking."""
+        video = self.get_object()
+        if not video.original_file:
+            return Response({"detail": "Video file not found."}, status=status.HTTP_404_NOT_FOUND)
+        
         try:
-            video =self.get_object()
-            if not video.video_file:
-                return Response({"detail": "Video file not found."}, status=status.HTTP_404_NOT_FOUND)
-            
-            Video_file = video.video_file.open('rb')
-            response = FileResponse(Video_file, content_type='video/mp4')
-            response['Accept-ranges'] ='bytes'
-            return response
-        except Exception as e:
-            return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            content_type = mimetypes.guess_type(video.original_file.name)[0] or 'video/mp4'
+            return range_file_response(request, video.original_file, content_type)
+        except FileNotFoundError:
+            return Response({"detail": "Video file not found."}, status=status.HTTP_404_NOT_FOUND)
+    
+    @action(detail=True, methods=['post'])
+    def view(self, request, pk=None):
+        """Count a view. Buffered in Redis, so hot videos never lock the row."""
+        if not str(pk).isdigit() or caching.get_video_version(pk) is None:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        
+        Video(id=int(pk)).increment_views()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    @action(detail=True, methods=['get'], url_path='status')
+    def live_status(self, request, pk=None):
+        """
+        Lightweight processing status for polling.
+        
+        Served from the live status store in Redis. The database is only
+        read when nothing was published yet, e.g. for older videos.
+        """
+        if not str(pk).isdigit():
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        
+        state = live_status.read(pk)
+        if state is None:
+            video = Video.objects.filter(pk=pk).only('status', 'processing_progress', 'hls_playlist').first()
+            if video is None:
+                return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+            state = {
+                'status': video.status,
+                'percent': video.processing_progress,
+                'stage': None,
+                'eta': None,
+                'playable': video.is_playable(),
+            }
+        return Response({'id': int(pk), **state})
+    
+    @action(detail=True, methods=['get'])
+    def queue(self, request, pk=None):
+        """
+        Position of a video in the fair-share encode queue.
+        
+        position is null once the encode was handed to a worker, or if
+        the video is not waiting for one.
+        """
+        video = self.get_object()
+        return Response({
+            'id': video.id,
+            'status': video.status,
+            'position': scheduler.queue_position(video.id),
+            'waiting': scheduler.waiting_encodes().count(),
+        })
+    
+    @action(detail=True, methods=['get'])
+    def runs(self, request, pk=None):
+        """Processing runs of a video, newest first, with per-stage timings."""
+        video = self.get_object()
+        runs = ProcessingRun.objects.filter(video=video).prefetch_related('stages')[:10]
+        return Response(ProcessingRunSerializer(runs, many=True).data)
+    
+    def cached_response(self, request, key, etag, last_modified, build, videos=lambda data: [data]):
+        """
+        Answer from the payload cache, honouring If-None-Match/If-Modified-Since.
+        
+        build() serializes the payload and only runs on a cache miss.
+        videos(data) picks the video dicts out of the payload so views
+        buffered since the last flush can be added on every response.
+        """
+        not_modified = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+        
+        data = cache.get(key)
+        if data is None:
+            data = build()
+            cache.set(key, data, settings.VIDEO_CACHE_TIMEOUT)
+        
+        data = copy.deepcopy(data)
+        view_counter.add_pending_views(videos(data))
+        response = Response(data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'private, no-cache'
+        return response
     
     def list(self,request, *args, **kwargs):
-        """List all videos."""
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        """List videos, newest first, one cursor page at a time."""
+        def build():
+            queryset = self.get_queryset()
+            page = self.paginate_queryset(queryset)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data).data
+        
+        generation = caching.get_list_generation()
+        key = caching.list_key(generation, request)
+        etag = f'"list-{generation}-{key[-8:]}"'
+        return self.cached_response(
+            request, key, etag, generation / 1_000_000, build,
+            videos=lambda data: data['results']
+        )
+    
     def retrieve(self, request, *args, **kwargs):
         """Retrieve video details."""
-        instance = self.get_object()
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
\ No newline at end of file
+        pk = str(kwargs.get('pk'))
+        current = caching.get_video_version(pk) if pk.isdigit() else None
+        if current is None:
+            # Unknown id: let get_object produce the usual 404
+            self.get_object()
+        version, last_modified = current
+        
+        def build():
+            return self.get_serializer(self.get_object()).data
+        
+        key = caching.detail_key(pk, version, request)
+        etag = f'"video-{pk}-{version}"'
+        return self.cached_response(request, key, etag, last_modified, build)
+
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Resumable chunked uploads
+    1. POST /api/videos/uploads/ - start an upload session
+    2. GET /api/videos/uploads/{id}/ - bytes received so far, i.e. where to resume
+    3. PUT /api/videos/uploads/{id}/chunk/ - send bytes with a Content-Range header
+    4. POST /api/videos/uploads/{id}/complete/ - turn the finished upload into a video
+
+    """
+    
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        return UploadSession.objects.filter(uploaded_by=self.request.user)
+    
+    @action(detail=True, methods=['put'])
+    def chunk(self, request, pk=None):
+        """Append one byte range to the upload, streamed straight to disk."""
+        session = self.get_object()
+        
+        match = CONTENT_RANGE.match(request.headers.get('Content-Range', ''))
+        if not match:
+            return Response({"detail": "Content-Range: bytes start-end/total is required."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        start, end, total = map(int, match.groups())
+        if total != session.total_size or end < start or end >= total:
+            return Response({"detail": "Content-Range does not match the upload."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        length = end - start + 1
+        if length > settings.VIDEO_UPLOAD_MAX_CHUNK_SIZE:
+            return Response({"detail": "Chunk is too large."},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        # DRF has no stream at all for an empty body
+        if request.stream is None or request.headers.get('Content-Length') != str(length):
+            return Response({"detail": "Content-Length must match Content-Range."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        # One writer per session: a retried chunk waits for the first copy,
+        # then finds it counted instead of truncating bytes still being written
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update().get(pk=session.pk)
+            if session.video_id:
+                return Response({"detail": "Upload is already complete."},
+                                status=status.HTTP_409_CONFLICT)
+            if start != session.received_bytes:
+                return Response({"detail": "Chunk must start at received_bytes.",
+                                 "received_bytes": session.received_bytes},
+                                status=status.HTTP_409_CONFLICT)
+            
+            os.makedirs(os.path.dirname(session.part_path), exist_ok=True)
+            written = 0
+            with open(session.part_path, 'r+b' if os.path.exists(session.part_path) else 'wb') as f:
+                # Drop bytes of an earlier chunk that never got counted
+                f.seek(start)
+                f.truncate()
+                while written < length:
+                    data = request.stream.read(min(64 * 1024, length - written))
+                    if not data:
+                        break
+                    f.write(data)
+                    written += len(data)
+            
+            # Only count what actually arrived, a dropped connection resumes from there
+            session.received_bytes = start + written
+            session.save(update_fields=['received_bytes'])
+        
+        return Response(self.get_serializer(session).data)
+    
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        """Move the finished upload into original_file and queue processing."""
+        session = self.get_object()
+        
+        with transaction.atomic():
+            # Claim the session, so a concurrent complete waits and then finds the video
+            session = UploadSession.objects.select_for_update().get(pk=session.pk)
+            if session.video_id:
+                serializer = VideoSerializer(session.video, context={'request': request})
+                return Response(serializer.data)
+            if not session.is_complete:
+                return Response({"detail": "Upload is not complete.",
+                                 "received_bytes": session.received_bytes},
+                                status=status.HTTP_409_CONFLICT)
+            
+            # The file, not the counter, is what gets processed
+            size = os.path.getsize(session.part_path) if os.path.exists(session.part_path) else 0
+            if size != session.total_size:
+                session.received_bytes = min(size, session.total_size)
+                session.save(update_fields=['received_bytes'])
+                return Response({"detail": "Uploaded file does not match total_size, resume from received_bytes.",
+                                 "received_bytes": session.received_bytes},
+                                status=status.HTTP_409_CONFLICT)
+            
+            name = default_storage.get_available_name(
+                'videos/originals/' + get_valid_filename(os.path.basename(session.filename))
+            )
+            path = default_storage.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(session.part_path, path)
+            
+            try:
+                video = Video.objects.create(
+                    title=session.title,
+                    description=session.description,
+                    uploaded_by=session.uploaded_by,
+                    original_file=name
+                )
+                session.video = video
+                session.save(update_fields=['video'])
+            except BaseException:
+                # Leave the upload where a retried complete will find it
+                os.replace(path, session.part_path)
+                raise
+        
+        serializer = VideoSerializer(video, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)